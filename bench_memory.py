@@ -0,0 +1,46 @@
+import gc
+import tracemalloc
+
+from reg import dispatch
+from reg import match_instance
+from reg import match_key
+
+
+FUNCTIONS = 10000
+
+
+def implementation(obj, name):
+    return name
+
+
+def build(**kw):
+    functions = []
+    for i in range(FUNCTIONS):
+
+        @dispatch(match_instance("obj"), match_key("name"), **kw)
+        def view(obj, name):
+            return None
+
+        functions.append(view)
+    return functions
+
+
+def measure(**kw):
+    # build once first, so that shared code and caches exist
+    build(**kw)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    functions = build(**kw)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(functions) == FUNCTIONS
+    return (after - before) / float(FUNCTIONS)
+
+
+print("Memory per dispatch function with %d functions" % FUNCTIONS)
+print("==============================================")
+print("{0:20} {1:8.0f} bytes".format("function", measure()))
+print("{0:20} {1:8.0f} bytes".format("compact_function", measure(compact_function=True)))
+print("{0:20} {1:8.0f} bytes".format("deferred", measure(deferred=True)))
@@ -0,0 +1,96 @@
+import os
+import sys
+
+from reg import DictCachingKeyLookup
+from reg import dispatch
+from reg import match_instance
+from reg import match_key
+from reg import prefork_prepare
+
+
+WORKERS = 4
+FUNCTIONS = 100
+CLASSES = 100
+NAMES = ["view", "edit", "add", "delete", "json"]
+
+
+def implementation(obj, name):
+    return name
+
+
+def build():
+    classes = [type("Model%d" % i, (object,), {}) for i in range(CLASSES)]
+    instances = [type("Sub%d" % i, (class_,), {})() for i, class_ in enumerate(classes)]
+    functions = []
+    for i in range(FUNCTIONS):
+
+        @dispatch(match_instance("obj"), match_key("name"), get_key_lookup=DictCachingKeyLookup)
+        def view(obj, name):
+            return None
+
+        for class_ in classes:
+            for name in NAMES:
+                view.register(implementation, obj=class_, name=name)
+        functions.append(view)
+    return functions, instances
+
+
+def work(functions, instances):
+    for function in functions:
+        for instance in instances:
+            for name in NAMES:
+                function(instance, name)
+
+
+def unique_set_size():
+    # memory that is not shared with other processes, in kB
+    result = 0
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                result += int(line.split()[1])
+    return result
+
+
+def run(prepare):
+    functions, instances = build()
+    if prepare:
+        prefork_prepare()
+    sizes = []
+    for i in range(WORKERS):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            work(functions, instances)
+            os.write(write, str(unique_set_size()).encode())
+            os._exit(0)
+        os.close(write)
+        with os.fdopen(read) as f:
+            sizes.append(int(f.read()))
+        os.waitpid(pid, 0)
+    return sum(sizes) / float(len(sizes))
+
+
+def measure(prepare):
+    # measure in a fresh child, so both runs start out the same
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        os.write(write, str(run(prepare)).encode())
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        result = float(f.read())
+    os.waitpid(pid, 0)
+    return result
+
+
+if not sys.platform.startswith("linux"):
+    sys.exit("This benchmark needs /proc/self/smaps_rollup (Linux)")
+
+print("Per-worker unique memory with %d workers" % WORKERS)
+print("=========================================")
+print("{0:30} {1:8.0f} kB".format("without prefork_prepare", measure(False)))
+print("{0:30} {1:8.0f} kB".format("with prefork_prepare", measure(True)))
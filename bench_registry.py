@@ -0,0 +1,63 @@
+import timeit
+import tracemalloc
+
+from reg import BitsetPredicateRegistry
+from reg import DecisionTreePredicateRegistry
+from reg import PredicateRegistry
+from reg import match_instance
+from reg import match_key
+
+
+KEYS = ["GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS",
+        "TRACE", "CONNECT", "PROPFIND"]
+
+
+def make_classes(count):
+    classes = []
+    for i in range(count):
+        base = type("Model%d" % i, (object,), {})
+        sub = type("SubModel%d" % i, (base,), {})
+        classes.append((base, sub))
+    return classes
+
+
+def build(registry_class, classes):
+    registry = registry_class(match_instance("model"), match_key("method"))
+    for base, sub in classes:
+        for key in KEYS:
+            registry.register((base, key), "%s %s" % (base.__name__, key))
+    registry.compact()
+    return registry
+
+
+def measure_memory(registry_class, classes):
+    tracemalloc.start()
+    registry = build(registry_class, classes)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return registry, size
+
+
+def measure_lookup(registry, classes):
+    subs = [sub for base, sub in classes[:100]]
+
+    def lookup():
+        for sub in subs:
+            registry.component((sub, "POST"))
+            registry.fallback((sub, "UNKNOWN"))
+
+    return min(timeit.repeat(lookup, number=10, repeat=3)) / (10 * len(subs))
+
+
+print("Registry engine benchmark")
+print("=========================")
+
+for count in (1000, 10000, 100000):
+    classes = make_classes(count // len(KEYS))
+    print("\n%d registrations" % count)
+    for registry_class in (PredicateRegistry, BitsetPredicateRegistry,
+                           DecisionTreePredicateRegistry):
+        registry, size = measure_memory(registry_class, classes)
+        lookup = measure_lookup(registry, classes)
+        print("{0:30} {1:8.2f} MB {2:8.2f} us/lookup".format(
+            registry_class.__name__, size / 1024 / 1024, lookup * 1e6))
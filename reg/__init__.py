@@ -1,25 +1,43 @@
 from __future__ import annotations
 
 from .arginfo import arginfo
+from .cache import AdaptiveCachingKeyLookup
+from .cache import CacheManager
+from .cache import CanonicalCachingKeyLookup
 from .cache import DictCachingKeyLookup
 from .cache import LruCachingKeyLookup
+from .cache import SharedCachingKeyLookup
+from .cache import TinyLFUCache
+from .cache import TwoQueueCache
 from .context import DispatchMethod
 from .context import clean_dispatch_methods
 from .context import dispatch_method
 from .context import methodify
 
 # flake8: noqa
+from .dispatch import DeferredDispatch
 from .dispatch import Dispatch
+from .dispatch import DispatchFunction
 from .dispatch import LookupEntry
 from .dispatch import dispatch
+from .dispatch import freeze_all
+from .dispatch import prefork_prepare
+from .dispatch import retain_sources
 from .error import RegistrationError
+from .predicate import BitsetPredicateRegistry
 from .predicate import ClassIndex
+from .predicate import DecisionTreePredicateRegistry
 from .predicate import KeyIndex
+from .predicate import LazyResolver
 from .predicate import Predicate
 from .predicate import PredicateRegistry
 from .predicate import match_class
 from .predicate import match_instance
 from .predicate import match_key
+from .snapshot import load_snapshot
+from .snapshot import save_snapshot
+from .warm import KeyRecorder
+from .warm import warm_from_file
 
 
 def make_tree():
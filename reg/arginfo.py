@@ -2,6 +2,8 @@ from __future__ import annotations
 from __future__ import unicode_literals
 
 import inspect
+from types import FunctionType
+from weakref import WeakKeyDictionary
 
 class FullArgSpec(inspect.FullArgSpec):
     pass
@@ -20,37 +22,163 @@ def arginfo(callable):
     arginfo returns ``None`` if given something that is not callable.
 
     arginfo caches previous calls (except for instances with a
-    __call__), making calling it repeatedly cheap.
+    __call__), making calling it repeatedly cheap. The cache does not
+    keep functions and classes alive. It holds at most 10000 entries,
+    which ``arginfo.set_cache_size(size)`` changes, and
+    ``arginfo.cache_info()`` returns its number of hits and misses.
+
+    The arguments of Python functions and methods are read from their
+    code object, which is much faster than
+    :func:`inspect.getfullargspec`.
 
     This was originally inspired by the pytest.core varnames() function,
     but has been completely rewritten to handle class constructors,
     also show other getarginfo() information, and for readability.
     """
     try:
-        return arginfo._cache[callable]
+        return get_cached(callable)
     except KeyError:
         # Try to get __call__ function from the cache.
         try:
-            return arginfo._cache[callable.__call__]
+            return get_cached(callable.__call__)
         except (AttributeError, KeyError):
             pass
     func, cache_key, remove_self = get_callable_info(callable)
     if func is None:
         return None
-    result = inspect.getfullargspec(func)
+    result = getfullargspec(func)
     if remove_self:
         args = result.args[1:]
         result = inspect.FullArgSpec(args, result.varargs, result.varkw, result.defaults, result.kwonlyargs, result.kwonlydefaults, result.annotations)
-    arginfo._cache[cache_key] = result
+    cache, cache_key = get_cache(cache_key)
+    try:
+        cache[cache_key] = result
+    except TypeError:
+        # cannot be weakly referenced, so we do not cache
+        pass
     return result
 
+def getfullargspec(func):
+    function = func.__func__ if inspect.ismethod(func) else func
+    if type(function) is FunctionType and not hasattr(function, "__signature__"):
+        return code_arginfo(function)
+    return inspect.getfullargspec(func)
+
+
+def code_arginfo(function):
+    """Get the arguments of a Python function from its code object.
+
+    The result is the same as that of :func:`inspect.getfullargspec`,
+    which computes a :class:`inspect.Signature` first.
+    """
+    code = function.__code__
+    names = code.co_varnames
+    count = code.co_argcount
+    end = count + code.co_kwonlyargcount
+    varargs = varkw = None
+    if code.co_flags & inspect.CO_VARARGS:
+        varargs = names[end]
+        end += 1
+    if code.co_flags & inspect.CO_VARKEYWORDS:
+        varkw = names[end]
+    return inspect.FullArgSpec(list(names[:count]), varargs, varkw, function.__defaults__ or None, list(names[count : count + code.co_kwonlyargcount]), function.__kwdefaults__ or None, dict(function.__annotations__))
+
+
+class ArgInfoCache(object):
+    """A bounded cache of arginfo results.
+
+    It refers to its keys weakly, so it does not keep callables alive.
+    Once it holds ``size`` entries, adding one evicts the oldest.
+
+    :param size: the maximum number of entries.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        """Remove all entries and reset the statistics."""
+        self.data = WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, key):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        data = self.data
+        if len(data) >= self.size and key not in data:
+            # the weak references in data are in insertion order
+            try:
+                del data.data[next(iter(data.data))]
+            except (KeyError, StopIteration, RuntimeError):
+                # removed by garbage collection in the meantime
+                pass
+        data[key] = value
+
+    def __len__(self):
+        return len(self.data)
+
+
+def get_cache(callable):
+    # A bound method is created anew whenever it is accessed, so it
+    # would drop out of a weak cache right away. We cache its result
+    # for the function it binds instead.
+    if inspect.ismethod(callable):
+        return arginfo._method_cache, callable.__func__
+    return arginfo._cache, callable
+
+def get_cached(callable):
+    cache, cache_key = get_cache(callable)
+    try:
+        return cache[cache_key]
+    except TypeError:
+        raise KeyError(callable)
+
 def is_cached(callable):
-    if callable in arginfo._cache:
-        return True
-    return callable.__call__ in arginfo._cache
+    for candidate in (callable, getattr(callable, "__call__", None)):
+        try:
+            get_cached(candidate)
+            return True
+        except KeyError:
+            pass
+    return False
+
+def cache_info():
+    """The number of hits and misses of the arginfo cache.
+
+    Lookups of instances with a ``__call__`` count twice, once for the
+    instance and once for the method.
+
+    :returns: a ``(hits, misses)`` tuple.
+    """
+    caches = [arginfo._cache, arginfo._method_cache]
+    return sum(cache.hits for cache in caches), sum(cache.misses for cache in caches)
+
+
+def set_cache_size(size):
+    """Set the maximum number of entries of the arginfo caches.
+
+    This clears the caches.
+
+    :param size: the maximum number of entries.
+    """
+    arginfo.cache_size = size
+    arginfo._cache = ArgInfoCache(size)
+    arginfo._method_cache = ArgInfoCache(size)
+
 
-arginfo._cache = {}
+set_cache_size(10000)
 arginfo.is_cached = is_cached
+arginfo.cache_info = cache_info
+arginfo.set_cache_size = set_cache_size
 
 
 def get_callable_info(callable):
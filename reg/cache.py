@@ -1,6 +1,13 @@
 from __future__ import annotations
 
+from .predicate import ClassIndex
+from collections import OrderedDict
+from repoze.lru import LRUCache
 from repoze.lru import lru_cache
+from weakref import WeakKeyDictionary
+from weakref import finalize
+from weakref import ref
+import threading
 
 
 class Cache(dict):
@@ -14,6 +21,130 @@ class Cache(dict):
         return result
 
 
+class WeakKeys(object):
+    """Refer weakly to the classes in keys.
+
+    :meth:`weaken` replaces the classes in a key with weak references,
+    so that a cache keyed by the result does not keep them alive. Once
+    a class is garbage collected, ``evict`` is called for every weak
+    key that contained it and that was passed to :meth:`watch`.
+
+    A cache can also drop entries by itself. With ``live``, weak keys
+    that are no longer cached stop being watched whenever twice as
+    many are watched as after the last time, see :meth:`prune`.
+
+    :param evict: a function that takes a weak key.
+    :param live: a function that takes a weak key, and returns whether
+      it is still cached.
+    """
+
+    def __init__(self, evict, live=None):
+        self._evict = evict
+        self._live = live
+        # maps weak references with a callback to the weak keys
+        # that contain them
+        self._watched = {}
+        # the number of weak keys in _watched, and the number after
+        # which we prune
+        self._count = 0
+        self._limit = 64
+
+    def weaken(self, key):
+        """Replace the classes in key with weak references."""
+        return tuple([ref(item) if isinstance(item, type) else item for item in key])
+
+    def strengthen(self, weak_key):
+        """Get the key for a weak key.
+
+        :returns: the key, or ``None`` if one of its classes is gone.
+        """
+        key = []
+        for item in weak_key:
+            if type(item) is ref:
+                item = item()
+                if item is None:
+                    return None
+            key.append(item)
+        return tuple(key)
+
+    def watch(self, weak_key):
+        """Evict weak_key once one of its classes is garbage collected."""
+        for item in weak_key:
+            if type(item) is ref:
+                # a weak reference without callback is equal to one
+                # with a callback to the same class
+                weak_keys = self._watched.get(item)
+                if weak_keys is None:
+                    class_ = item()
+                    if class_ is None:
+                        continue
+                    weak_keys = self._watched[ref(class_, self._collected)] = set()
+                weak_keys.add(weak_key)
+                self._count += 1
+        if self._live is not None and self._count > self._limit:
+            self.prune()
+
+    def prune(self):
+        """Stop watching the weak keys that are no longer cached."""
+        live = self._live
+        count = 0
+        for reference, weak_keys in list(self._watched.items()):
+            weak_keys.difference_update([weak_key for weak_key in list(weak_keys) if not live(weak_key)])
+            if weak_keys:
+                count += len(weak_keys)
+            else:
+                self._watched.pop(reference, None)
+        self._count = count
+        self._limit = max(64, 2 * count)
+
+    def _collected(self, reference):
+        for weak_key in self._watched.pop(reference, ()):
+            self._evict(weak_key)
+
+
+class WeakCache(object):
+    """Cache a function of keys without keeping their classes alive.
+
+    This works like :class:`Cache`, but classes in keys are weakly
+    referenced. When a class is garbage collected, the entries for the
+    keys that contain it are evicted.
+
+    :param func: the function to cache, which takes a key tuple.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        # maps weak keys to results
+        self._data = {}
+        self._weak_keys = WeakKeys(self._evict, self._data.__contains__)
+
+    def __getitem__(self, key):
+        weak_key = self._weak_keys.weaken(key)
+        try:
+            return self._data[weak_key]
+        except KeyError:
+            pass
+        result = self._data[weak_key] = self.func(key)
+        self._weak_keys.watch(weak_key)
+        return result
+
+    def __iter__(self):
+        strengthen = self._weak_keys.strengthen
+        for weak_key in list(self._data):
+            key = strengthen(weak_key)
+            if key is not None:
+                yield key
+
+    def __len__(self):
+        return len(self._data)
+
+    def pop(self, key, default=None):
+        return self._data.pop(self._weak_keys.weaken(key), default)
+
+    def _evict(self, weak_key):
+        self._data.pop(weak_key, None)
+
+
 class DictCachingKeyLookup(object):
     """A key lookup that caches.
 
@@ -26,15 +157,143 @@ class DictCachingKeyLookup(object):
     predicate keys. If so, you can use
     :class:`reg.LruCachingKeyLookup` instead.
 
+    Dispatch calls only use the :meth:`resolve` cache, which stores
+    a single record per key: the implementation that is actually
+    invoked. The :meth:`component`, :meth:`fallback` and :meth:`all`
+    caches are only filled when they are used for introspection.
+
+    When an implementation is registered later, only the cache
+    entries it affects are evicted; see :meth:`invalidate`.
+
+    :param: key_lookup - the :class:`PredicateRegistry` to cache.
+    :param weak: if true, the cache does not keep the classes in keys
+      alive, and evicts their entries once they are garbage
+      collected. Use this if classes are created at runtime.
+
+    """
+
+    def __init__(self, key_lookup: "reg.PredicateRegistry", weak=False):
+        self.key_lookup = key_lookup
+        cache_class = WeakCache if weak else Cache
+        self._caches = caches = [
+            cache_class(key_lookup.resolve),
+            cache_class(key_lookup.component),
+            cache_class(key_lookup.fallback),
+            cache_class(lambda key: list(key_lookup.all(key))),
+        ]
+        self.resolve, self.component, self.fallback, self.all = [cache.__getitem__ for cache in caches]
+        key_lookup.add_listener(self.invalidate)
+
+    def invalidate(self, registered_key):
+        """Evict the cache entries affected by a registration.
+
+        The registry calls this for every new registration, so
+        implementations can be registered after lookups have been
+        cached.
+
+        :param registered_key: the key of the new registration.
+        """
+        affects = self.key_lookup.affects
+        for cache in self._caches:
+            for key in list(cache):
+                if affects(registered_key, key):
+                    cache.pop(key, None)
+
+
+class CanonicalCachingKeyLookup(object):
+    """A key lookup that caches on canonical keys.
+
+    Implements the read-only API of :class:`reg.PredicateRegistry` using
+    a cache to speed up access.
+
+    A lookup only depends on which permutations of each key item are
+    registered, such as the registered base classes of a class. Before
+    the cache is consulted, each key item is therefore replaced by a
+    canonical item with the same registered permutations, typically
+    the registered class it inherits from. Many classes created at
+    runtime then share the cache entry of their registered base class,
+    so the cache grows with the registrations rather than with the
+    classes that are dispatched on. In exchange, a cache hit costs a
+    few more dictionary lookups than with
+    :class:`reg.DictCachingKeyLookup`.
+
+    The canonical item of a class is cached per predicate, with a weak
+    reference to the class. A new registration clears these canonical
+    items, and evicts the cache entries it affects.
+
     :param: key_lookup - the :class:`PredicateRegistry` to cache.
 
     """
 
-    def __init__(self, key_lookup: "reg.PredicateRegistry"):
+    def __init__(self, key_lookup):
         self.key_lookup = key_lookup
-        self.component = Cache(key_lookup.component).__getitem__
-        self.fallback = Cache(key_lookup.fallback).__getitem__
-        self.all = Cache(lambda key: list(key_lookup.all(key))).__getitem__
+        # per index: maps classes to their canonical item
+        self._canonical_items = [WeakKeyDictionary() if isinstance(index, ClassIndex) else None for index in key_lookup.indexes]
+        # per index: maps registered permutations to the canonical item
+        self._representatives = [{} for index in key_lookup.indexes]
+        self._resolved = Cache(key_lookup.resolve)
+        self._caches = caches = [
+            self._resolved,
+            Cache(key_lookup.component),
+            Cache(key_lookup.fallback),
+            Cache(lambda key: list(key_lookup.all(key))),
+        ]
+        resolve, component, fallback, all = [cache.__getitem__ for cache in caches]
+        canonical = self.canonical
+        self.resolve = lambda key: resolve(canonical(key))
+        self.component = lambda key: component(canonical(key))
+        self.fallback = lambda key: fallback(canonical(key))
+        self.all = lambda key: all(canonical(key))
+        key_lookup.add_listener(self.invalidate)
+
+    def invalidate(self, registered_key):
+        """Evict the cache entries affected by a registration.
+
+        The registry calls this for every new registration. As the
+        registered permutations of key items may have changed, the
+        canonical items are recomputed when they are needed next.
+
+        :param registered_key: the key of the new registration.
+        """
+        for canonical_items, representatives in zip(self._canonical_items, self._representatives):
+            if canonical_items is not None:
+                canonical_items.clear()
+            representatives.clear()
+        affects = self.key_lookup.affects
+        for cache in self._caches:
+            for key in list(cache):
+                if affects(registered_key, key):
+                    cache.pop(key, None)
+
+    def canonical(self, key):
+        """Get the canonical key for a key.
+
+        :param key: a tuple, as returned by :meth:`reg.PredicateRegistry.key`.
+        :returns: a tuple with the same lookup results as ``key``.
+        """
+        result = []
+        for index, canonical_items, representatives, item in zip(self.key_lookup.indexes, self._canonical_items, self._representatives, key):
+            if canonical_items is not None:
+                try:
+                    result.append(canonical_items[item])
+                    continue
+                except KeyError:
+                    pass
+            permutations = index.registered_permutations(item)
+            try:
+                representative = representatives[permutations]
+            except KeyError:
+                # prefer a registered item, so that we do not keep
+                # classes created at runtime alive
+                if permutations and index.registered_permutations(permutations[0]) == permutations:
+                    representative = permutations[0]
+                else:
+                    representative = item
+                representatives[permutations] = representative
+            if canonical_items is not None:
+                canonical_items[item] = representative
+            result.append(representative)
+        return tuple(result)
 
 
 class LruCachingKeyLookup(object):
@@ -49,16 +308,607 @@ class LruCachingKeyLookup(object):
 
     :param: key_lookup - the :class:`PredicateRegistry` to cache.
     :param component_cache_size: how many cache entries to store for
-      the :meth:`component` method. This is also used by dispatch
-      calls.
+      the :meth:`component` method.
     :param all_cache_size: how many cache entries to store for the
       the :meth:`all` method.
     :param fallback_cache_size: how many cache entries to store for
       the :meth:`fallback` method.
+    :param resolve_cache_size: how many cache entries to store for
+      the :meth:`resolve` method, which is used by dispatch calls.
+      Defaults to ``component_cache_size``.
+    :param cache_class: the cache policy, a class that is called with
+      the size of a cache. The default is :class:`repoze.lru.LRUCache`,
+      which implements CLOCK. :class:`reg.TwoQueueCache` and
+      :class:`reg.TinyLFUCache` hold up better when rarely used keys
+      are looked up between the popular ones.
+    :param weak: if true, the cache does not keep the classes in keys
+      alive, and evicts their entries once they are garbage
+      collected.
+
+    When an implementation is registered later, only the cache
+    entries it affects are evicted; see :meth:`invalidate`.
+    """
+
+    def __init__(self, key_lookup, component_cache_size=20, all_cache_size=20, fallback_cache_size=20, resolve_cache_size=None, cache_class=LRUCache, weak=False):
+        self.key_lookup = key_lookup
+        if resolve_cache_size is None:
+            resolve_cache_size = component_cache_size
+        self._weak_keys = None
+        if weak:
+            caches = []
+
+            def evict(weak_key):
+                for cache in caches:
+                    cache.invalidate((weak_key,))
+
+            def live(weak_key):
+                # the caches are keyed by the arguments of compute
+                return any((weak_key,) in cache.data for cache in caches)
+
+            self._weak_keys = weak_keys = WeakKeys(evict, live)
+
+        def cached(size, func):
+            cache = cache_class(size)
+            if not weak:
+                return lru_cache(size, cache=cache)(func)
+            caches.append(cache)
+
+            def compute(weak_key):
+                result = func(weak_keys.strengthen(weak_key))
+                weak_keys.watch(weak_key)
+                return result
+
+            cached_compute = lru_cache(size, cache=cache)(compute)
+
+            def cached_weak(key):
+                return cached_compute(weak_keys.weaken(key))
+
+            cached_weak._cache = cache
+            return cached_weak
+
+        self.resolve = cached(resolve_cache_size, key_lookup.resolve)
+        self.component = cached(component_cache_size, key_lookup.component)
+        self.fallback = cached(fallback_cache_size, key_lookup.fallback)
+        self.all = cached(all_cache_size, lambda key: list(key_lookup.all(key)))
+        key_lookup.add_listener(self.invalidate)
+
+    def invalidate(self, registered_key):
+        """Evict the cache entries affected by a registration.
+
+        The registry calls this for every new registration, so
+        implementations can be registered after lookups have been
+        cached.
+
+        :param registered_key: the key of the new registration.
+        """
+        affects = self.key_lookup.affects
+        for cached in (self.resolve, self.component, self.fallback, self.all):
+            cache = cached._cache
+            # the cache is keyed by the arguments of the cached function
+            for args in list(cache.data):
+                key = args[0]
+                if self._weak_keys is not None:
+                    key = self._weak_keys.strengthen(key)
+                if key is None or affects(registered_key, key):
+                    cache.invalidate(args)
+
+
+class AdaptiveCachingKeyLookup(object):
+    """A key lookup that decides by itself how to cache.
+
+    Implements the read-only API of :class:`reg.PredicateRegistry`.
+    Only :meth:`resolve`, which is used by dispatch calls, is cached.
+
+    The key lookup starts without a cache, and samples the keys that
+    are looked up. If enough of the lookups in a sample repeat a key,
+    it switches to a dictionary, as :class:`reg.DictCachingKeyLookup`
+    does. If the dictionary then grows beyond ``max_size`` entries,
+    the keys keep varying, and it switches to an LRU cache, as
+    :class:`reg.LruCachingKeyLookup` does. The LRU cache is sized to
+    twice the number of distinct keys in the last sample, up to
+    ``max_size``.
+
+    This makes it a reasonable choice for all dispatch functions,
+    without tuning each of them.
+
+    :param: key_lookup - the :class:`PredicateRegistry` to cache.
+    :param sample_size: the number of lookups in a sample.
+    :param repeat_ratio: the fraction of the lookups in a sample that
+      need to repeat a key to start caching.
+    :param max_size: the number of entries after which the dictionary
+      is replaced by an LRU cache.
     """
 
-    def __init__(self, key_lookup, component_cache_size=20, all_cache_size=20, fallback_cache_size=20):
+    def __init__(self, key_lookup, sample_size=1000, repeat_ratio=0.5, max_size=10000):
         self.key_lookup = key_lookup
-        self.component = lru_cache(component_cache_size)(key_lookup.component)
-        self.fallback = lru_cache(fallback_cache_size)(key_lookup.fallback)
-        self.all = lru_cache(all_cache_size)(lambda key: list(key_lookup.all(key)))
+        self.sample_size = sample_size
+        self.repeat_ratio = repeat_ratio
+        self.max_size = max_size
+        self.component = key_lookup.component
+        self.fallback = key_lookup.fallback
+        self.all = key_lookup.all
+        #: the current mode: ``"uncached"``, ``"dict"`` or ``"lru"``.
+        self.mode = "uncached"
+        #: why the mode was switched, a message for every switch.
+        self.reasons = []
+        #: the number of distinct keys in the last sample.
+        self.working_set = 0
+        self._cache = None
+        self._start_sample()
+        key_lookup.add_listener(self.invalidate)
+
+    def resolve(self, key):
+        """Get the implementation for a key, see :meth:`reg.PredicateRegistry.resolve`."""
+        return self._resolve(key)
+
+    def _start_sample(self):
+        self._sampled = 0
+        self._sampled_keys = set()
+        self._resolve = self._sample
+
+    def _sample(self, key):
+        self._sampled += 1
+        self._sampled_keys.add(key)
+        if self._sampled >= self.sample_size:
+            self._decide()
+        return self.key_lookup.resolve(key)
+
+    def _decide(self):
+        sampled = self._sampled
+        self.working_set = len(self._sampled_keys)
+        repeated = sampled - self.working_set
+        if repeated < self.repeat_ratio * sampled:
+            # caching would not pay off yet, try again
+            self._start_sample()
+            return
+        self._sampled_keys = None
+        cache = Cache(self._miss)
+        self._switch("dict", cache, cache.__getitem__, "%d of %d sampled lookups repeated a key" % (repeated, sampled))
+
+    def _miss(self, key):
+        if len(self._cache) >= self.max_size:
+            size = max(1, min(self.max_size, 2 * self.working_set))
+            cache = LRUCache(size)
+            self._switch(
+                "lru",
+                cache,
+                lru_cache(size, cache=cache)(self.key_lookup.resolve),
+                "more than %d distinct keys, using %d entries for a working set of %d keys" % (self.max_size, size, self.working_set),
+            )
+        return self.key_lookup.resolve(key)
+
+    def _switch(self, mode, cache, resolve, reason):
+        self.mode = mode
+        self.reasons.append("%s: %s" % (mode, reason))
+        self._cache = cache
+        self._resolve = resolve
+
+    def invalidate(self, registered_key):
+        """Evict the cache entries affected by a registration.
+
+        The registry calls this for every new registration, so
+        implementations can be registered after lookups have been
+        cached.
+
+        :param registered_key: the key of the new registration.
+        """
+        affects = self.key_lookup.affects
+        cache = self._cache
+        if self.mode == "dict":
+            for key in list(cache):
+                if affects(registered_key, key):
+                    cache.pop(key, None)
+        elif self.mode == "lru":
+            for args in list(cache.data):
+                if affects(registered_key, args[0]):
+                    cache.invalidate(args)
+
+
+class TwoQueueCache(object):
+    """A cache with the 2Q replacement policy.
+
+    New keys enter a FIFO queue. They are only promoted to the main
+    LRU queue if they are requested again after having left the FIFO
+    queue, which is remembered in a queue of recently evicted keys. A
+    scan of keys that are used once therefore does not push popular
+    keys out of the cache.
+
+    This has the same API as :class:`repoze.lru.LRUCache`, so it can
+    be used as the ``cache_class`` of :class:`reg.LruCachingKeyLookup`.
+    A hit does not take a lock.
+
+    :param size: the maximum number of entries.
+    """
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("Cache size must be greater than zero")
+        self.size = size
+        self._in_size = max(1, size // 4)
+        self._out_size = max(1, size // 2)
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self.lock:
+            # maps keys to values
+            self.data = {}
+            self._in = OrderedDict()
+            self._main = OrderedDict()
+            self._out = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+            self.lookups = 0
+
+    def get(self, key, default=None):
+        """Return the value for key, or default if it is not cached."""
+        self.lookups += 1
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        try:
+            self._main.move_to_end(key)
+        except KeyError:
+            # hits in the FIFO queue do not count
+            pass
+        return value
+
+    def put(self, key, value):
+        """Add a value for key to the cache."""
+        with self.lock:
+            data = self.data
+            if key in data:
+                data[key] = value
+                return
+            if key in self._out:
+                del self._out[key]
+                self._main[key] = None
+            else:
+                self._in[key] = None
+            data[key] = value
+            while len(data) > self.size:
+                if len(self._in) > self._in_size or not self._main:
+                    evicted = self._in.popitem(last=False)[0]
+                    self._out[evicted] = None
+                    if len(self._out) > self._out_size:
+                        self._out.popitem(last=False)
+                else:
+                    evicted = self._main.popitem(last=False)[0]
+                del data[evicted]
+
+    def invalidate(self, key):
+        """Remove key from the cache."""
+        with self.lock:
+            if self.data.pop(key, _marker) is not _marker:
+                self._in.pop(key, None)
+                self._main.pop(key, None)
+
+
+class FrequencySketch(object):
+    """Estimate how often keys are used.
+
+    This is a count-min sketch with four rows of small counters. The
+    counters are halved once enough uses have been counted, so that
+    keys that were popular a long time ago are forgotten.
+
+    :param size: the number of entries of the cache the sketch is used
+      for.
+    """
+
+    def __init__(self, size):
+        width = 1
+        while width < size * 2:
+            width <<= 1
+        self._mask = width - 1
+        self._sample_size = 10 * size
+        self._rows = [bytearray(width) for seed in _sketch_seeds]
+        self._additions = 0
+
+    def _indexes(self, key):
+        h = hash(key)
+        mask = self._mask
+        return [((h ^ seed) * 0x9E3779B1 >> 16) & mask for seed in _sketch_seeds]
+
+    def increment(self, key):
+        """Count a use of key."""
+        added = False
+        for row, i in zip(self._rows, self._indexes(key)):
+            if row[i] < 15:
+                row[i] += 1
+                added = True
+        if added:
+            self._additions += 1
+            if self._additions >= self._sample_size:
+                self._age()
+
+    def frequency(self, key):
+        """Estimate how often key was used recently."""
+        return min([row[i] for row, i in zip(self._rows, self._indexes(key))])
+
+    def _age(self):
+        self._rows = [bytearray([count >> 1 for count in row]) for row in self._rows]
+        self._additions //= 2
+
+
+_sketch_seeds = (0x5BD1E995, 0x27D4EB2F, 0x165667B1, 0x61C88647)
+
+
+class TinyLFUCache(object):
+    """A cache with the W-TinyLFU replacement policy.
+
+    New keys enter a small LRU window. A key that drops out of the
+    window is only admitted to the main cache if it has been used
+    more often than the key the main cache would evict for it,
+    according to a frequency sketch that counts every lookup.
+    The main cache is a segmented LRU: keys that are hit while on
+    probation move to a protected segment. This keeps popular keys
+    cached when there are many keys that are rarely used.
+
+    This has the same API as :class:`repoze.lru.LRUCache`, so it can
+    be used as the ``cache_class`` of :class:`reg.LruCachingKeyLookup`.
+    A hit does not wait for a lock; when another thread holds it, a
+    key on probation is promoted on a later hit.
+
+    :param size: the maximum number of entries.
+    """
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("Cache size must be greater than zero")
+        self.size = size
+        self._window_size = max(1, size // 100)
+        self._main_size = size - self._window_size
+        self._protected_size = self._main_size * 4 // 5
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self.lock:
+            # maps keys to values
+            self.data = {}
+            self._window = OrderedDict()
+            self._probation = OrderedDict()
+            self._protected = OrderedDict()
+            self._sketch = FrequencySketch(self.size)
+            self.hits = 0
+            self.misses = 0
+            self.lookups = 0
+
+    def get(self, key, default=None):
+        """Return the value for key, or default if it is not cached."""
+        self.lookups += 1
+        self._sketch.increment(key)
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        for segment in (self._protected, self._window):
+            try:
+                segment.move_to_end(key)
+                return value
+            except KeyError:
+                pass
+        if self.lock.acquire(False):
+            try:
+                self._promote(key)
+            finally:
+                self.lock.release()
+        return value
+
+    def _promote(self, key):
+        if self._probation.pop(key, _marker) is _marker:
+            return
+        self._protected[key] = None
+        if len(self._protected) > self._protected_size:
+            demoted = self._protected.popitem(last=False)[0]
+            self._probation[demoted] = None
+
+    def put(self, key, value):
+        """Add a value for key to the cache."""
+        with self.lock:
+            data = self.data
+            if key in data:
+                data[key] = value
+                return
+            data[key] = value
+            self._window[key] = None
+            if len(self._window) <= self._window_size:
+                return
+            candidate = self._window.popitem(last=False)[0]
+            if len(self._probation) + len(self._protected) < self._main_size:
+                self._probation[candidate] = None
+                return
+            segment = self._probation or self._protected
+            if not segment:
+                del data[candidate]
+                return
+            victim = next(iter(segment))
+            if self._sketch.frequency(candidate) > self._sketch.frequency(victim):
+                del segment[victim]
+                del data[victim]
+                self._probation[candidate] = None
+            else:
+                del data[candidate]
+
+    def invalidate(self, key):
+        """Remove key from the cache."""
+        with self.lock:
+            if self.data.pop(key, _marker) is not _marker:
+                for segment in (self._window, self._probation, self._protected):
+                    segment.pop(key, None)
+
+
+class _CachedKeys(set):
+    # The keys a cached function has put in the cache of a manager.
+    # The cache policy evicts without telling us, so these can include
+    # keys that are no longer cached. We prune them whenever there are
+    # twice as many as after the last pruning.
+
+    limit = 16
+
+    def prune(self, token, data):
+        self.difference_update([key for key in list(self) if (token, key) not in data])
+        self.limit = max(16, 2 * len(self))
+
+
+class CacheManager(object):
+    """One cache for the key lookups of many dispatch functions.
+
+    A :class:`reg.SharedCachingKeyLookup` keeps its entries in the
+    cache of a manager. All its dispatch functions therefore share a
+    single budget. The cache policy decides which entries to evict
+    across them, so a dispatch function that is called often gets
+    more entries than one that is rarely called.
+
+    :param size: the maximum number of entries, for all key lookups
+      together.
+    :param cache_class: the cache policy; see
+      :class:`reg.LruCachingKeyLookup`. The default,
+      :class:`reg.TinyLFUCache`, evicts by both recency and frequency.
+    """
+
+    def __init__(self, size=10000, cache_class=TinyLFUCache):
+        self.cache = cache_class(size)
+        # maps the token of each cached function to its keys, so that
+        # we do not have to go through the entries of all of them
+        self._keys = {}
+
+    def cached(self, func):
+        """Cache a function in this manager.
+
+        The entries of the function are removed when it is garbage
+        collected, for instance after :meth:`reg.Dispatch.clean`
+        replaced its key lookup.
+
+        :param func: a function that takes a single hashable argument.
+        :returns: a function that returns the same results as
+          ``func``, from the cache if possible.
+        """
+        cache = self.cache
+        # the entries of func are keyed by this token, so that cached
+        # entries do not keep func alive
+        token = object()
+        keys = self._keys[token] = _CachedKeys()
+
+        def cached(key):
+            entry = (token, key)
+            value = cache.get(entry, _marker)
+            if value is _marker:
+                value = func(key)
+                cache.put(entry, value)
+                keys.add(key)
+                if len(keys) > keys.limit:
+                    keys.prune(token, cache.data)
+            return value
+
+        cached.token = token
+        finalize(cached, self._discard, token).atexit = False
+        return cached
+
+    def evict(self, cached, condition):
+        """Evict entries of a cached function.
+
+        This only goes through the entries of ``cached``.
+
+        :param cached: a function returned by :meth:`cached`.
+        :param condition: a function that is called with the
+          argument of every cached entry of ``cached``, and returns
+          ``True`` if the entry should be evicted.
+        """
+        token = cached.token
+        keys = self._keys.get(token)
+        if keys is None:
+            return
+        cache = self.cache
+        data = cache.data
+        for key in list(keys):
+            entry = (token, key)
+            if entry not in data:
+                keys.discard(key)
+            elif condition(key):
+                cache.invalidate(entry)
+                keys.discard(key)
+
+    def discard(self, cached):
+        """Remove all entries of a cached function.
+
+        Use this when ``cached`` is no longer used.
+
+        :param cached: a function returned by :meth:`cached`.
+        """
+        self._discard(cached.token)
+
+    def _discard(self, token):
+        for key in list(self._keys.pop(token, ())):
+            self.cache.invalidate((token, key))
+
+    def clear(self):
+        """Remove all entries, for all key lookups."""
+        self.cache.clear()
+        for keys in list(self._keys.values()):
+            keys.clear()
+
+
+class SharedCachingKeyLookup(object):
+    """A key lookup that caches in a shared :class:`reg.CacheManager`.
+
+    Implements the read-only API of :class:`reg.PredicateRegistry` using
+    a cache to speed up access.
+
+    Unlike :class:`reg.DictCachingKeyLookup` and
+    :class:`reg.LruCachingKeyLookup`, the size of the cache is not
+    configured per dispatch function. The entries of all key lookups
+    that use the same manager are limited together, and a dispatch
+    function that is called often automatically gets more of them.
+    By default, the process-wide manager ``reg.cache.default_cache_manager``
+    is used.
+
+    :param: key_lookup - the :class:`PredicateRegistry` to cache.
+    :param manager: the :class:`reg.CacheManager` to use.
+    """
+
+    def __init__(self, key_lookup, manager=None):
+        if manager is None:
+            manager = default_cache_manager
+        self.key_lookup = key_lookup
+        self.manager = manager
+        self.resolve = manager.cached(key_lookup.resolve)
+        self.component = manager.cached(key_lookup.component)
+        self.fallback = manager.cached(key_lookup.fallback)
+        self.all = manager.cached(lambda key: list(key_lookup.all(key)))
+        key_lookup.add_listener(self.invalidate)
+
+    def discard(self):
+        """Remove the entries of this key lookup from the manager.
+
+        This happens by itself when the key lookup is garbage
+        collected.
+        """
+        for cached in (self.resolve, self.component, self.fallback, self.all):
+            self.manager.discard(cached)
+
+    def invalidate(self, registered_key):
+        """Evict the cache entries affected by a registration.
+
+        The registry calls this for every new registration, so
+        implementations can be registered after lookups have been
+        cached.
+
+        :param registered_key: the key of the new registration.
+        """
+        affects = self.key_lookup.affects
+        for cached in (self.resolve, self.component, self.fallback, self.all):
+            self.manager.evict(cached, lambda key: affects(registered_key, key))
+
+
+_marker = object()
+
+# used by SharedCachingKeyLookup unless another manager is given
+default_cache_manager = CacheManager()
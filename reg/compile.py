@@ -0,0 +1,250 @@
+"""Compile dispatch functions ahead of time into a Python module.
+
+Usage::
+
+  python -m reg.compile package.module [package.other] [-o output.py]
+
+This imports the given modules, which should register all
+implementations, and writes a module with a plain Python function for
+every dispatch function it finds. Such a function looks up the
+implementation in a precomputed dictionary, so importing the
+generated module does not compile code or build indexes. Keys that
+are not in the dictionary are dispatched by the original dispatch
+function, which is only imported when this first happens.
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import sys
+from .arginfo import arginfo
+from .context import DispatchMethod
+from .dispatch import _dispatches
+from .dispatch import _materialize_all
+from .dispatch import format_signature
+from .warm import dotted_name
+from .warm import resolve_dotted_name
+
+HEADER = '''\
+# Generated by reg.compile from: {modules}
+# Do not edit; generate it again when registrations change.
+import importlib
+
+
+def _import(name):
+    module_name, qualname = name.split(":")
+    obj = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+'''
+
+
+class CompileError(Exception):
+    """A dispatch function cannot be compiled."""
+
+
+class ModuleWriter(object):
+    """Collect the source of a generated module."""
+
+    def __init__(self):
+        self.lines = []
+        # maps objects to the names under which they are imported
+        self._names = {}
+
+    def reference(self, obj):
+        """The name of an importable object in the generated module.
+
+        Implementations that are imported when first called, such as
+        those of a snapshot, are imported by their name.
+
+        :raises CompileError: if the object cannot be imported.
+        """
+        try:
+            return self._names[obj]
+        except (KeyError, TypeError):
+            pass
+        name = getattr(obj, "snapshot_name", None)
+        if name is not None:
+            importable = True
+        else:
+            try:
+                name = dotted_name(obj)
+                importable = resolve_dotted_name(name) is obj
+            except (AttributeError, ImportError, ValueError):
+                importable = False
+        if not importable:
+            raise CompileError("Cannot be imported: %r" % (obj,))
+        reference = self._names[obj] = "_imported_%d" % len(self._names)
+        self.lines.append("{} = _import({!r})".format(reference, name))
+        return reference
+
+    def literal(self, value):
+        """Source for a key item.
+
+        :raises CompileError: if the key item cannot be written.
+        """
+        if isinstance(value, type):
+            return self.reference(value)
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return repr(value)
+        raise CompileError("Cannot write key item: %r" % (value,))
+
+
+def top_package(class_):
+    return class_.__module__.split(".")[0]
+
+
+def function_name(name):
+    return name.replace(".", "_").replace(":", "__")
+
+
+def compile_dispatch(dispatch, writer, number, packages=()):
+    """Write the source of a compiled dispatch function.
+
+    The table has the registered classes, and those of their
+    subclasses that are in the same top-level package as they are, or
+    in ``packages``. Other subclasses, such as those the standard
+    library derives from builtins, are dispatched by the original
+    dispatch function, so that the generated module does not import
+    them.
+
+    :param dispatch: the :class:`reg.Dispatch` to compile.
+    :param writer: the :class:`ModuleWriter`.
+    :param number: a number that is unique for the dispatch function.
+    :param packages: the names of top-level packages whose subclasses
+      are in the table.
+    :returns: the name of the generated function.
+    :raises CompileError: if the dispatch function cannot be compiled.
+    """
+    name = dotted_name(dispatch.wrapped_func)
+    if isinstance(dispatch, DispatchMethod):
+        # there is one for every class, all with the same name
+        raise CompileError("Dispatch methods cannot be compiled: %s" % name)
+    if "<locals>" in name:
+        raise CompileError("Dispatch function cannot be imported: %s" % name)
+    args = arginfo(dispatch.wrapped_func)
+    signature = format_signature(args)
+    expressions = []
+    for i, predicate in enumerate(dispatch.predicates):
+        func_name = None
+        if predicate.func is not None:
+            func_name = writer.reference(predicate.func)
+        expression = predicate.key_expression(args.args, func_name)
+        if expression is None:
+            raise CompileError("Predicate key cannot be inlined: %s" % predicate.name)
+        expressions.append(expression)
+    parameters = args.args
+    if args.defaults:
+        defaults = [writer.literal(default) for default in args.defaults]
+        parameters = parameters[: -len(defaults)] + ["{}={}".format(arg, default) for arg, default in zip(parameters[-len(defaults) :], defaults)]
+    parameters = ", ".join(parameters + (["*" + args.varargs] if args.varargs else []) + (["**" + args.varkw] if args.varkw else []))
+
+    # classes registered for by name are in the table as well
+    dispatch.import_pending()
+    entries = []
+    resolve = dispatch.registry.resolve
+    indexes = dispatch.registry.indexes
+    packages = set(packages)
+    for index in indexes:
+        packages.update(top_package(item) for item in index if isinstance(item, type))
+    for key in dispatch._known_keys():
+        if not all(item in index or not isinstance(item, type) or top_package(item) in packages for item, index in zip(key, indexes)):
+            # a subclass from elsewhere
+            continue
+        implementation = resolve(key)
+        if implementation is None:
+            # the original dispatch function calls its wrapped function
+            continue
+        try:
+            reference = writer.reference(implementation)
+            entries.append("    ({},): {},".format(", ".join(writer.literal(item) for item in key), reference))
+        except CompileError:
+            # dispatched by the original dispatch function
+            continue
+    table = "_table_%d" % number
+    dynamic = "_dynamic_%d" % number
+    function = function_name(name)
+    key_source = "({},)".format(", ".join(expressions)) if expressions else "()"
+    writer.lines.extend(
+        [
+            "",
+            "{} = {{".format(table),
+        ]
+        + sorted(entries)
+        + [
+            "}",
+            "",
+            "",
+            "def {}({}):".format(dynamic, signature),
+            "    return _import({!r})({})".format(name, signature),
+            "",
+            "",
+            "def {}({}):".format(function, parameters),
+            "    try:",
+            "        _implementation = {}[{}]".format(table, key_source),
+            "    except KeyError:",
+            "        _implementation = {}".format(dynamic),
+            "    return _implementation({})".format(signature),
+            "",
+        ]
+    )
+    return function
+
+
+def compile_modules(modules, err=None):
+    """Import modules and compile all dispatch functions.
+
+    :param modules: a list of module names.
+    :param err: a file to report dispatch functions that cannot be
+      compiled to, by default ``sys.stderr``.
+    :returns: the source of the generated module.
+    """
+    if err is None:
+        err = sys.stderr
+    for module in modules:
+        importlib.import_module(module)
+    # deferred dispatch functions are compiled as well
+    _materialize_all()
+    writer = ModuleWriter()
+    writer.lines.append(HEADER.format(modules=", ".join(modules)))
+    functions = []
+    packages = {module.split(".")[0] for module in modules}
+    dispatches = sorted(_dispatches, key=lambda dispatch: dotted_name(dispatch.wrapped_func))
+    for dispatch in dispatches:
+        name = dotted_name(dispatch.wrapped_func)
+        start = len(writer.lines)
+        names = dict(writer._names)
+        try:
+            # numbered by the compiled dispatch functions only, so that
+            # others that come and go do not change the output
+            functions.append((name, compile_dispatch(dispatch, writer, len(functions), packages)))
+        except CompileError as e:
+            # forget the imports we drop, so others write them again
+            del writer.lines[start:]
+            writer._names = names
+            err.write("Skipping {}: {}\n".format(name, e))
+    writer.lines.append("")
+    writer.lines.append("dispatch_functions = {")
+    writer.lines.extend("    {!r}: {},".format(name, function) for name, function in functions)
+    writer.lines.append("}")
+    return "\n".join(writer.lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m reg.compile", description="Compile dispatch functions into a Python module.")
+    parser.add_argument("modules", nargs="+", help="modules that register the implementations")
+    parser.add_argument("-o", "--output", help="the file to write to, by default standard output")
+    options = parser.parse_args(argv)
+    source = compile_modules(options.modules)
+    if options.output is None:
+        sys.stdout.write(source)
+    else:
+        with open(options.output, "w") as f:
+            f.write(source)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
@@ -8,6 +8,7 @@ from .dispatch import dispatch
 from .dispatch import execute
 from .dispatch import format_signature
 from types import MethodType
+from weakref import WeakKeyDictionary
 
 
 def _invocation(x):
@@ -31,6 +32,13 @@ class dispatch_method(dispatch):
       you can return a caching key lookup (such as
       :class:`reg.DictCachingKeyLookup` or
       :class:`reg.LruCachingKeyLookup`) to make it more efficient.
+    :param inline_cache_after: optional number of calls after which
+      the dispatch specializes itself, see :class:`reg.Dispatch`.
+    :param inline_cache_size: the number of keys to specialize for.
+    :param registry_class: the class of the registry that stores the
+      implementations, :class:`reg.PredicateRegistry` by default.
+    :param lazy_predicates: if true, evaluate predicates lazily, see
+      :class:`reg.Dispatch`.
     :param first_invocation_hook: a callable that accepts an instance of the
       class in which this decorator is used. It is invoked the first
       time the method is invoked.
@@ -39,7 +47,11 @@ class dispatch_method(dispatch):
     def __init__(self, *predicates, **kw):
         self.first_invocation_hook = kw.pop("first_invocation_hook", _invocation)
         super().__init__(*predicates, **kw)
-        self._cache = {}
+        if self.deferred or self.compact_function:
+            # dispatch methods are already created when first accessed
+            raise TypeError("dispatch_method does not support deferred or compact_function")
+        # classes created at runtime should not be kept alive by this
+        self._cache = WeakKeyDictionary()
 
     def __call__(self, callable):
         self.callable = callable
@@ -50,12 +62,14 @@ class dispatch_method(dispatch):
         # this guarantees that we distinguish between dispatches
         # on a per class basis, and on the name of the method
 
+        if type is None:
+            type = obj.__class__
         dispatch = self._cache.get(type)
 
         if dispatch is None:
             # if this is the first time we access the dispatch method,
             # we create it and store it in the cache
-            dispatch = DispatchMethod(self.predicates, self.callable, self.get_key_lookup).call
+            dispatch = DispatchMethod(self.predicates, self.callable, self.get_key_lookup, self.inline_cache_after, self.inline_cache_size, self.registry_class, self.lazy_predicates).call
             self._cache[type] = dispatch
 
         # we cannot attach the dispatch method to the class
@@ -86,6 +100,19 @@ class DispatchMethod(Dispatch):
         """
         return super(DispatchMethod, self).by_args(None, *args, **kw)
 
+    def record(self, recorder):
+        """Not supported for dispatch methods.
+
+        Every class has its own dispatch method, but they all have the
+        name of the method, so their keys cannot be told apart in a
+        :class:`reg.KeyRecorder`.
+
+        :raises TypeError: unless ``recorder`` is ``None``.
+        """
+        if recorder is not None:
+            raise TypeError("Keys of dispatch methods cannot be recorded: %s" % self.wrapped_func.__qualname__)
+        super(DispatchMethod, self).record(recorder)
+
 
 def methodify(func, selfname=None):
     """Turn a function into a method, if needed.
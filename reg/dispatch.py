@@ -3,11 +3,30 @@ from __future__ import unicode_literals
 
 from .arginfo import arginfo
 from .error import RegistrationError
+from .predicate import ClassIndex
+from .predicate import DecisionTreePredicateRegistry
+from .predicate import LazyResolver
 from .predicate import PredicateRegistry
 from .predicate import match_instance
+from .warm import dotted_name
+from .warm import resolve_dotted_name
+from collections import Counter
 from collections import namedtuple
+from contextlib import contextmanager
 from functools import partial
 from functools import wraps
+from itertools import product
+import builtins
+import gc
+import sys
+import threading
+from types import FunctionType
+from weakref import WeakSet
+
+# all dispatch functions, for freeze_all
+_dispatches = WeakSet()
+# deferred dispatch functions that have not been created yet
+_deferred = WeakSet()
 
 
 class dispatch(object):
@@ -28,6 +47,20 @@ class dispatch(object):
       you can return a caching key lookup (such as
       :class:`reg.DictCachingKeyLookup` or
       :class:`reg.LruCachingKeyLookup`) to make it more efficient.
+    :param inline_cache_after: optional number of calls after which
+      the dispatch function specializes itself for the keys it has
+      seen most. See :class:`reg.Dispatch`.
+    :param inline_cache_size: the number of keys to specialize for.
+    :param registry_class: the class of the registry that stores the
+      implementations, :class:`reg.PredicateRegistry` by default.
+    :param lazy_predicates: if true, evaluate predicates lazily. See
+      :class:`reg.Dispatch`.
+    :param deferred: if true, return a lightweight stand-in that only
+      creates the :class:`reg.Dispatch` when it is first called or one
+      of its methods is first used. See :class:`reg.DeferredDispatch`.
+    :param compact_function: if true, return a
+      :class:`reg.DispatchFunction` instead of a function, which takes
+      less memory. This cannot be combined with ``deferred``.
     :returns: a function that you can use as if it were a
       :class:`reg.Dispatch` instance.
 
@@ -36,6 +69,14 @@ class dispatch(object):
     def __init__(self, *predicates, **kw):
         self.predicates = [self._make_predicate(predicate) for predicate in predicates]
         self.get_key_lookup = kw.pop("get_key_lookup", identity)
+        self.inline_cache_after = kw.pop("inline_cache_after", None)
+        self.inline_cache_size = kw.pop("inline_cache_size", 3)
+        self.registry_class = kw.pop("registry_class", PredicateRegistry)
+        self.lazy_predicates = kw.pop("lazy_predicates", False)
+        self.deferred = kw.pop("deferred", False)
+        self.compact_function = kw.pop("compact_function", False)
+        if self.deferred and self.compact_function:
+            raise ValueError("A dispatch function cannot be both deferred and compact")
 
     def _make_predicate(self, predicate):
         if isinstance(predicate, str):
@@ -43,7 +84,12 @@ class dispatch(object):
         return predicate
 
     def __call__(self, callable):
-        return Dispatch(self.predicates, callable, self.get_key_lookup).call
+        args = (self.predicates, callable, self.get_key_lookup, self.inline_cache_after, self.inline_cache_size, self.registry_class, self.lazy_predicates)
+        if self.deferred:
+            return DeferredDispatch(Dispatch, args).call
+        if self.compact_function:
+            return DispatchFunction(Dispatch(*args, compact_function=True))
+        return Dispatch(*args).call
 
 
 def identity(registry):
@@ -94,73 +140,252 @@ class Dispatch(object):
       you can return a caching key lookup (such as
       :class:`reg.DictCachingKeyLookup` or
       :class:`reg.LruCachingKeyLookup`) to make it more efficient.
+    :param inline_cache_after: optional number of calls after which
+      the dispatch function regenerates its code with an inline cache:
+      it then first tests whether the arguments match one of the keys
+      it has seen most, and if so invokes its implementation directly.
+      Other keys are looked up as usual. Registering an implementation
+      or changing the predicates reverts to the generic code, which
+      starts counting again. By default there is no inline cache.
+    :param inline_cache_size: the number of keys in the inline cache.
+    :param registry_class: the class of the registry that stores the
+      implementations. Besides :class:`reg.PredicateRegistry` you can
+      use :class:`reg.BitsetPredicateRegistry`, which is more
+      efficient with many registrations, or
+      :class:`reg.DecisionTreePredicateRegistry`.
+    :param lazy_predicates: if true, a call does not compute all
+      predicates up front. Predicates are evaluated one at a time,
+      most selective first, until the outcome is known; see
+      :class:`reg.LazyResolver`. This helps when some predicates are
+      expensive to compute. The inline cache is not used in this mode.
+    :param call: optional function object to turn into the dispatch
+      function, instead of creating a new one. Its code and globals are
+      replaced. This is used by :class:`reg.DeferredDispatch`.
+    :param compact_function: if true, the methods of this class are not
+      copied onto :attr:`call`. This is used by
+      :class:`reg.DispatchFunction`.
     """
 
-    def __init__(self, predicates, callable, get_key_lookup):
+    def __init__(self, predicates, callable, get_key_lookup, inline_cache_after=None, inline_cache_size=3, registry_class=PredicateRegistry, lazy_predicates=False, call=None, compact_function=False):
         self.wrapped_func = callable
+        self._compact_function = compact_function
         self.get_key_lookup = get_key_lookup
+        self.inline_cache_after = inline_cache_after
+        self.inline_cache_size = inline_cache_size
+        self.registry_class = registry_class
+        self.lazy_predicates = lazy_predicates
         self._original_predicates = predicates
-        self._define_call()
+        self._recorder = None
+        self._frozen = False
+        self._frozen_table = None
+        # registrations collected by bulk
+        self._bulk = None
+        self._define_call(call)
         self._register_predicates(predicates)
+        _dispatches.add(self)
 
     def _register_predicates(self, predicates):
-        self.registry = PredicateRegistry(*predicates)
         self.predicates = predicates
-        self.call.key_lookup = self.key_lookup = self.get_key_lookup(self.registry)
-        self.call.__globals__.update(
-            _registry_key=self.registry.key,
-            _component_lookup=self.key_lookup.component,
-            _fallback_lookup=self.key_lookup.fallback,
-        )
-        self._predicate_key.__globals__.update(
-            _registry_key=self.registry.key,
-            _return_type=partial(LookupEntry, self.key_lookup),
-        )
-
-    def _define_call(self):
+        # registrations by dotted name whose classes are not imported
+        # yet: pending keys map the predicate keys, with names for
+        # classes, to implementations, and pending names map class
+        # names to the pending keys they occur in. Pending keys with
+        # names for all classes are kept to find duplicates when they
+        # are registered, rather than when a call imports them.
+        self._pending_keys = {}
+        self._pending_names = {}
+        self._pending_normalized = set()
+        self._set_registry(self.registry_class(*predicates))
+
+    def _set_registry(self, registry):
+        self.registry = registry
+        # the positions of the class predicates in a key
+        self._class_positions = [i for i, index in enumerate(registry.indexes) if isinstance(index, ClassIndex)]
+        self.key_lookup = self.get_key_lookup(registry)
+        if not self._compact_function:
+            self.call.key_lookup = self.key_lookup
+        self._update_call()
+
+    def _define_call(self, call=None):
         # We build the generic function on the fly. Its definition
         # requires the signature of the wrapped function and the
         # arguments needed by the registered predicates
-        # (predicate_args):
-        code_template = """\
-def call({signature}):
-    _key = _registry_key({predicate_args})
-    return (_component_lookup(_key) or
-            _fallback_lookup(_key) or
-            _fallback)({signature})
-"""
-
+        # (predicate_args). Its body depends on the predicates and
+        # is filled in by _update_call.
         args = arginfo(self.wrapped_func)
-        signature = format_signature(args)
-        predicate_args = ", ".join("{0}={0}".format(x) for x in args.args)
-        code_source = code_template.format(signature=signature, predicate_args=predicate_args)
+        self._argnames = args.args
+        self._signature = format_signature(args)
+        self._predicate_args = ", ".join("{0}={0}".format(x) for x in args.args)
+        code_source = "def call({signature}):\n    pass\n".format(signature=self._signature)
 
         # We now compile call to byte-code:
-        self.call = call = wraps(self.wrapped_func)(execute(code_source, _registry_key=None, _component_lookup=None, _fallback_lookup=None, _fallback=self.wrapped_func)["call"])
+        namespace = execute(code_source, _fallback=self.wrapped_func)
+        if call is None and self._compact_function:
+            # the function gets no attributes, so it has no __dict__
+            call = namespace.pop("call")
+            call.__name__ = self.wrapped_func.__name__
+            call.__qualname__ = self.wrapped_func.__qualname__
+        elif call is None:
+            call = wraps(self.wrapped_func)(namespace.pop("call"))
+        else:
+            # we take over an existing function object, so that
+            # references to it become references to the dispatch
+            # function
+            call.__code__ = namespace.pop("call").__code__
+            call.__globals__.update(namespace)
+        self.call = call
 
         # We copy over the defaults from the wrapped function.
         call.__defaults__ = args.defaults
 
-        # Make the methods available as attributes of call
-        for k in dir(type(self)):
-            if not k.startswith("_"):
-                setattr(call, k, getattr(self, k))
-        call.wrapped_func = self.wrapped_func
+        if not self._compact_function:
+            # Make the methods available as attributes of call
+            for k in dir(type(self)):
+                if not k.startswith("_"):
+                    setattr(call, k, getattr(self, k))
+            call.wrapped_func = self.wrapped_func
+
+    def _key_expressions(self):
+        """Source of the expressions that compute the dispatch key.
+
+        If all predicates support it, the key expressions of the
+        predicates are inlined so that no keyword dictionary needs to
+        be built during a call. Otherwise we fall back on
+        :meth:`reg.PredicateRegistry.key`.
+
+        :returns: a tuple with a list of expressions, one per
+          predicate, or ``None`` if they cannot be inlined, and the
+          namespace the expressions need.
+        """
+        namespace = {}
+        expressions = []
+        for i, predicate in enumerate(self.predicates):
+            func_name = "_key_func_%d" % i
+            expression = predicate.key_expression(self._argnames, func_name)
+            if expression is None:
+                return None, {}
+            namespace[func_name] = predicate.func
+            expressions.append(expression)
+        return expressions, namespace
+
+    def _key_source(self):
+        # The key expressions, the source that computes the dispatch
+        # key, and the namespace it needs.
+        expressions, namespace = self._key_expressions()
+        namespace.update(_registry_key=self.registry.key)
+        if expressions is None:
+            key_source = "_registry_key({})".format(self._predicate_args)
+        else:
+            key_source = "({},)".format(", ".join(expressions)) if expressions else "()"
+        return expressions, key_source, namespace
 
-        # We now build the implementation for the predicate_key method
-        self._predicate_key = execute(
-            "def predicate_key({signature}):\n" "    return _return_type(_registry_key({predicate_args}))".format(signature=format_signature(args), predicate_args=predicate_args),
-            _registry_key=None,
-            _return_type=None,
-        )["predicate_key"]
+    def _update_call(self, inline_cache=()):
+        """Regenerate the body of call.
+
+        The function object is kept, so that references to it remain
+        valid; only its code and globals are replaced.
+
+        :param inline_cache: a sequence of ``(key, implementation)``
+          tuples. The call tests for these keys first and invokes the
+          implementation directly, before it does a generic lookup.
+        """
+        expressions, key_source, namespace = self._key_source()
+        resolve = resolver(self.key_lookup)
+        if self._recorder is not None:
+            resolve = self._recorder.recording(self, resolve)
+        if self._pending_keys:
+            resolve = self._pending_resolver(resolve)
+        if self._frozen_table is not None:
+            self._lazy_resolver = None
+            namespace.update(_frozen_table=self._frozen_table)
+            lines = [
+                "def call({}):".format(self._signature),
+                "    _key = {}".format(key_source),
+                "    try:",
+                "        _implementation = _frozen_table[_key]",
+                "    except KeyError:",
+                "        _implementation = _resolve(_key) or _fallback",
+                "    return _implementation({})".format(self._signature),
+            ]
+            inline_cache = ()
+        elif self.lazy_predicates:
+            self._lazy_resolver = LazyResolver(self.registry, resolve)
+            namespace.update(_lazy_resolve=self._lazy_resolver.resolve)
+            lines = ["def call({}):".format(self._signature), "    return (_lazy_resolve({}) or _fallback)({})".format(self._predicate_args, self._signature)]
+            inline_cache = ()
+        else:
+            self._lazy_resolver = None
+            lines = self._call_lines(expressions, key_source, inline_cache, namespace)
+        self._inline_cache = inline_cache
+        self._observed = Counter()
+        self._observations = 0
+
+        call_namespace = execute("\n".join(lines) + "\n", **namespace)
+        self.call.__code__ = call_namespace.pop("call").__code__
+        self.call.__globals__.update(call_namespace, _resolve=resolve, _observe=self._observe)
+        # generated by by_args when it is first needed
+        self._predicate_key = None
+
+    def _call_lines(self, expressions, key_source, inline_cache, namespace):
+        # The source lines of call, which computes the key and then
+        # tests it against the inline cache, if any, before it does a
+        # generic lookup. Adds the objects it refers to to namespace.
+        lines = ["def call({}):".format(self._signature)]
+        if inline_cache and expressions:
+            # we compute the key items once, so the guards can test them
+            # without building the key tuple
+            names = ["_key_item_%d" % i for i in range(len(expressions))]
+            lines.extend("    {} = {}".format(name, expression) for name, expression in zip(names, expressions))
+        else:
+            names = None
+            lines.append("    _key = {}".format(key_source))
+        for i, (key, implementation) in enumerate(inline_cache):
+            namespace["_implementation_%d" % i] = implementation
+            if names is None:
+                namespace["_guard_%d" % i] = key
+                conditions = ["_key == _guard_%d" % i] if key else []
+            else:
+                conditions = []
+                for j, (name, value) in enumerate(zip(names, key)):
+                    namespace["_guard_%d_%d" % (i, j)] = value
+                    # classes are compared by identity, like dict
+                    # lookups of classes effectively do
+                    operator = "is" if isinstance(value, type) else "=="
+                    conditions.append("{} {} _guard_{}_{}".format(name, operator, i, j))
+            if not conditions:
+                # without predicates there is only a single key
+                lines.append("    return _implementation_{}({})".format(i, self._signature))
+                break
+            lines.append("    if {}:".format(" and ".join(conditions)))
+            lines.append("        return _implementation_{}({})".format(i, self._signature))
+        else:
+            if names is not None:
+                lines.append("    _key = ({},)".format(", ".join(names)))
+            if self.inline_cache_after is not None and not inline_cache:
+                lines.append("    _observe(_key)")
+            lines.append("    return (_resolve(_key) or _fallback)({})".format(self._signature))
+        return lines
+
+    def _observe(self, key):
+        # Count the keys the generic call sees. Once we have seen
+        # enough calls, we regenerate call with an inline cache for
+        # the most common ones.
+        self._observed[key] += 1
+        self._observations += 1
+        if self._observations >= self.inline_cache_after:
+            resolve = resolver(self.key_lookup)
+            self._update_call([(key, resolve(key) or self.wrapped_func) for key, count in self._observed.most_common(self.inline_cache_size)])
 
     def clean(self):
         """Clean up implementations and added predicates.
 
         This restores the dispatch function to its original state,
         removing registered implementations and predicates added
-        using :meth:`reg.Dispatch.add_predicates`.
+        using :meth:`reg.Dispatch.add_predicates`. A frozen dispatch
+        function is thawed.
         """
+        self._frozen = False
+        self._frozen_table = None
         self._register_predicates(self._original_predicates)
 
     def add_predicates(self, predicates):
@@ -173,6 +398,7 @@ def call({signature}):
 
         :param predicates: a list of predicates to add.
         """
+        self._check_not_frozen()
         self._register_predicates(self.predicates + predicates)
 
     def register(self, func=None, **key_dict):
@@ -182,22 +408,348 @@ def call({signature}):
         decorator and the decorated function will be used as the
         actual ``func`` argument.
 
+        Instead of importing the implementation and the classes to
+        register it for, you can give their dotted names, such as
+        ``"pkg.views:document_get"`` for ``document_get`` in the module
+        ``pkg.views``. The implementation is then only imported when it
+        is first called, without validating its signature. A
+        registration for a class name is made once the class is
+        imported: when a call has a key with the class or one of its
+        subclasses, or when :meth:`import_pending` is called. Until
+        then, only calls see it; :meth:`by_args` and
+        :meth:`by_predicates` do not. Names are only imported by calls
+        when predicates are not evaluated lazily. Registering for the
+        same classes again, by name or not, raises
+        :exc:`reg.RegistrationError` right away.
+
         :param func: a function that implements behavior for this
           dispatch function. It needs to have the same signature as
           the original dispatch function. If this is a
           :class:`reg.DispatchMethod`, then this means it needs to
-          take a first context argument.
+          take a first context argument. This can also be the dotted
+          name of the function.
         :param key_dict: keyword arguments describing the registration,
           with as keys predicate name and as values predicate values.
+          For class predicates the value can be a dotted name.
         :returns: ``func``.
         """
         if func is None:
             return partial(self.register, **key_dict)
+        self._check_not_frozen()
+        if self._bulk is not None:
+            self._bulk.append((func, key_dict))
+            return func
+        if self._by_name(func, key_dict):
+            self._register_by_name(func, key_dict)
+            return func
         validate_signature(func, self.wrapped_func)
         predicate_key = self.registry.key_dict_to_predicate_key(key_dict)
+        self._check_not_pending(predicate_key)
         self.registry.register(predicate_key, func)
+        self._registrations_changed()
         return func
 
+    def register_many(self, registrations):
+        """Register many implementations at once.
+
+        This is faster than calling :meth:`register` for each of them.
+        The signature of each distinct implementation is validated
+        once, and the registry adds all registrations in a single
+        pass. If one of them is invalid, none are registered.
+
+        :param registrations: an iterable of ``(func, key_dict)``
+          tuples, with ``func`` and ``key_dict`` as for :meth:`register`.
+        """
+        self._check_not_frozen()
+        plain, by_name = [], []
+        for func, key_dict in registrations:
+            (by_name if self._by_name(func, key_dict) else plain).append((func, key_dict))
+        validated = set()
+        for func, key_dict in plain:
+            if id(func) not in validated:
+                validate_signature(func, self.wrapped_func)
+                validated.add(id(func))
+        key_dict_to_predicate_key = self.registry.key_dict_to_predicate_key
+        keys = [(key_dict_to_predicate_key(key_dict), func) for func, key_dict in plain]
+        pending = []
+        for func, key_dict in by_name:
+            name_key, func, names = self._prepare_by_name(func, key_dict)
+            if names is None:
+                keys.append((self._import_key(name_key), func))
+            else:
+                pending.append((name_key, func, names))
+        # check all keys before registering any: the registry checks
+        # the others among themselves
+        normalized = set()
+        for name_key, func, names in pending:
+            key = self._normalize_key(name_key)
+            if key in normalized or key in self._pending_normalized:
+                raise RegistrationError("Already have registration for key: %s" % (name_key,))
+            normalized.add(key)
+        if normalized:
+            for key, func in keys:
+                if self._normalize_key(key) in normalized:
+                    raise RegistrationError("Already have registration for key: %s" % (key,))
+        self._register_keys(keys)
+        for name_key, func, names in pending:
+            self._add_pending(name_key, func, names)
+
+    @contextmanager
+    def bulk(self):
+        """Collect registrations and make them all at once.
+
+        Use this as a context manager::
+
+          with dispatch_function.bulk():
+              dispatch_function.register(view, obj=Document)
+              ...
+
+        Within the block, :meth:`register` only records its arguments.
+        When the block ends they are registered with
+        :meth:`register_many`, so that is where errors are raised.
+        Until then, calls do not see the new implementations. If the
+        block raises an exception, nothing is registered. Nested blocks
+        register when the outermost block ends.
+        """
+        if self._bulk is not None:
+            yield
+            return
+        self._bulk = registrations = []
+        try:
+            yield
+        finally:
+            self._bulk = None
+        self.register_many(registrations)
+
+    def _by_name(self, func, key_dict):
+        # whether a registration uses dotted names
+        if _is_dotted_name(func):
+            return True
+        return any(_is_dotted_name(key_dict.get(self.predicates[i].name)) for i in self._class_positions)
+
+    def _register_by_name(self, func, key_dict):
+        name_key, func, names = self._prepare_by_name(func, key_dict)
+        if names is None:
+            key = self._import_key(name_key)
+            self._check_not_pending(key)
+            self.registry.register(key, func)
+            self._registrations_changed()
+            return
+        if self._normalize_key(name_key) in self._pending_normalized:
+            raise RegistrationError("Already have registration for key: %s" % (name_key,))
+        self._add_pending(name_key, func, names)
+
+    def _prepare_by_name(self, func, key_dict):
+        # The key with names, the implementation, and the class names
+        # that are not imported yet, or None if they all are.
+        name_key = self.registry.key_dict_to_predicate_key(key_dict)
+        if _is_dotted_name(func):
+            implementation = _imported(func)
+            if implementation is None:
+                func = lazy_implementation_factory(self._signature)(func)
+            else:
+                func = implementation
+                validate_signature(func, self.wrapped_func)
+        names = [name_key[i] for i in self._class_positions if _is_dotted_name(name_key[i])]
+        if all(_imported(name) is not None for name in names):
+            names = None
+        return name_key, func, names
+
+    def _add_pending(self, name_key, func, names):
+        had_pending = bool(self._pending_keys)
+        self._pending_keys[name_key] = func
+        self._pending_normalized.add(self._normalize_key(name_key))
+        for name in names:
+            self._pending_names.setdefault(name, []).append(name_key)
+        if not had_pending:
+            # calls now check for the pending classes
+            self._update_call()
+
+    def _normalize_key(self, key):
+        # the key with names for all classes
+        key = list(key)
+        for i in self._class_positions:
+            if isinstance(key[i], type):
+                key[i] = dotted_name(key[i])
+        return tuple(key)
+
+    def _check_not_pending(self, key):
+        if self._pending_normalized and self._normalize_key(key) in self._pending_normalized:
+            raise RegistrationError("Already have registration for key: %s" % (key,))
+
+    def _import_key(self, name_key):
+        # the key with the classes for their names
+        key = list(name_key)
+        for i in self._class_positions:
+            if _is_dotted_name(key[i]):
+                key[i] = resolve_dotted_name(key[i])
+        return tuple(key)
+
+    def _import_name(self, name):
+        # import a class name and make the registrations for it
+        registrations = []
+        for name_key in self._pending_names.pop(name, ()):
+            func = self._pending_keys.pop(name_key, None)
+            if func is not None:
+                self._pending_normalized.discard(self._normalize_key(name_key))
+                # the other names in this key are imported as well
+                registrations.append((self._import_key(name_key), func))
+        if registrations:
+            self._register_keys(registrations)
+
+    def _pending_resolver(self, resolve):
+        # Wrap resolve so that it first imports the class names that
+        # the classes in the key, or their bases, have.
+        positions = self._class_positions
+        seen = WeakSet()
+
+        def resolve_pending(key):
+            if self._pending_keys:
+                for i in positions:
+                    class_ = key[i]
+                    if class_ not in seen:
+                        seen.add(class_)
+                        for base in class_.__mro__:
+                            name = dotted_name(base)
+                            if name in self._pending_names:
+                                self._import_name(name)
+            return resolve(key)
+
+        return resolve_pending
+
+    def import_pending(self):
+        """Import all classes registered for by dotted name.
+
+        This makes the registrations that wait for their classes to be
+        imported. Implementations registered by name are still only
+        imported when they are first called.
+        """
+        for name in list(self._pending_names):
+            self._import_name(name)
+
+    def _register_keys(self, registrations):
+        # Register (predicate key, implementation) tuples without
+        # validating the implementations.
+        self._check_not_frozen()
+        if self._pending_normalized:
+            registrations = list(registrations)
+            for key, func in registrations:
+                self._check_not_pending(key)
+        self.registry.register_many(registrations)
+        self._registrations_changed()
+
+    def _registrations_changed(self):
+        if self._inline_cache:
+            self._update_call()
+        if self._lazy_resolver is not None:
+            self._lazy_resolver.reset()
+
+    def compile(self):
+        """Compile the registrations into a decision tree.
+
+        This switches to a :class:`reg.DecisionTreePredicateRegistry`
+        with the current registrations. Implementations registered
+        later are added to the tree as well. Calls dispatch to the
+        same implementations as before.
+        """
+        self.registry_class = DecisionTreePredicateRegistry
+        registry = DecisionTreePredicateRegistry(*self.predicates)
+        registry.register_many(self.registry.known_keys.items())
+        self._set_registry(registry)
+
+    def compact(self):
+        """Optimize the registry for lookups.
+
+        Call this once registration is done, typically at the end of
+        application startup. What this does depends on the registry
+        class; see :meth:`reg.BitsetPredicateRegistry.compact`.
+        """
+        self.registry.compact()
+
+    def freeze(self, max_size=10000):
+        """Freeze the registrations.
+
+        Call this once registration is done, if no implementations are
+        registered later. The implementation to call is then computed
+        in advance for all combinations of registered key items,
+        including the subclasses of registered classes that exist at
+        this point. A call only looks up its key in this table. Keys
+        that are not in it, such as those of subclasses created later,
+        are looked up as before, and are not added to it.
+
+        The number of combinations is the product of the number of key
+        items for each predicate, so it can be large. If it is more
+        than ``max_size``, no table is computed and calls look up
+        their keys as before.
+
+        After this, :meth:`register` and :meth:`add_predicates` raise
+        :exc:`reg.RegistrationError`. :meth:`clean` thaws the
+        dispatch function. Classes registered for by dotted name are
+        imported first, see :meth:`import_pending`.
+
+        :param max_size: the largest number of keys to compute the
+          implementation for in advance.
+        """
+        self.import_pending()
+        self._frozen = True
+        key_items = self._known_key_items()
+        size = 1
+        for items in key_items:
+            size *= len(items)
+        if size <= max_size:
+            resolve = self.registry.resolve
+            self._frozen_table = {key: resolve(key) or self.wrapped_func for key in product(*key_items)}
+        self._update_call()
+
+    def _known_keys(self):
+        # All combinations of registered key items, including the
+        # existing subclasses of registered classes.
+        return product(*self._known_key_items())
+
+    def _known_key_items(self):
+        # The registered key items for each predicate, including the
+        # existing subclasses of registered classes.
+        key_items = []
+        for index in self.registry.indexes:
+            items = set(index)
+            if isinstance(index, ClassIndex):
+                # None is there for registrations that leave the
+                # predicate out, but calls always have a class
+                items = {class_ for class_ in items if isinstance(class_, type)}
+                for class_ in list(items):
+                    # every class is a subclass of object, and lookups
+                    # for them are added as they come
+                    if not index.matches_everything(class_):
+                        items.update(subclasses(class_))
+            key_items.append(items)
+        return key_items
+
+    def _check_not_frozen(self):
+        if self._frozen:
+            raise RegistrationError("Dispatch function is frozen: %s" % self.wrapped_func.__name__)
+
+    def warm(self, keys):
+        """Look up keys in advance, so that their lookups are cached.
+
+        Use this with a caching key lookup, so that the first calls
+        after startup do not pay for the lookups.
+
+        :param keys: an iterable of dispatch keys, as returned by
+          :meth:`reg.PredicateRegistry.key`.
+        """
+        resolve = resolver(self.key_lookup)
+        for key in keys:
+            resolve(key)
+
+    def record(self, recorder):
+        """Record the keys that calls look up.
+
+        :param recorder: a :class:`reg.KeyRecorder`, or ``None`` to stop
+          recording.
+        """
+        self._recorder = recorder
+        self._update_call()
+
     def by_args(self, *args, **kw):
         """Lookup an implementation by invocation arguments.
 
@@ -205,6 +757,10 @@ def call({signature}):
         :param kw: named arguments used in invocation.
         :returns: a :class:`reg.LookupEntry`.
         """
+        if self._predicate_key is None:
+            expressions, key_source, namespace = self._key_source()
+            code_source = "def predicate_key({signature}):\n    return _return_type({key})\n".format(signature=self._signature, key=key_source)
+            self._predicate_key = execute(code_source, _return_type=partial(LookupEntry, self.key_lookup), **namespace)["predicate_key"]
         return self._predicate_key(*args, **kw)
 
     def by_predicates(self, **predicate_values):
@@ -216,6 +772,228 @@ def call({signature}):
         return LookupEntry(self.key_lookup, self.registry.key_dict_to_predicate_key(predicate_values))
 
 
+class DispatchFunction(object):
+    """A compact dispatch function.
+
+    A dispatch function is normally a Python function with the methods
+    of its :class:`reg.Dispatch` copied onto it as attributes, which
+    takes memory for every dispatch function. With
+    ``compact_function=True``, :class:`reg.dispatch` returns an
+    instance of this class instead, which only has a few slots. Its
+    attributes, such as ``register``, ``by_args`` or ``key_lookup``,
+    are looked up on the :class:`reg.Dispatch` when they are used.
+    ``__doc__`` and ``__module__`` are those of the wrapped function.
+
+    Calling it is a little slower than calling a function, and unlike a
+    function it does not become a method when it is assigned to a class.
+
+    :param dispatch: the :class:`reg.Dispatch`.
+    """
+
+    __slots__ = ("__call__", "__wrapped__", "dispatch", "__weakref__")
+
+    def __init__(self, dispatch):
+        # a __call__ slot is called like a method: the generated
+        # function is invoked without a frame in between
+        self.__call__ = dispatch.call
+        self.__wrapped__ = dispatch.wrapped_func
+        self.dispatch = dispatch
+
+    def __getattr__(self, name):
+        if name in DispatchFunction.__slots__:
+            raise AttributeError(name)
+        if name.startswith("__"):
+            # such as __name__ and __qualname__
+            return getattr(self.__wrapped__, name)
+        return getattr(self.dispatch, name)
+
+    def __repr__(self):
+        return "<dispatch function {}>".format(self.__wrapped__.__qualname__)
+
+
+class _WrappedAttribute(str):
+    # A class attribute of DispatchFunction that is itself for the
+    # class, and that of the wrapped function for instances. These
+    # are found on the class, so __getattr__ does not see them.
+
+    def __new__(cls, name, value):
+        self = str.__new__(cls, value)
+        self.name = name
+        return self
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        return getattr(obj.__wrapped__, self.name)
+
+
+DispatchFunction.__doc__ = _WrappedAttribute("__doc__", DispatchFunction.__doc__)
+DispatchFunction.__module__ = _WrappedAttribute("__module__", DispatchFunction.__module__)
+
+
+def _deferred_call(*args, **kw):
+    # The code of a deferred dispatch function until it is created.
+    # Each stand-in has its own globals with _materialize.
+    return _materialize()(*args, **kw)
+
+
+# the public methods of dispatch classes, by class
+_public_methods = {}
+_materialize_lock = threading.RLock()
+
+
+class DeferredDispatch(object):
+    """Create a dispatch function when it is first used.
+
+    Creating a :class:`reg.Dispatch` inspects the signature of the
+    function, generates code for it and sets up a registry. A module
+    that defines many dispatch functions pays for this at import time,
+    even when most of them are never used. With ``deferred=True``,
+    :class:`reg.dispatch` returns the :attr:`call` of this class
+    instead: a function that does none of this until it is called or
+    one of the :class:`reg.Dispatch` methods on it is used, such as
+    ``register``.
+
+    The :class:`reg.Dispatch` then takes over the function object of
+    the stand-in, so it remains valid. Attributes other than methods,
+    such as ``key_lookup``, only exist once the dispatch function has
+    been created.
+
+    :param dispatch_class: the class to create, such as
+      :class:`reg.Dispatch`.
+    :param args: the positional arguments to create it with.
+    """
+
+    def __init__(self, dispatch_class, args):
+        self.dispatch_class = dispatch_class
+        self.args = args
+        self.dispatch = None
+        callable = args[1]
+        #: The stand-in, which becomes the dispatch function.
+        self.call = call = wraps(callable)(FunctionType(_deferred_call.__code__, {"__builtins__": builtins, "_materialize": self.materialize}))
+        methods = _public_methods.get(dispatch_class)
+        if methods is None:
+            methods = _public_methods[dispatch_class] = [k for k in dir(dispatch_class) if not k.startswith("_")]
+        for k in methods:
+            setattr(call, k, partial(self._method, k))
+        call.wrapped_func = callable
+        _deferred.add(self)
+
+    def materialize(self):
+        """Create the dispatch function, if that has not happened yet.
+
+        :returns: the dispatch function, which is :attr:`call`.
+        """
+        with _materialize_lock:
+            if self.dispatch is None:
+                self.dispatch = self.dispatch_class(*self.args, call=self.call)
+                _deferred.discard(self)
+        return self.call
+
+    def _method(self, *args, **kw):
+        # materializing replaces this by the method of the dispatch;
+        # the method name is not a keyword, as predicates can be
+        # called name
+        return getattr(self.materialize(), args[0])(*args[1:], **kw)
+
+
+def freeze_all(max_size=10000):
+    """Freeze all dispatch functions.
+
+    Call this once the application has registered all implementations.
+    See :meth:`reg.Dispatch.freeze`. Dispatch methods are frozen for
+    the classes on which they have been accessed so far. Deferred
+    dispatch functions are created first.
+
+    :param max_size: passed to :meth:`reg.Dispatch.freeze`.
+    """
+    _materialize_all()
+    for dispatch in list(_dispatches):
+        dispatch.freeze(max_size)
+
+
+def prefork_prepare(freeze=True, max_size=10000, deferred=False):
+    """Prepare all dispatch functions before forking worker processes.
+
+    This freezes all dispatch functions, see :func:`reg.freeze_all`,
+    so that the implementations for all known keys are looked up once
+    in the parent process, and compacts their registries. It then
+    moves all objects into the permanent generation of the garbage
+    collector with :func:`gc.freeze`, so that garbage collection in
+    the workers does not write to them. The workers then share the
+    memory pages with the dispatch state of the parent, instead of
+    each building and copying their own.
+
+    This has a cost: freezing looks up every combination of key items
+    of every dispatch function in the parent, up to ``max_size`` per
+    dispatch function, and the objects moved by :func:`gc.freeze`,
+    garbage or not, are never collected. Deferred dispatch functions
+    that have not been used are left alone by default, as creating
+    them is what they avoid.
+
+    Call this in the parent process, after registration is done and
+    right before forking.
+
+    :param freeze: if false, dispatch functions are only compacted,
+      and registering in the workers remains possible.
+    :param max_size: passed to :meth:`reg.Dispatch.freeze`.
+    :param deferred: if true, deferred dispatch functions are created
+      first, so that they are prepared as well.
+    """
+    if deferred:
+        _materialize_all()
+    for dispatch in list(_dispatches):
+        if freeze:
+            dispatch.freeze(max_size)
+        dispatch.compact()
+    gc.collect()
+    gc.freeze()
+
+
+def _get_dispatch(dispatch_function):
+    """The :class:`reg.Dispatch` of a dispatch function.
+
+    A deferred dispatch function is created first.
+    """
+    register = dispatch_function.register
+    if isinstance(register, partial):
+        # a deferred stand-in, see DeferredDispatch._method
+        register.func.__self__.materialize()
+        register = dispatch_function.register
+    return register.__self__
+
+
+def _materialize_all():
+    for deferred in list(_deferred):
+        deferred.materialize()
+
+
+def subclasses(class_):
+    """All subclasses of a class that exist now, recursively."""
+    result = set()
+    todo = [class_]
+    while todo:
+        for subclass in type.__subclasses__(todo.pop()):
+            if subclass not in result:
+                result.add(subclass)
+                todo.append(subclass)
+    return result
+
+
+def resolver(key_lookup):
+    """Get the resolve function of a key lookup.
+
+    Key lookups that predate :meth:`reg.PredicateRegistry.resolve`
+    only implement ``component`` and ``fallback``; we combine those.
+    """
+    try:
+        return key_lookup.resolve
+    except AttributeError:
+        component = key_lookup.component
+        fallback = key_lookup.fallback
+        return lambda key: component(key) or fallback(key)
+
+
 def validate_signature(f, dispatch):
     f_arginfo = arginfo(f)
     if f_arginfo is None:
@@ -228,6 +1006,44 @@ def format_signature(args):
     return ", ".join(args.args + (["*" + args.varargs] if args.varargs else []) + (["**" + args.varkw] if args.varkw else []))
 
 
+def lazy_implementation_factory(signature):
+    """Make a factory for implementations that are imported when called.
+
+    :param signature: the signature of the implementations.
+    :returns: a function that takes the name of an implementation, as
+      given by :func:`reg.warm.dotted_name`, and returns a function with
+      the given signature. The first call to that function imports the
+      implementation, and every call calls it.
+    """
+    code_source = (
+        "def make_implementation(_snapshot_name):\n"
+        "    _target = []\n"
+        "    def implementation({signature}):\n"
+        "        if not _target:\n"
+        "            _target.append(_resolve_dotted_name(_snapshot_name))\n"
+        "        return _target[0]({signature})\n"
+        "    implementation.snapshot_name = _snapshot_name\n"
+        "    return implementation\n"
+    ).format(signature=signature)
+    return execute(code_source, _resolve_dotted_name=resolve_dotted_name)["make_implementation"]
+
+
+def _is_dotted_name(value):
+    return isinstance(value, str) and ":" in value
+
+
+def _imported(name):
+    # The object with a dotted name if its module has been imported,
+    # otherwise None.
+    if name.split(":")[0] not in sys.modules:
+        return None
+    try:
+        return resolve_dotted_name(name)
+    except AttributeError:
+        # the module is still being imported
+        return None
+
+
 def same_signature(a, b):
     """Check whether a arginfo and b arginfo are the same signature.
 
@@ -239,10 +1055,40 @@ def same_signature(a, b):
     return len(a_args) == len(b_args) and a.varargs == b.varargs and a.varkw == b.varkw
 
 
+# compiled code objects, by source
+_code_cache = {}
+_retain_sources = True
+
+
+def retain_sources(retain):
+    """Set whether generated code keeps its source.
+
+    By default the source of generated code is kept in the
+    ``__source__`` list of its globals and in the file name of its code
+    object, to help debugging. Turn this off in production, where many
+    dispatch functions are created, so that only the shared code
+    objects remain.
+
+    :param retain: a boolean.
+    """
+    global _retain_sources
+    _retain_sources = retain
+
+
 def execute(code_source, **namespace):
-    """Execute code in a namespace, returning the namespace."""
-    code_object = compile(code_source, "<generated code: {}>".format(code_source), "exec")
+    """Execute code in a namespace, returning the namespace.
+
+    Code is compiled only once per source, so functions generated with
+    the same source share a code object and only get their own
+    namespace as globals.
+    """
+    code_object = _code_cache.get(code_source)
+    if code_object is None:
+        filename = "<generated code: {}>".format(code_source) if _retain_sources else "<generated code>"
+        code_object = _code_cache[code_source] = compile(code_source, filename, "exec")
     exec(code_object, namespace)
+    if not _retain_sources:
+        return namespace
     try:
         namespace.setdefault("__source__", []).append(code_source[:])
     except AttributeError:
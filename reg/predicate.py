@@ -5,6 +5,7 @@ from .error import RegistrationError
 from boltons.setutils import IndexedSet
 from itertools import product
 from operator import itemgetter
+from weakref import WeakKeyDictionary
 
 try:
     from hypothesis.internal.reflection import nicerepr
@@ -29,15 +30,25 @@ class Predicate(object):
     :param default: default expected value of the predicate, to be
       used by :meth:`reg.Dispatch.register` whenever the expected
       value for the predicate is not given explicitly.
+    :param key_template: optional template of a Python expression
+      computing the same key as ``get_key``, used by
+      :class:`reg.Dispatch` to inline key extraction into the
+      generated dispatch code. ``{name}`` is replaced by the predicate
+      name, ``{func}`` by the name under which ``func`` is available
+      and ``{args}`` by the keyword arguments of the generic function.
+    :param func: optional callable referred to by ``{func}`` in
+      ``key_template``.
 
     """
 
-    def __init__(self, name, index, get_key=None, fallback=None, default=None):
+    def __init__(self, name, index, get_key=None, fallback=None, default=None, key_template=None, func=None):
         self.name = name
         self.index = index
         self.fallback = fallback
         self.get_key = get_key
         self.default = default
+        self.key_template = key_template
+        self.func = func
 
     def create_index(self):
         return self.index(self.fallback)
@@ -45,6 +56,21 @@ class Predicate(object):
     def key_by_predicate_name(self, d):
         return d.get(self.name, self.default)
 
+    def key_expression(self, argnames, func_name):
+        """Python expression computing the key from the arguments.
+
+        :param argnames: the names of the arguments of the generic function.
+        :param func_name: the name under which ``func`` is available
+          to the expression.
+        :returns: the source of the expression, or ``None`` if the key
+          cannot be computed inline.
+        """
+        if self.key_template is None:
+            return None
+        if self.func is None and self.name not in argnames:
+            return None
+        return self.key_template.format(name=self.name, func=func_name, args=", ".join("{0}={0}".format(x) for x in argnames))
+
     def __repr__(self):
         clsname = type(self).__name__
         kwarg_items = ((k, v) for k, v in self.__dict__.items() if v is not None)
@@ -71,12 +97,15 @@ def match_key(name, func=None, fallback=None, default=None):
     """
     if func is None:
         get_key = itemgetter(name)
+        key_template = "{name}"
     else:
 
         def get_key(d):
             return func(**d)
 
-    return Predicate(name, KeyIndex, get_key, fallback, default)
+        key_template = "{func}({args})"
+
+    return Predicate(name, KeyIndex, get_key, fallback, default, key_template, func)
 
 
 def match_instance(name, func=None, fallback=None, default=None):
@@ -98,12 +127,15 @@ def match_instance(name, func=None, fallback=None, default=None):
         def get_key(d):
             return d[name].__class__
 
+        key_template = "{name}.__class__"
     else:
 
         def get_key(d):
             return func(**d).__class__
 
-    return Predicate(name, ClassIndex, get_key, fallback, default)
+        key_template = "{func}({args}).__class__"
+
+    return Predicate(name, ClassIndex, get_key, fallback, default, key_template, func)
 
 
 def match_class(name, func=None, fallback=None, default=None):
@@ -122,12 +154,15 @@ def match_class(name, func=None, fallback=None, default=None):
     """
     if func is None:
         get_key = itemgetter(name)
+        key_template = "{name}"
     else:
 
         def get_key(d):
             return func(**d)
 
-    return Predicate(name, ClassIndex, get_key, fallback, default)
+        key_template = "{func}({args})"
+
+    return Predicate(name, ClassIndex, get_key, fallback, default, key_template, func)
 
 
 _emptyset = frozenset()
@@ -147,8 +182,43 @@ class KeyIndex(dict):
         """
         yield key
 
+    def registered_permutations(self, key):
+        """Permutations for key that are keys of this index.
+
+        :returns: a tuple with the permutations in the order of
+          :meth:`permutations`.
+        """
+        return (key,) if key in self else ()
+
+    def matches_everything(self, key):
+        """Whether a registration for key matches all keys."""
+        return False
+
 
 class ClassIndex(KeyIndex):
+    def __init__(self, fallback=None):
+        super(ClassIndex, self).__init__(fallback)
+        self._registered_mro = WeakKeyDictionary()
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._forget_subclasses(key)
+        super(ClassIndex, self).__setitem__(key, value)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._forget_subclasses(key)
+        return super(ClassIndex, self).setdefault(key, default)
+
+    def _forget_subclasses(self, class_):
+        # a new key only changes the registered permutations of its
+        # subclasses; a key that is not a class, such as None for a
+        # predicate left out of a registration, has none
+        if not isinstance(class_, type):
+            return
+        for cls in [cls for cls in self._registered_mro.keys() if issubclass(cls, class_)]:
+            del self._registered_mro[cls]
+
     def permutations(self, key):
         """Permutations for class key.
 
@@ -161,13 +231,40 @@ class ClassIndex(KeyIndex):
         if class_ is not object:
             yield object  # pragma: no cover
 
+    def registered_permutations(self, key):
+        """Permutations for class key that are keys of this index.
+
+        The result is cached per class, and the cache only holds weak
+        references to classes. Adding a key to the index updates the
+        cache for its subclasses.
+
+        :returns: a tuple with the base classes of key that are keys
+          of this index, in mro order.
+        """
+        try:
+            return self._registered_mro[key]
+        except KeyError:
+            result = self._registered_mro[key] = tuple([class_ for class_ in self.permutations(key) if class_ in self])
+            return result
+
+    def matches_everything(self, key):
+        """Whether a registration for key matches all keys.
+
+        This is the case for ``object``, which every class inherits from.
+        """
+        return key is object
+
 
 class PredicateRegistry(object):
     def __init__(self, *predicates):
-        self.known_keys = IndexedSet()
+        # maps registered keys to their values
+        self.known_keys = {}
         self.known_values = IndexedSet()
         self.predicates = predicates
         self.indexes = [predicate.create_index() for predicate in predicates]
+        # incremented for every registration
+        self.generation = 0
+        self._listeners = []
         self._key_getters = key_getters = [p.get_key for p in predicates]
         if len(predicates) == 0:
             self.key = lambda **kw: ()
@@ -184,13 +281,96 @@ class PredicateRegistry(object):
             self.key = lambda **kw: tuple([p(kw) for p in key_getters])
 
     def register(self, key, value):
+        """Register a value for a key.
+
+        :param key: a tuple with a key item for each predicate.
+        :param value: the value to register, typically a function.
+        """
         if key in self.known_keys:
             raise RegistrationError("Already have registration for key: %s" % (key,))
+        self._add(key, value)
+        self._registered(key)
+
+    def _add(self, key, value):
         for index, key_item in zip(self.indexes, key):
             index.setdefault(key_item, IndexedSet()).add(value)
-        self.known_keys.add(key)
+        self.known_keys[key] = value
         self.known_values.add(value)
 
+    def register_many(self, registrations):
+        """Register many values at once.
+
+        This is the same as calling :meth:`register` for each of the
+        registrations, but faster. All keys are checked first, so if
+        one of them is already registered, nothing is registered.
+
+        :param registrations: an iterable of ``(key, value)`` tuples.
+        """
+        registrations = list(registrations)
+        keys = set()
+        for key, value in registrations:
+            if key in self.known_keys or key in keys:
+                raise RegistrationError("Already have registration for key: %s" % (key,))
+            keys.add(key)
+        self._register_many(registrations)
+        for key, value in registrations:
+            self._registered(key)
+
+    def _register_many(self, registrations):
+        # we collect the values of every index entry first, so that
+        # each entry is created or updated only once
+        entries = [{} for index in self.indexes]
+        for key, value in registrations:
+            for entry, key_item in zip(entries, key):
+                entry.setdefault(key_item, []).append(value)
+            self.known_keys[key] = value
+        self.known_values.update(value for key, value in registrations)
+        for index, entry in zip(self.indexes, entries):
+            for key_item, values in entry.items():
+                if key_item in index:
+                    index[key_item].update(values)
+                else:
+                    index[key_item] = IndexedSet(values)
+
+    def add_listener(self, listener):
+        """Call a function for every new registration.
+
+        Caching key lookups use this to evict the cache entries that a
+        registration affects.
+
+        :param listener: a function that is called with the key of
+          every registration made after this.
+        """
+        self._listeners.append(listener)
+
+    def _registered(self, key):
+        self.generation += 1
+        for listener in self._listeners:
+            listener(key)
+
+    def affects(self, registered_key, key):
+        """Whether a registration can change the lookups for a key.
+
+        The lookups for a key only depend on the registrations for the
+        permutations of its key items, such as their base classes. A
+        registration therefore affects the key if any of its key items
+        is a registered permutation of the corresponding key item.
+        This includes registrations that do not match the key
+        completely, as they can still change which fallback applies.
+
+        :param registered_key: the key of a registration.
+        :param key: the key of a lookup.
+        :returns: ``True`` if the registration can change the result
+          of :meth:`component`, :meth:`fallback`, :meth:`all` or
+          :meth:`resolve` for ``key``.
+        """
+        if not self.indexes:
+            return True
+        for index, registered_item, key_item in zip(self.indexes, registered_key, key):
+            if registered_item in index.registered_permutations(key_item):
+                return True
+        return False
+
     def get(self, keys):
         # do an intersection of all sets that result from index lookup
         # this code is a bit convoluted for performance reasons.
@@ -225,29 +405,469 @@ class PredicateRegistry(object):
         """
         return tuple([p.key_by_predicate_name(d) for p in self.predicates])
 
+    def compact(self):
+        """Optimize the registry for lookups once registration is done.
+
+        This does nothing for this registry. Registration can continue
+        after compacting.
+        """
+
     def component(self, keys):
         return next(self.all(keys), None)
 
+    def resolve(self, keys):
+        """Find the implementation a dispatch call with these keys invokes.
+
+        :param keys: a tuple, as returned by :meth:`key`.
+        :returns: the component if there is one, otherwise the fallback.
+          If neither exists ``None`` is returned, and the dispatch
+          function itself is invoked.
+        """
+        return self.component(keys) or self.fallback(keys)
+
     def fallback(self, keys):
         result = None
         for index, key in zip(self.indexes, keys):
-            for k in index.permutations(key):
-                match = index[k]
-                if match:
-                    break
-            else:
+            permutations = index.registered_permutations(key)
+            if not permutations:
                 # no matching permutation for this key, so this is the fallback
                 return index.fallback
-            if result is None:
-                result = match
+            match = self._match(index, permutations[0])
+            if result is not None:
+                match = self._narrow(result, match)
+                # as soon as the intersection becomes empty, we have a
+                # failed match
+                if match is None:
+                    return index.fallback
+            result = match
+
+    def all(self, key):
+        """Iterate over all values that match the key.
+
+        Values are produced in order of precedence: the order of the
+        key combinations produced by :meth:`permutations`. Instead of
+        looking up every combination, we search depth-first, one
+        predicate at a time. As soon as the values matching the key
+        items chosen so far run out, all combinations that start with
+        these key items are skipped.
+
+        :param key: a tuple, as returned by :meth:`key`.
+        :returns: an iterator over the matching values.
+        """
+        if not self.indexes:
+            return iter(self.get(()))
+        return self._search(key, 0, None)
+
+    def _search(self, key, level, entry):
+        index = self.indexes[level]
+        last = level == len(self.indexes) - 1
+        for k in index.registered_permutations(key[level]):
+            match = self._match(index, k)
+            if entry is not None:
+                match = self._narrow(entry, match)
+                if match is None:
+                    continue
+            if last:
+                yield from self._values(match)
             else:
-                result = result.intersection(match)
-            # as soon as the intersection becomes empty, we have a failed
-            # match
-            if not result:
+                yield from self._search(key, level + 1, match)
+
+    def _match(self, index, key):
+        # the index entry for key, or None if nothing is registered for it
+        return index[key] or None
+
+    def _narrow(self, entry, match):
+        # the intersection of two index entries, or None if it is empty
+        return entry.intersection(match) or None
+
+    def _values(self, entry):
+        return entry
+
+
+class BitsetPredicateRegistry(PredicateRegistry):
+    """A predicate registry that stores index entries as bitmasks.
+
+    Each registered value gets an integer id, and an index entry is an
+    ``(offset, mask)`` tuple: bit ``i`` of the ``int`` mask is set if
+    the value with id ``offset + i`` is registered for it. The offset
+    keeps masks small for entries that only contain values registered
+    late. Intersections are then shifts and bitwise ands instead of
+    set operations, which is faster when there are many registrations.
+
+    This implements the same API as :class:`PredicateRegistry`, so
+    you can pass it as ``registry_class`` to :func:`reg.dispatch`.
+    Values come in the same order as well: that in which they were
+    registered for the key item of the first predicate.
+    """
+
+    def __init__(self, *predicates):
+        super(BitsetPredicateRegistry, self).__init__(*predicates)
+        self.known_values = []
+        self._ids = {}
+        # the ids of the values registered for each key item of the
+        # first predicate, in order of registration, for the key items
+        # for which this is not the order of the ids
+        self._orders = {}
+
+    def _add(self, key, value):
+        if self._ids is None:
+            # we were compacted, so make things mutable again
+            self.known_values = list(self.known_values)
+            self._ids = {v: i for i, v in enumerate(self.known_values)}
+        id = self._ids.get(value)
+        if id is None:
+            id = self._ids[value] = len(self.known_values)
+            self.known_values.append(value)
+        for level, (index, key_item) in enumerate(zip(self.indexes, key)):
+            entry = index.get(key_item)
+            if entry is None:
+                index[key_item] = (id, 1)
+                continue
+            if level == 0:
+                self._add_order(key_item, entry, id)
+            offset, mask = entry
+            if id >= offset:
+                index[key_item] = (offset, mask | 1 << (id - offset))
+            else:
+                index[key_item] = (id, mask << (offset - id) | 1)
+        self.known_keys[key] = value
+
+    def _add_order(self, key_item, entry, id):
+        # id is added to the entry of key_item of the first predicate
+        offset, mask = entry
+        if id >= offset and mask >> (id - offset) & 1:
+            return
+        order = self._orders.get(key_item)
+        if order is not None:
+            order.append(id)
+        elif id < offset + mask.bit_length() - 1:
+            # an earlier id comes after the ids that are there already
+            self._orders[key_item] = self._ids_of(entry) + [id]
+
+    def _ids_of(self, entry):
+        # the ids in an entry, in ascending order
+        offset, mask = entry
+        ids = []
+        while mask:
+            bit = mask & -mask
+            ids.append(offset + bit.bit_length() - 1)
+            mask ^= bit
+        return ids
+
+    def _register_many(self, registrations):
+        for key, value in registrations:
+            self._add(key, value)
+
+    def compact(self):
+        """Drop the data only needed during registration.
+
+        The mapping from values to ids is discarded and the values are
+        stored in a tuple. Registration can continue after compacting,
+        but the first registration rebuilds the mapping.
+        """
+        self._ids = None
+        self.known_values = tuple(self.known_values)
+
+    def get(self, keys):
+        result = None
+        for index, key in zip(self.indexes, keys):
+            entry = index.get(key)
+            if entry is None:
+                return []
+            result = entry if result is None else intersect(result, entry)
+            if not result[1]:
+                return []
+        if result is None:
+            # there are no indexes at all
+            return list(self.known_values)
+        return self._values(result + (keys[0],))
+
+    # The entries of a search carry the key item of the first
+    # predicate as a third element, which tells the order of values.
+
+    def _match(self, index, key):
+        entry = index.get(key)
+        if entry is None:
+            return None
+        return entry + (key,)
+
+    def _narrow(self, entry, match):
+        result = intersect(entry[:2], match[:2])
+        return result + entry[2:] if result[1] else None
+
+    def _values(self, entry):
+        offset, mask, first = entry
+        order = self._orders.get(first)
+        known_values = self.known_values
+        if order is None:
+            return [known_values[id] for id in self._ids_of((offset, mask))]
+        return [known_values[id] for id in order if id >= offset and mask >> (id - offset) & 1]
+
+
+class DecisionTreePredicateRegistry(PredicateRegistry):
+    """A predicate registry that compiles registrations into a decision tree.
+
+    The tree has a level for each predicate. Each node maps the key
+    items registered at its level to a node of the next level; nodes of
+    the last level map key items to the values that match them. A
+    lookup walks down the tree trying the permutations of each key item
+    in order, so it only does dict lookups, without any set
+    intersections.
+
+    As in :class:`PredicateRegistry`, a value that is registered for
+    several keys matches every combination of their key items. So
+    registering a value adds the paths of all these combinations to
+    the tree; this is fast as long as values are registered for few
+    keys.
+
+    This implements the same API as :class:`PredicateRegistry`, so
+    you can pass it as ``registry_class`` to :func:`reg.dispatch`, or
+    switch to it with :meth:`reg.Dispatch.compile`.
+    """
+
+    def __init__(self, *predicates):
+        super(DecisionTreePredicateRegistry, self).__init__(*predicates)
+        self.tree = {}
+        # the key items each value is registered for, by level
+        self._value_items = {}
+
+    def _add(self, key, value):
+        super(DecisionTreePredicateRegistry, self)._add(key, value)
+        self._grow([(key, value)])
+
+    def _register_many(self, registrations):
+        super(DecisionTreePredicateRegistry, self)._register_many(registrations)
+        self._grow(registrations)
+
+    def _grow(self, registrations):
+        # Only the combinations of the key items of the values
+        # registered now can match differently, so we compute their
+        # leaves again with the index intersection of get.
+        values = {}
+        for key, value in registrations:
+            items = self._value_items.get(value)
+            if items is None:
+                items = self._value_items[value] = [set() for index in self.indexes]
+            for level_items, key_item in zip(items, key):
+                level_items.add(key_item)
+            values[value] = items
+        if not self.indexes:
+            return
+        get = super(DecisionTreePredicateRegistry, self).get
+        for items in values.values():
+            for path in product(*items):
+                node = self.tree
+                for key_item in path[:-1]:
+                    node = node.setdefault(key_item, {})
+                node[path[-1]] = list(get(path))
+
+    def get(self, keys):
+        if not self.indexes:
+            return self.known_values
+        node = self.tree
+        for key_item in keys:
+            node = node.get(key_item)
+            if node is None:
+                return []
+        return node
+
+    def fallback(self, keys):
+        node = self.tree
+        for index, key in zip(self.indexes, keys):
+            permutations = index.registered_permutations(key)
+            if not permutations:
+                # no matching permutation for this key, so this is the fallback
                 return index.fallback
+            k = permutations[0]
+            if k not in node:
+                return index.fallback
+            node = node[k]
 
     def all(self, key):
-        for p in self.permutations(key):
-            for value in self.get(p):
-                yield value
+        if not self.indexes:
+            return iter(self.known_values)
+        return self._walk(self.tree, key, 0)
+
+    def _walk(self, node, key, level):
+        index = self.indexes[level]
+        last = level == len(self.indexes) - 1
+        for k in index.registered_permutations(key[level]):
+            if k in node:
+                if last:
+                    yield from node[k]
+                else:
+                    yield from self._walk(node[k], key, level + 1)
+
+
+def intersect(a, b):
+    """Intersect two ``(offset, mask)`` bitset entries."""
+    a_offset, a_mask = a
+    b_offset, b_mask = b
+    if a_offset < b_offset:
+        return b_offset, (a_mask >> (b_offset - a_offset)) & b_mask
+    return a_offset, a_mask & (b_mask >> (a_offset - b_offset))
+
+
+class LazyNode(object):
+    """A node in the decision tree of a :class:`LazyResolver`.
+
+    Either ``position`` is the position of the predicate to evaluate
+    next and ``children`` maps its key items to the next nodes, or
+    ``position`` is ``None`` and ``result`` is the outcome.
+    """
+
+    __slots__ = ("position", "assignment", "children", "result")
+
+    def __init__(self, position=None, assignment=None, result=None):
+        self.position = position
+        self.assignment = assignment
+        self.children = {}
+        self.result = result
+
+
+class LazyResolver(object):
+    """Resolve invocation arguments, evaluating predicates lazily.
+
+    Instead of computing the whole dispatch key up front, the resolver
+    evaluates one predicate at a time. It starts with the predicate
+    that distinguishes between the most registrations, and stops as
+    soon as the remaining predicates cannot change the outcome: when
+    all the registrations that still match were registered for
+    ``object`` for these predicates, or when none match anymore and
+    the fallback is known. Which predicate to evaluate after which key
+    items is recorded in a tree, so each combination is only analyzed
+    once. The tree has at most ``max_nodes`` nodes; when it would get
+    more, it is dropped and built again by the calls that follow, so
+    that it does not keep the key items of every call alive.
+
+    The outcome is the same as that of :meth:`PredicateRegistry.resolve`
+    for the whole key.
+
+    :param registry: the :class:`PredicateRegistry`.
+    :param resolve: the function used to resolve keys, for instance
+      the ``resolve`` method of a caching key lookup for ``registry``.
+    :param max_nodes: the largest number of nodes in the tree.
+    """
+
+    def __init__(self, registry, resolve, max_nodes=10000):
+        self.registry = registry
+        self._resolve = resolve
+        self._get_keys = [predicate.get_key for predicate in registry.predicates]
+        self.max_nodes = max_nodes
+        self.reset()
+
+    def reset(self):
+        """Forget the tree, for instance because registrations changed."""
+        self._root = None
+        self._nodes = 0
+        # the registered values by key item for each position, and the
+        # key items of each value for each position; made when first
+        # needed
+        self._values_by_item = None
+        self._value_items = None
+
+    def resolve(self, **kw):
+        """Find the implementation for invocation arguments.
+
+        :param kw: a dictionary with the arguments passed to a generic
+          function.
+        :returns: the same as :meth:`PredicateRegistry.resolve` for the
+          key of these arguments.
+        """
+        node = self._root
+        if node is None:
+            node = self._root = self._node({})
+        get_keys = self._get_keys
+        while node.position is not None:
+            key_item = get_keys[node.position](kw)
+            try:
+                node = node.children[key_item]
+            except KeyError:
+                self._nodes += 1
+                if self._nodes > self.max_nodes:
+                    # start again, the tree is built by the calls that
+                    # follow; node and its children are then garbage
+                    self._root = None
+                    self._nodes = 0
+                assignment = dict(node.assignment)
+                assignment[node.position] = key_item
+                child = node.children[key_item] = self._node(assignment)
+                node = child
+        return node.result
+
+    def _node(self, assignment):
+        # Analyze what is known given the key items in assignment, a
+        # dictionary mapping predicate positions to key items.
+        indexes = self.registry.indexes
+        remaining = [i for i in range(len(indexes)) if i not in assignment]
+        if not remaining:
+            return LazyNode(result=self._resolve(tuple([assignment[i] for i in range(len(indexes))])))
+        candidates = self._candidates(assignment)
+        if not candidates:
+            return self._fallback_node(assignment, remaining[0])
+        value_items = self._value_items
+        if all(indexes[i].matches_everything(item) for value in candidates for i in remaining for item in value_items[value][i]):
+            # whatever the remaining key items are, the candidates only
+            # match them with object, so we resolve the key with that
+            first = next(iter(candidates))
+            probe = tuple([assignment[i] if i in assignment else next(iter(value_items[first][i])) for i in range(len(indexes))])
+            return LazyNode(result=self._resolve(probe))
+        # evaluate the predicate that distinguishes between the most
+        # candidates next; registrations for object don't distinguish
+        position = max(
+            remaining,
+            key=lambda i: (len({item for value in candidates for item in value_items[value][i] if not indexes[i].matches_everything(item)}), -i),
+        )
+        return LazyNode(position, assignment)
+
+    def _index_values(self):
+        # As in PredicateRegistry, a value matches a key if each key
+        # item has a permutation that the value is registered for,
+        # possibly in different registrations.
+        indexes = self.registry.indexes
+        self._values_by_item = [{} for index in indexes]
+        self._value_items = {}
+        for key, value in self.registry.known_keys.items():
+            items = self._value_items.get(value)
+            if items is None:
+                items = self._value_items[value] = [set() for index in indexes]
+            for i, key_item in enumerate(key):
+                self._values_by_item[i].setdefault(key_item, set()).add(value)
+                items[i].add(key_item)
+
+    def _matching(self, i, permutations, values):
+        # The values that are registered for one of the permutations
+        # at position i, and are in values unless that is None.
+        values_by_item = self._values_by_item[i]
+        matching = set()
+        for permutation in permutations:
+            matching.update(values_by_item.get(permutation, ()))
+        return matching if values is None else values & matching
+
+    def _candidates(self, assignment):
+        # The registered values that match the key items in assignment.
+        if self._values_by_item is None:
+            self._index_values()
+        candidates = None
+        for i, key_item in assignment.items():
+            candidates = self._matching(i, self.registry.indexes[i].registered_permutations(key_item), candidates)
+            if not candidates:
+                break
+        if candidates is None:
+            return set(self._value_items)
+        return candidates
+
+    def _fallback_node(self, assignment, first_unknown):
+        # No registration matches, so the outcome is a fallback. As in
+        # PredicateRegistry.fallback, the predicates are considered in
+        # order, each with the first of its registered permutations.
+        values = None
+        for i, index in enumerate(self.registry.indexes):
+            if i == first_unknown:
+                return LazyNode(i, assignment)
+            permutations = index.registered_permutations(assignment[i])
+            if not permutations:
+                return LazyNode(result=index.fallback)
+            values = self._matching(i, permutations[:1], values)
+            if not values:
+                return LazyNode(result=index.fallback)
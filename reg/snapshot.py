@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import json
+from .dispatch import _get_dispatch
+from .dispatch import lazy_implementation_factory
+from .warm import decode_key_item
+from .warm import dotted_name
+from .warm import encode_key_item
+from .warm import resolve_dotted_name
+
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(dispatch_function, path):
+    """Save the registrations of a dispatch function to a file.
+
+    The keys are stored like those of a :class:`reg.KeyRecorder`, and
+    implementations by the name under which they can be imported.
+    Registrations for classes by dotted name that are not imported yet
+    are stored with these names.
+
+    :param dispatch_function: the dispatch function.
+    :param path: the path of the file.
+    :raises ValueError: if a key or an implementation cannot be
+      stored, for instance because it cannot be imported.
+    """
+    dispatch = _get_dispatch(dispatch_function)
+    registrations = []
+    class_positions = set(dispatch._class_positions)
+    pending = list(dispatch._pending_keys.items())
+    for key, func in list(dispatch.registry.known_keys.items()) + pending:
+        name = getattr(func, "snapshot_name", None)
+        if name is None:
+            name = dotted_name(func)
+            try:
+                importable = resolve_dotted_name(name) is func
+            except (ImportError, AttributeError):
+                importable = False
+            if not importable:
+                raise ValueError("Implementation cannot be imported: %r" % (func,))
+        # pending keys have names for the classes that are not imported
+        registrations.append([[{"class": item} if i in class_positions and isinstance(item, str) else encode_key_item(item) for i, item in enumerate(key)], name])
+    data = {
+        "version": SNAPSHOT_VERSION,
+        "dispatch": dotted_name(dispatch.wrapped_func),
+        "predicates": [predicate.name for predicate in dispatch.predicates],
+        "registrations": registrations,
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+
+
+def load_snapshot(dispatch_function, path):
+    """Register the implementations saved by :func:`reg.save_snapshot`.
+
+    The implementations are not imported until they are first called,
+    and their signatures are not validated again. The classes in the
+    keys are imported, as they are needed for the indexes.
+
+    :param dispatch_function: the dispatch function, with the same
+      predicates as the one that was saved.
+    :param path: the path of the file.
+    :raises ValueError: if the snapshot has another version, or does
+      not match the dispatch function.
+    """
+    dispatch = _get_dispatch(dispatch_function)
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != SNAPSHOT_VERSION:
+        raise ValueError("Unsupported snapshot version: %r" % data.get("version"))
+    predicates = [predicate.name for predicate in dispatch.predicates]
+    if data["dispatch"] != dotted_name(dispatch.wrapped_func) or data["predicates"] != predicates:
+        raise ValueError("Snapshot is for another dispatch function: %s%r" % (data["dispatch"], data["predicates"]))
+    make_implementation = lazy_implementation_factory(dispatch._signature)
+    dispatch._register_keys(
+        (tuple([decode_key_item(item) for item in encoded_key]), make_implementation(name)) for encoded_key, name in data["registrations"]
+    )
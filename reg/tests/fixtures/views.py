@@ -0,0 +1,31 @@
+"""Classes and implementations for tests that import them by name."""
+
+from reg import dispatch
+from reg import match_instance
+from reg import match_key
+
+
+class Document(object):
+    pass
+
+
+class Report(Document):
+    pass
+
+
+def document_view(obj, name):
+    return "document view"
+
+
+def report_edit(obj, name):
+    return "report edit"
+
+
+def make_view(**kw):
+    """A new dispatch function for views, with the same name every time."""
+
+    @dispatch(match_instance("obj"), match_key("name", fallback=lambda obj, name: "name fallback"), **kw)
+    def view(obj, name):
+        return "default"
+
+    return view
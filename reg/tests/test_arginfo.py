@@ -1,7 +1,11 @@
 from __future__ import annotations
 
+import gc
+import inspect
 import pytest
+import weakref
 from ..arginfo import arginfo
+from ..arginfo import code_arginfo
 
 
 def func_no_args():
@@ -324,3 +328,108 @@ def test_arginfo_cache_callable():
     assert not arginfo.is_cached(foo)
     arginfo(foo)
     assert arginfo.is_cached(foo)
+
+
+def test_arginfo_cache_method():
+    class Foo(object):
+        def method(self, a):
+            pass
+
+    foo = Foo()
+    assert not arginfo.is_cached(foo.method)
+    arginfo(foo.method)
+    # bound methods are created on each access, but still cached
+    assert arginfo.is_cached(foo.method)
+    assert arginfo.is_cached(Foo().method)
+
+
+def test_arginfo_cache_is_weak():
+    class Foo(object):
+        def __init__(self, a):
+            pass
+
+    def foo(a):
+        pass
+
+    assert arginfo(Foo).args == ["a"]
+    assert arginfo(foo).args == ["a"]
+    references = [weakref.ref(Foo), weakref.ref(foo)]
+    del Foo, foo
+    gc.collect()
+    assert [reference() for reference in references] == [None, None]
+
+
+def test_arginfo_not_weakly_referenceable():
+    # bound builtin methods cannot be weakly referenced
+    assert arginfo([].append) is not None
+    assert not arginfo.is_cached([].append)
+
+
+def signature_examples():
+    def positional(a, b, c=1):
+        pass
+
+    def star(a, *args, **kw):
+        pass
+
+    def keyword_only(a, *, b, c=3, **kw):
+        pass
+
+    def annotated(a: int, b: str = "b") -> bool:
+        pass
+
+    def positional_only(a, b=2, /, c=3, *args, d, **kw):
+        pass
+
+    def locals_only(a):
+        x = y = a
+        return x, y
+
+    return [positional, star, keyword_only, annotated, positional_only, locals_only]
+
+
+@pytest.mark.parametrize("func", signature_examples())
+def test_code_arginfo(func):
+    assert code_arginfo(func) == inspect.getfullargspec(func)
+
+
+def test_arginfo_signature_attribute():
+    def foo(a, b):
+        pass
+
+    foo.__signature__ = inspect.signature(lambda c: None)
+    assert arginfo(foo).args == ["c"]
+
+
+def test_arginfo_cache_bounded():
+    set_cache_size = arginfo.set_cache_size
+    set_cache_size(2)
+    try:
+
+        def first(a):
+            pass
+
+        def second(a):
+            pass
+
+        def third(a):
+            pass
+
+        for func in [first, second, third]:
+            arginfo(func)
+        assert not arginfo.is_cached(first)
+        assert arginfo.is_cached(second)
+        assert arginfo.is_cached(third)
+    finally:
+        set_cache_size(10000)
+
+
+def test_arginfo_cache_info():
+    def foo(a):
+        pass
+
+    hits, misses = arginfo.cache_info()
+    arginfo(foo)
+    arginfo(foo)
+    arginfo(foo)
+    assert arginfo.cache_info() == (hits + 2, misses + 1)
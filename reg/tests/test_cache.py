@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import gc
+import random
+
+import pytest
+from repoze.lru import LRUCache
+
+from ..cache import CacheManager
+from ..cache import FrequencySketch
+from ..cache import LruCachingKeyLookup
+from ..cache import SharedCachingKeyLookup
+from ..cache import default_cache_manager
+from ..cache import TinyLFUCache
+from ..cache import TwoQueueCache
+from ..dispatch import dispatch
+from ..predicate import match_key
+
+
+policies = [LRUCache, TwoQueueCache, TinyLFUCache]
+
+
+@pytest.mark.parametrize("cache_class", policies)
+def test_cache_api(cache_class):
+    cache = cache_class(10)
+    assert cache.get("a") is None
+    assert cache.get("a", "default") == "default"
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    cache.put("a", 2)
+    assert cache.get("a") == 2
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    cache.invalidate("a")
+    cache.put("b", 3)
+    cache.clear()
+    assert cache.get("b") is None
+
+
+@pytest.mark.parametrize("cache_class", policies)
+def test_cache_size(cache_class):
+    cache = cache_class(10)
+    for i in range(100):
+        cache.get(i)
+        cache.put(i, i)
+        assert len(cache.data) <= 10
+    for i in range(100):
+        assert cache.get(i) in (None, i)
+
+
+@pytest.mark.parametrize("cache_class", [TwoQueueCache, TinyLFUCache])
+def test_cache_size_one(cache_class):
+    cache = cache_class(1)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert len(cache.data) == 1
+
+
+@pytest.mark.parametrize("cache_class", [TwoQueueCache, TinyLFUCache])
+def test_cache_size_must_be_positive(cache_class):
+    with pytest.raises(ValueError):
+        cache_class(0)
+
+
+def hit_ratio(cache_class, size=100, lookups=20000):
+    # a few popular keys, mixed with a long tail of keys that are
+    # rarely used, as in a scan
+    rng = random.Random(42)
+    cache = cache_class(size)
+    for i in range(lookups):
+        if rng.random() < 0.5:
+            key = int(rng.paretovariate(1.0)) % 200
+        else:
+            key = "tail %d" % rng.randrange(100000)
+        if cache.get(key) is None:
+            cache.put(key, key)
+    return cache.hits / float(lookups)
+
+
+def test_hit_ratio():
+    lru = hit_ratio(LRUCache)
+    two_queue = hit_ratio(TwoQueueCache)
+    tiny_lfu = hit_ratio(TinyLFUCache)
+    assert two_queue > lru
+    assert tiny_lfu > lru
+
+
+def test_frequency_sketch():
+    sketch = FrequencySketch(100)
+    for i in range(10):
+        sketch.increment("popular")
+    sketch.increment("rare")
+    assert sketch.frequency("popular") == 10
+    assert sketch.frequency("rare") == 1
+    assert sketch.frequency("unknown") == 0
+    # counters saturate
+    for i in range(100):
+        sketch.increment("popular")
+    assert sketch.frequency("popular") == 15
+
+
+def test_frequency_sketch_ages():
+    sketch = FrequencySketch(10)
+    for i in range(10):
+        sketch.increment("old")
+    for i in range(200):
+        sketch.increment(i)
+    assert sketch.frequency("old") < 10
+
+
+@pytest.mark.parametrize("cache_class", policies)
+def test_lru_caching_key_lookup_cache_class(cache_class):
+    @dispatch(
+        match_key("name", fallback=lambda name: "fallback"),
+        get_key_lookup=lambda r: LruCachingKeyLookup(r, 10, 10, 10, cache_class=cache_class),
+    )
+    def view(name):
+        return "default"
+
+    view.register(lambda name: "view", name="view")
+    assert view("view") == "view"
+    assert view("edit") == "fallback"
+    assert isinstance(view.key_lookup.resolve._cache, cache_class)
+    assert view.key_lookup.resolve._cache.get((("view",),)) is not None
+
+    view.register(lambda name: "edit", name="edit")
+    assert view("edit") == "edit"
+
+
+def make_shared(manager):
+    @dispatch(
+        match_key("name", fallback=lambda name: "fallback"),
+        get_key_lookup=lambda r: SharedCachingKeyLookup(r, manager),
+    )
+    def view(name):
+        return "default"
+
+    return view
+
+
+def cached_entries(manager, view):
+    token = view.key_lookup.resolve.token
+    return len([entry for entry in manager.cache.data if entry[0] is token])
+
+
+def test_cache_manager_budget():
+    manager = CacheManager(100)
+    hot = make_shared(manager)
+    cold = make_shared(manager)
+    for i in range(20):
+        for j in range(80):
+            hot(j)
+            cold((i, j))
+    assert len(manager.cache.data) <= 100
+    # the hot function gets most of the budget
+    assert cached_entries(manager, hot) > 2 * cached_entries(manager, cold)
+
+
+def test_cache_manager_register_later():
+    manager = CacheManager(100)
+    view = make_shared(manager)
+    other = make_shared(manager)
+    view.register(lambda name: "view", name="view")
+    other.register(lambda name: "other view", name="view")
+    assert view("view") == "view"
+    assert view("edit") == "fallback"
+    assert other("edit") == "fallback"
+    assert view.by_args("view").all_matches == [view.by_args("view").component]
+
+    view.register(lambda name: "edit", name="edit")
+    assert view("edit") == "edit"
+    assert cached_entries(manager, view) == 2
+    # other dispatch functions are not affected
+    assert cached_entries(manager, other) == 1
+
+    manager.clear()
+    assert cached_entries(manager, view) == 0
+    assert view("edit") == "edit"
+
+
+def test_cache_manager_clean():
+    manager = CacheManager(100)
+    view = make_shared(manager)
+    view.register(lambda name: "view", name="view")
+    assert view("view") == "view"
+    token = view.key_lookup.resolve.token
+    view.clean()
+    gc.collect()
+    # the entries of the old key lookup are gone
+    assert not [entry for entry in manager.cache.data if entry[0] is token]
+    assert token not in manager._keys
+    assert view("view") == "fallback"
+
+    view.key_lookup.discard()
+    assert cached_entries(manager, view) == 0
+
+
+def test_cache_manager_prunes_keys():
+    manager = CacheManager(10)
+    view = make_shared(manager)
+    for i in range(1000):
+        view(i)
+    keys = manager._keys[view.key_lookup.resolve.token]
+    # keys the cache evicted are forgotten as well
+    assert len(keys) < 100
+    view.register(lambda name: "five", name=5)
+    assert view(5) == "five"
+
+
+def test_shared_caching_key_lookup_default_manager():
+    @dispatch(match_key("name"), get_key_lookup=SharedCachingKeyLookup)
+    def view(name):
+        return "default"
+
+    assert view.key_lookup.manager is default_cache_manager
+    assert view("view") == "default"
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import importlib.util
+import io
+import sys
+
+from ..compile import compile_modules
+from ..compile import main
+from ..dispatch import dispatch
+from ..dispatch import freeze_all
+from ..predicate import match_instance
+from ..predicate import match_key
+from weakref import WeakSet
+from .fixtures.views import Document
+from .fixtures.views import Report
+from .fixtures.views import document_view
+from .fixtures.views import report_edit
+
+
+class Image(object):
+    pass
+
+
+@dispatch(match_instance("obj"), match_key("name"))
+def view(obj, name="view"):
+    return "default"
+
+
+view.register(document_view, obj=Document, name="view")
+view.register(report_edit, obj=Report, name="edit")
+view.register(lambda obj, name: "image view", obj=Image, name="view")
+
+
+def shared_name(obj, name):
+    return name
+
+
+# compiling this fails after the shared predicate function has been
+# referenced, as its default cannot be written
+@dispatch(match_instance("obj"), match_key("name", shared_name))
+def a_skipped(obj, name, extra=object()):
+    return "default"
+
+
+@dispatch(match_instance("obj"), match_key("name", shared_name))
+def b_shared(obj, name):
+    return "default"
+
+
+b_shared.register(document_view, obj=Document, name="view")
+
+
+# not used before compiling, so it is still a stand-in
+@dispatch(match_instance("obj"), deferred=True)
+def deferred_view(obj):
+    return "default"
+
+
+def load(path):
+    spec = importlib.util.spec_from_file_location("compiled", str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_compile(tmp_path):
+    err = io.StringIO()
+    path = tmp_path / "compiled.py"
+    path.write_text(compile_modules([__name__], err))
+    compiled = load(path)
+
+    call = compiled.dispatch_functions[__name__ + ":view"]
+    assert call is compiled.reg_tests_test_compile__view
+    assert call(Document(), "view") == "document view"
+    assert call(Report(), "view") == "document view"
+    assert call(Report(), "edit") == "report edit"
+    assert call(Report()) == "document view"
+    assert call(Document(), "edit") == "default"
+    assert "Skipping " + __name__ + ":view" not in err.getvalue()
+
+
+def test_compile_table(tmp_path):
+    path = tmp_path / "compiled.py"
+    path.write_text(compile_modules([__name__], io.StringIO()))
+    source = path.read_text()
+    assert "compile(" not in source
+    assert "exec(" not in source
+    call = load(path).dispatch_functions[__name__ + ":view"]
+    (table_name,) = [name for name in call.__code__.co_names if name.startswith("_table_")]
+    table = call.__globals__[table_name]
+    assert table[(Document, "view")] is document_view
+    assert table[(Report, "view")] is document_view
+    assert table[(Report, "edit")] is report_edit
+    # the lambda cannot be imported, and neither can a key without
+    # an implementation
+    assert (Image, "view") not in table
+    assert (Document, "edit") not in table
+
+
+def test_compile_dynamic(tmp_path):
+    path = tmp_path / "compiled.py"
+    path.write_text(compile_modules([__name__], io.StringIO()))
+    call = load(path).dispatch_functions[__name__ + ":view"]
+    # dispatched by the original dispatch function
+    assert call(Image(), "view") == "image view"
+    assert call(object(), "view") == "default"
+
+
+def test_compile_skips_local(tmp_path):
+    @dispatch("obj")
+    def local(obj):
+        pass
+
+    err = io.StringIO()
+    source = compile_modules([__name__], err)
+    assert "test_compile_skips_local" not in source
+    assert "Skipping " + __name__ + ":test_compile_skips_local.<locals>.local" in err.getvalue()
+
+
+def test_main(tmp_path, capsys):
+    path = tmp_path / "compiled.py"
+    main([__name__, "-o", str(path)])
+    assert load(path).dispatch_functions[__name__ + ":view"](Report(), "edit") == "report edit"
+
+    main([__name__])
+    assert capsys.readouterr().out == path.read_text()
+
+
+def test_compile_skipped_references(tmp_path):
+    err = io.StringIO()
+    path = tmp_path / "compiled.py"
+    path.write_text(compile_modules([__name__], err))
+    assert "Skipping " + __name__ + ":a_skipped" in err.getvalue()
+    call = load(path).dispatch_functions[__name__ + ":b_shared"]
+    assert call(Document(), "view") == "document view"
+    assert call(Report(), "view") == "document view"
+    assert call(Document(), "edit") == "default"
+
+
+def test_compile_deferred(tmp_path):
+    path = tmp_path / "compiled.py"
+    path.write_text(compile_modules([__name__], io.StringIO()))
+    call = load(path).dispatch_functions[__name__ + ":deferred_view"]
+    assert call(Document()) == "default"
+
+
+APP = """
+from reg import dispatch
+from reg import dispatch_method
+
+
+@dispatch("obj")
+def number_view(obj):
+    return "default"
+
+
+number_view.register("compile_plugin.views:int_view", obj=int)
+
+
+class App(object):
+    @dispatch_method("obj")
+    def view(self, obj):
+        return "default"
+
+
+class Sub(App):
+    pass
+
+
+App().view(1)
+Sub().view(1)
+"""
+
+
+def test_compile_plugin(tmp_path, monkeypatch):
+    package = tmp_path / "compile_plugin"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "app.py").write_text(APP)
+    (package / "views.py").write_text("def int_view(obj):\n    return 'int'\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for module in ["compile_plugin", "compile_plugin.app", "compile_plugin.views"]:
+        monkeypatch.delitem(sys.modules, module, raising=False)
+    # only compile the dispatch functions of the plugin
+    dispatches = WeakSet()
+    monkeypatch.setitem(compile_modules.__globals__, "_dispatches", dispatches)
+    monkeypatch.setitem(freeze_all.__globals__, "_dispatches", dispatches)
+
+    err = io.StringIO()
+    path = tmp_path / "compiled.py"
+    path.write_text(compile_modules(["compile_plugin.app"], err))
+    assert "compile_plugin.views" not in sys.modules
+    # dispatch methods have the same name for every class
+    assert "Skipping compile_plugin.app:App.view: Dispatch methods" in err.getvalue()
+    source = path.read_text()
+    assert "App" not in source
+    # only the subclasses of int that are in the same package
+    assert "enum" not in source
+
+    call = load(path).dispatch_functions["compile_plugin.app:number_view"]
+    (table_name,) = [name for name in call.__code__.co_names if name.startswith("_table_")]
+    table = call.__globals__[table_name]
+    assert table[(int,)] is sys.modules["compile_plugin.views"].int_view
+    assert table[(bool,)] is table[(int,)]
+    assert call(1) == "int"
@@ -1,12 +1,26 @@
 from __future__ import annotations
 from __future__ import unicode_literals
 
+import gc
+import inspect
 import pytest
+from ..cache import DictCachingKeyLookup
+from ..dispatch import DeferredDispatch
+from ..dispatch import DispatchFunction
 from ..dispatch import dispatch
+from ..dispatch import freeze_all
+from ..dispatch import prefork_prepare
+from ..dispatch import retain_sources
 from ..error import RegistrationError
+from ..predicate import BitsetPredicateRegistry
+from ..predicate import ClassIndex
+from ..predicate import DecisionTreePredicateRegistry
+from ..predicate import Predicate
 from ..predicate import match_class
 from ..predicate import match_instance
 from ..predicate import match_key
+from ..warm import dotted_name
+from weakref import WeakSet
 
 
 class IAlpha(object):
@@ -1070,3 +1084,719 @@ def test_predicate_key_wrong_keyword_argument_gives_typeerror():
 
     with pytest.raises(TypeError):
         assert foo.by_args(wrong=1)
+
+
+def test_inline_predicate_keys():
+    def get_name(obj, name):
+        return name.upper()
+
+    @dispatch("obj", match_key("name", get_name))
+    def view(obj, name):
+        return "fallback"
+
+    class Foo(object):
+        pass
+
+    def foo_edit(obj, name):
+        return "foo edit"
+
+    view.register(foo_edit, obj=Foo, name="EDIT")
+
+    assert "_key = (obj.__class__, _key_func_1(obj=obj, name=name),)" in view.__globals__["__source__"][-1]
+    assert view(Foo(), "edit") == "foo edit"
+    assert view(Foo(), "view") == "fallback"
+    assert view.by_args(Foo(), "edit").component is foo_edit
+
+
+def test_inline_predicate_keys_not_an_argument():
+    @dispatch(match_instance("model"))
+    def view(obj):
+        return "fallback"
+
+    assert "_key = _registry_key(obj=obj)" in view.__globals__["__source__"][-1]
+
+    with pytest.raises(KeyError):
+        view(object())
+
+
+def test_inline_predicate_keys_add_predicates():
+    @dispatch()
+    def view(obj, name):
+        return "fallback"
+
+    view.add_predicates([match_instance("obj"), match_key("name")])
+
+    class Foo(object):
+        pass
+
+    def foo_edit(obj, name):
+        return "foo edit"
+
+    view.register(foo_edit, obj=Foo, name="edit")
+
+    assert "_key = (obj.__class__, name,)" in view.__globals__["__source__"][-1]
+    assert view(Foo(), "edit") == "foo edit"
+    assert view(Foo(), "view") == "fallback"
+
+
+def test_inline_cache():
+    @dispatch("obj", match_key("name"), inline_cache_after=4, inline_cache_size=1)
+    def view(obj, name):
+        return "fallback"
+
+    class Foo(object):
+        pass
+
+    class Bar(object):
+        pass
+
+    def foo_edit(obj, name):
+        return "foo edit"
+
+    view.register(foo_edit, obj=Foo, name="edit")
+
+    assert view(Foo(), "edit") == "foo edit"
+    assert view(Bar(), "edit") == "fallback"
+    assert view(Foo(), "edit") == "foo edit"
+    assert "_observe(_key)" in view.__globals__["__source__"][-1]
+    assert view(Foo(), "edit") == "foo edit"
+
+    source = view.__globals__["__source__"][-1]
+    assert "_observe(_key)" not in source
+    assert "if _key_item_0 is _guard_0_0 and _key_item_1 == _guard_0_1:" in source
+    assert "_guard_1_0" not in source
+    assert view.__globals__["_guard_0_0"] is Foo
+    assert view.__globals__["_implementation_0"] is foo_edit
+
+    assert view(Foo(), "edit") == "foo edit"
+    assert view(Foo(), "view") == "fallback"
+    assert view(Bar(), "edit") == "fallback"
+
+    def bar_edit(obj, name):
+        return "bar edit"
+
+    # registering reverts to the generic code
+    view.register(bar_edit, obj=Bar, name="edit")
+    assert "_observe(_key)" in view.__globals__["__source__"][-1]
+    assert view(Bar(), "edit") == "bar edit"
+    assert view(Foo(), "edit") == "foo edit"
+
+
+def test_inline_cache_fallback():
+    @dispatch(match_instance("obj", fallback=lambda obj: "obj fallback"), inline_cache_after=1)
+    def view(obj):
+        return "default"
+
+    class Foo(object):
+        pass
+
+    assert view(Foo()) == "obj fallback"
+    assert "_observe(_key)" not in view.__globals__["__source__"][-1]
+    assert view(Foo()) == "obj fallback"
+
+
+def test_inline_cache_not_inlined_key():
+    def get_key(d):
+        return d["obj"].__class__
+
+    @dispatch(Predicate("model", ClassIndex, get_key), inline_cache_after=1)
+    def view(obj):
+        return "default"
+
+    class Foo(object):
+        pass
+
+    view.register(lambda obj: "foo", model=Foo)
+
+    assert view(Foo()) == "foo"
+    assert "if _key == _guard_0:" in view.__globals__["__source__"][-1]
+    assert view(Foo()) == "foo"
+    assert view(object()) == "default"
+
+
+def test_inline_cache_no_predicates():
+    @dispatch(inline_cache_after=1)
+    def view():
+        return "default"
+
+    view.register(lambda: "registered")
+
+    assert view() == "registered"
+    assert "return _implementation_0()" in view.__globals__["__source__"][-1]
+    assert view() == "registered"
+
+
+def test_dispatch_bitset_registry():
+    @dispatch("obj", match_key("name", fallback=lambda obj, name: "name fallback"), registry_class=BitsetPredicateRegistry)
+    def view(obj, name):
+        return "fallback"
+
+    class Foo(object):
+        pass
+
+    class FooSub(Foo):
+        pass
+
+    def foo_edit(obj, name):
+        return "foo edit"
+
+    view.register(foo_edit, obj=Foo, name="edit")
+    view.compact()
+
+    assert view(FooSub(), "edit") == "foo edit"
+    assert view(FooSub(), "view") == "name fallback"
+    assert view(object(), "edit") == "fallback"
+    assert view.by_args(FooSub(), "edit").all_matches == [foo_edit]
+
+
+def test_dispatch_compile():
+    @dispatch("obj", match_key("name", fallback=lambda obj, name: "name fallback"), get_key_lookup=DictCachingKeyLookup)
+    def view(obj, name):
+        return "fallback"
+
+    class Foo(object):
+        pass
+
+    class FooSub(Foo):
+        pass
+
+    def foo_edit(obj, name):
+        return "foo edit"
+
+    def foo_sub_view(obj, name):
+        return "foo sub view"
+
+    view.register(foo_edit, obj=Foo, name="edit")
+    view.compile()
+
+    assert isinstance(view.key_lookup.key_lookup, DecisionTreePredicateRegistry)
+    assert view(FooSub(), "edit") == "foo edit"
+    assert view(FooSub(), "view") == "name fallback"
+    assert view(object(), "edit") == "fallback"
+
+    view.register(foo_sub_view, obj=FooSub, name="view")
+    assert view.by_args(FooSub(), "view").component is foo_sub_view
+    assert view.by_args(FooSub(), "edit").all_matches == [foo_edit]
+
+    # clean keeps the compiled registry class
+    view.clean()
+    assert isinstance(view.key_lookup.key_lookup, DecisionTreePredicateRegistry)
+    assert view(FooSub(), "edit") == "fallback"
+
+
+def test_dispatch_compile_same_results():
+    class A(object):
+        pass
+
+    class B(object):
+        pass
+
+    @dispatch(match_instance("a"), match_instance("b"))
+    def f(a, b):
+        return "default"
+
+    def same(a, b):
+        return "same"
+
+    f.register(same, a=A, b=A)
+    f.register(same, a=B, b=B)
+    assert f(A(), B()) == "same"
+    f.compile()
+    assert f(A(), B()) == "same"
+
+
+def test_lazy_predicates():
+    evaluated = []
+
+    def get_permission(obj, request):
+        evaluated.append("permission")
+        return request.permission
+
+    def get_name(obj, request):
+        evaluated.append("name")
+        return request.name
+
+    @dispatch(
+        match_class("permission", get_permission, fallback=lambda obj, request: "permission fallback"),
+        match_instance("obj"),
+        match_key("name", get_name, fallback=lambda obj, request: "name fallback"),
+        lazy_predicates=True,
+        get_key_lookup=DictCachingKeyLookup,
+    )
+    def view(obj, request):
+        return "default"
+
+    class Request(object):
+        def __init__(self, name, permission=object):
+            self.name = name
+            self.permission = permission
+
+    class Foo(object):
+        pass
+
+    class Bar(object):
+        pass
+
+    view.register(lambda obj, request: "foo view", obj=Foo, name="view", permission=object)
+    view.register(lambda obj, request: "foo edit", obj=Foo, name="edit", permission=object)
+    view.register(lambda obj, request: "bar view", obj=Bar, name="view", permission=object)
+
+    # name distinguishes most registrations, so it is evaluated first,
+    # and permission does not matter as everything is registered for
+    # object
+    assert view(Foo(), Request("edit")) == "foo edit"
+    assert evaluated == ["name"]
+    del evaluated[:]
+    assert view(Foo(), Request("view")) == "foo view"
+    assert view(Bar(), Request("view")) == "bar view"
+    assert evaluated == ["name", "name"]
+    del evaluated[:]
+
+    # no registration matches: we need the predicates in order
+    assert view(Bar(), Request("edit")) == "name fallback"
+    assert evaluated == ["name", "permission"]
+    assert view(object(), Request("edit")) == "default"
+
+    # registering resets what we know
+    class Permission(object):
+        pass
+
+    view.register(lambda obj, request: "bar edit", obj=Bar, name="edit", permission=Permission)
+    del evaluated[:]
+    assert view(Bar(), Request("edit", Permission)) == "bar edit"
+    assert sorted(evaluated) == ["name", "permission"]
+    assert view(Bar(), Request("edit", object)) == "name fallback"
+    assert view(Foo(), Request("edit", Permission)) == "foo edit"
+
+
+def test_lazy_predicates_same_as_eager():
+    class Base(object):
+        pass
+
+    class Sub(Base):
+        pass
+
+    class Other(object):
+        pass
+
+    def make(**kw):
+        @dispatch(
+            match_instance("a", fallback=lambda a, b, c: "a fallback"),
+            match_key("b", fallback=lambda a, b, c: "b fallback"),
+            match_instance("c", fallback=lambda a, b, c: "c fallback"),
+            **kw
+        )
+        def target(a, b, c):
+            return "default"
+
+        target.register(lambda a, b, c: "base x base", a=Base, b="x", c=Base)
+        target.register(lambda a, b, c: "sub x object", a=Sub, b="x", c=object)
+        target.register(lambda a, b, c: "object y sub", a=object, b="y", c=Sub)
+        target.register(lambda a, b, c: "sub y other", a=Sub, b="y", c=Other)
+        return target
+
+    eager = make()
+    lazy = make(lazy_predicates=True)
+
+    for a in [Base(), Sub(), Other(), object()]:
+        for b in ["x", "y", "z"]:
+            for c in [Base(), Sub(), Other(), object()]:
+                assert lazy(a, b, c) == eager(a, b, c)
+                # again, from the tree
+                assert lazy(a, b, c) == eager(a, b, c)
+
+
+def test_lazy_predicates_no_predicates():
+    @dispatch(lazy_predicates=True)
+    def target():
+        return "default"
+
+    assert target() == "default"
+
+
+def test_freeze():
+    class Model(object):
+        pass
+
+    class Sub(Model):
+        pass
+
+    @dispatch(match_instance("obj"), match_key("name", fallback=lambda obj, name: "name fallback"))
+    def view(obj, name):
+        return "default"
+
+    def model_view(obj, name):
+        return "model view"
+
+    view.register(model_view, obj=Model, name="view")
+    view.register(lambda obj, name: "model edit", obj=Model, name="edit")
+    view.freeze()
+
+    table = view.register.__self__._frozen_table
+    # registered classes and their subclasses are in the table
+    assert table[(Sub, "view")] is model_view
+    assert set(table) == {(Model, "view"), (Model, "edit"), (Sub, "view"), (Sub, "edit")}
+
+    assert view(Sub(), "view") == "model view"
+    assert view(Model(), "edit") == "model edit"
+    assert view(Model(), "other") == "name fallback"
+    assert view(object(), "view") == "default"
+
+    class Later(Sub):
+        pass
+
+    assert view(Later(), "view") == "model view"
+    # keys that are not in the table are not added to it
+    assert (Later, "view") not in table
+
+    with pytest.raises(RegistrationError):
+        view.register(lambda obj, name: "sub view", obj=Sub, name="view")
+    with pytest.raises(RegistrationError):
+        view.add_predicates([match_key("extra")])
+
+    view.clean()
+    view.register(lambda obj, name: "sub view", obj=Sub, name="view")
+    assert view(Sub(), "view") == "sub view"
+
+
+def test_freeze_max_size():
+    class Model(object):
+        pass
+
+    class Other(object):
+        pass
+
+    @dispatch(match_instance("obj"), match_key("name"))
+    def view(obj, name):
+        return "default"
+
+    view.register(lambda obj, name: "model view", obj=Model, name="view")
+    view.register(lambda obj, name: "other edit", obj=Other, name="edit")
+    # two classes and two names make four keys
+    view.freeze(max_size=3)
+    assert view.register.__self__._frozen_table is None
+    assert view(Model(), "view") == "model view"
+    assert view(Other(), "view") == "default"
+    with pytest.raises(RegistrationError):
+        view.register(lambda obj, name: "other view", obj=Other, name="view")
+
+    view.clean()
+    view.register(lambda obj, name: "model view", obj=Model, name="view")
+    view.freeze(max_size=1)
+    assert set(view.register.__self__._frozen_table) == {(Model, "view")}
+
+
+def test_freeze_without_class():
+    class Model(object):
+        pass
+
+    @dispatch(match_instance("obj"), match_instance("other"))
+    def view(obj, other):
+        return "default"
+
+    view.register(lambda obj, other: "model", obj=Model)
+    view.register(lambda obj, other: "model model", obj=Model, other=Model)
+    view.freeze()
+    assert view(Model(), Model()) == "model model"
+    assert view(Model(), 1) == "default"
+    assert set(view.register.__self__._frozen_table) == {(Model, Model)}
+
+
+def test_freeze_without_predicates():
+    @dispatch()
+    def target():
+        return "default"
+
+    target.freeze()
+    assert target() == "default"
+
+
+def test_freeze_all(monkeypatch):
+    # only freeze the dispatch functions of this test
+    monkeypatch.setitem(freeze_all.__globals__, "_dispatches", WeakSet())
+    monkeypatch.setitem(freeze_all.__globals__, "_deferred", WeakSet())
+
+    @dispatch("obj")
+    def first(obj):
+        return "default"
+
+    @dispatch("obj")
+    def second(obj):
+        return "default"
+
+    first.register(lambda obj: "int", obj=int)
+    freeze_all()
+    assert first(1) == "int"
+    for target in [first, second]:
+        with pytest.raises(RegistrationError):
+            target.register(lambda obj: "str", obj=str)
+
+
+def test_prefork_prepare(monkeypatch):
+    monkeypatch.setitem(freeze_all.__globals__, "_dispatches", WeakSet())
+    monkeypatch.setitem(freeze_all.__globals__, "_deferred", WeakSet())
+
+    class Model(object):
+        pass
+
+    class Sub(Model):
+        pass
+
+    @dispatch("obj", registry_class=BitsetPredicateRegistry)
+    def view(obj):
+        return "default"
+
+    view.register(lambda obj: "model", obj=Model)
+    try:
+        prefork_prepare()
+        assert gc.get_freeze_count() > 0
+    finally:
+        gc.unfreeze()
+    # everything was looked up in advance
+    assert (Sub,) in view.register.__self__._frozen_table
+    assert view(Sub()) == "model"
+    with pytest.raises(RegistrationError):
+        view.register(lambda obj: "int", obj=int)
+
+
+def test_prefork_prepare_options(monkeypatch):
+    monkeypatch.setitem(freeze_all.__globals__, "_dispatches", WeakSet())
+    monkeypatch.setitem(freeze_all.__globals__, "_deferred", WeakSet())
+
+    @dispatch("obj")
+    def view(obj):
+        return "default"
+
+    @dispatch("obj", deferred=True)
+    def deferred_view(obj):
+        return "default"
+
+    view.register(lambda obj: "int", obj=int)
+    try:
+        prefork_prepare(freeze=False)
+    finally:
+        gc.unfreeze()
+    # not frozen, and the deferred dispatch function is left alone
+    view.register(lambda obj: "str", obj=str)
+    assert view("s") == "str"
+    assert deferred_view.__globals__["_materialize"].__self__.dispatch is None
+
+    try:
+        prefork_prepare(deferred=True)
+    finally:
+        gc.unfreeze()
+    with pytest.raises(RegistrationError):
+        deferred_view.register(lambda obj: "int", obj=int)
+
+
+def test_deferred(monkeypatch):
+    monkeypatch.setitem(freeze_all.__globals__, "_dispatches", WeakSet())
+
+    @dispatch("obj", deferred=True)
+    def view(obj, name="default"):
+        """View an object."""
+        return name
+
+    assert view.__name__ == "view"
+    assert view.__doc__ == "View an object."
+    assert str(inspect.signature(view)) == "(obj, name='default')"
+    assert not hasattr(view, "key_lookup")
+    assert not freeze_all.__globals__["_dispatches"]
+
+    assert view(1) == "default"
+    assert view(1, "other") == "other"
+    assert view.key_lookup is view.register.__self__.registry
+    assert len(freeze_all.__globals__["_dispatches"]) == 1
+
+
+def test_deferred_register():
+    @dispatch("obj", deferred=True)
+    def view(obj):
+        return "default"
+
+    original = view
+
+    @view.register(obj=int)
+    def int_view(obj):
+        return "int"
+
+    assert view is original
+    assert view(1) == "int"
+    assert view("s") == "default"
+    assert view.by_args(1).component is int_view
+
+
+def test_deferred_materialize():
+    @dispatch("obj", deferred=True)
+    def view(obj):
+        return "default"
+
+    deferred = view.__globals__["_materialize"].__self__
+    assert isinstance(deferred, DeferredDispatch)
+    assert deferred.dispatch is None
+    assert deferred.materialize() is view
+    dispatch_object = deferred.dispatch
+    assert view.register.__self__ is dispatch_object
+    assert deferred.materialize() is view
+    assert deferred.dispatch is dispatch_object
+
+
+def test_freeze_all_deferred(monkeypatch):
+    monkeypatch.setitem(freeze_all.__globals__, "_dispatches", WeakSet())
+    monkeypatch.setitem(freeze_all.__globals__, "_deferred", WeakSet())
+
+    @dispatch("obj", deferred=True)
+    def view(obj):
+        return "default"
+
+    freeze_all()
+    with pytest.raises(RegistrationError):
+        view.register(lambda obj: "int", obj=int)
+    assert view(1) == "default"
+
+
+def test_shared_code():
+    def make():
+        @dispatch("obj", match_key("name"))
+        def view(obj, name):
+            return "default"
+
+        return view
+
+    first = make()
+    second = make()
+    assert first is not second
+    assert first.__code__ is second.__code__
+    assert first.__globals__ is not second.__globals__
+    first.register(lambda obj, name: "first", obj=int, name="a")
+    assert first(1, "a") == "first"
+    assert second(1, "a") == "default"
+
+
+def test_retain_sources():
+    retain_sources(False)
+    try:
+
+        @dispatch("obj")
+        def view(obj):
+            return "default"
+
+    finally:
+        retain_sources(True)
+    assert "__source__" not in view.__globals__
+    assert view(1) == "default"
+
+    @dispatch("obj")
+    def other(obj):
+        return "default"
+
+    assert "_key = (obj.__class__,)" in other.__globals__["__source__"][-1]
+
+
+def test_compact_function():
+    @dispatch("obj", match_key("name"), compact_function=True)
+    def view(obj, name="default"):
+        """View an object."""
+        return "default"
+
+    assert isinstance(view, DispatchFunction)
+    assert view.__name__ == "view"
+    assert view.__doc__ == "View an object."
+    assert view.__module__ == __name__
+    assert dotted_name(view) == __name__ + ":test_compact_function.<locals>.view"
+    assert DispatchFunction.__doc__.startswith("A compact dispatch function.")
+    assert DispatchFunction.__module__ == "reg.dispatch"
+    assert str(inspect.signature(view)) == "(obj, name='default')"
+    assert not vars(view.call)
+
+    @view.register(obj=int, name="default")
+    def int_view(obj, name):
+        return "int"
+
+    assert view(1) == "int"
+    assert view(1, "other") == "default"
+    assert view("s") == "default"
+    assert view.by_args(1, "default").component is int_view
+    assert view.by_predicates(obj=int, name="default").component is int_view
+    assert view.key_lookup is view.dispatch.registry
+    assert view.wrapped_func.__doc__ == "View an object."
+
+    view.clean()
+    assert view(1) == "default"
+    with pytest.raises(AttributeError):
+        view.nonexistent
+
+
+def test_compact_function_not_deferred():
+    with pytest.raises(ValueError):
+        dispatch("obj", deferred=True, compact_function=True)
+
+
+def test_register_many():
+    @dispatch("obj", match_key("name"))
+    def view(obj, name):
+        return "default"
+
+    def int_view(obj, name):
+        return "int"
+
+    def str_view(obj, name):
+        return "str"
+
+    view.register_many([(int_view, {"obj": int, "name": "a"}), (int_view, {"obj": int, "name": "b"}), (str_view, {"obj": str, "name": "a"})])
+    assert view(1, "a") == "int"
+    assert view(1, "b") == "int"
+    assert view("s", "a") == "str"
+    assert view("s", "b") == "default"
+
+
+def test_register_many_invalid():
+    @dispatch("obj")
+    def view(obj):
+        return "default"
+
+    with pytest.raises(RegistrationError):
+        view.register_many([(lambda obj: "int", {"obj": int}), (lambda obj, extra: "str", {"obj": str})])
+    with pytest.raises(RegistrationError):
+        view.register_many([(lambda obj: "int", {"obj": int}), (lambda obj: "other", {"obj": int})])
+    assert view(1) == "default"
+
+
+def test_bulk():
+    @dispatch("obj", inline_cache_after=1)
+    def view(obj):
+        return "default"
+
+    assert view(1) == "default"
+    with view.bulk():
+        assert view.register(lambda obj: "int", obj=int) is not None
+
+        @view.register(obj=str)
+        def str_view(obj):
+            return "str"
+
+        with view.bulk():
+            view.register(lambda obj: "float", obj=float)
+        # not registered yet
+        assert view(1) == "default"
+    assert view(1) == "int"
+    assert view("s") == "str"
+    assert view(1.0) == "float"
+
+
+def test_bulk_errors():
+    @dispatch("obj")
+    def view(obj):
+        return "default"
+
+    with pytest.raises(RegistrationError):
+        with view.bulk():
+            view.register(lambda obj: "int", obj=int)
+            view.register(lambda other, extra: "str", obj=str)
+    with pytest.raises(ZeroDivisionError):
+        with view.bulk():
+            view.register(lambda obj: "int", obj=int)
+            1 / 0
+    assert view(1) == "default"
+    view.register(lambda obj: "int", obj=int)
+    assert view(1) == "int"
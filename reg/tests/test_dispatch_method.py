@@ -1,12 +1,15 @@
 from __future__ import annotations
 
+import gc
 import pytest
+import weakref
 from ..context import clean_dispatch_methods
 from ..context import dispatch
 from ..context import dispatch_method
 from ..context import methodify
 from ..error import RegistrationError
 from ..predicate import match_instance
+from ..warm import KeyRecorder
 from types import FunctionType
 
 
@@ -798,3 +801,40 @@ def unmethodify(func):
     """
     func = getattr(func, "__func__", func)
     return func.__globals__.get("_func", func)
+
+
+def test_dispatch_method_does_not_keep_classes_alive():
+    class Foo(object):
+        @dispatch_method()
+        def bar(self):
+            return "default"
+
+    def make_subclass():
+        class Sub(Foo):
+            pass
+
+        assert Sub().bar() == "default"
+        return weakref.ref(Sub)
+
+    references = [make_subclass() for i in range(10)]
+    gc.collect()
+    assert [reference() for reference in references] == [None] * 10
+    assert list(Foo.__dict__["bar"]._cache) == []
+
+
+@pytest.mark.parametrize("option", ["deferred", "compact_function"])
+def test_dispatch_method_unsupported_options(option):
+    with pytest.raises(TypeError):
+        dispatch_method("obj", **{option: True})
+
+
+def test_dispatch_method_record():
+    class Foo(object):
+        @dispatch_method("obj")
+        def view(self, obj):
+            return "default"
+
+    with pytest.raises(TypeError):
+        Foo.view.register.__self__.record(KeyRecorder())
+    Foo.view.register.__self__.record(None)
+    assert Foo().view(1) == "default"
@@ -1,9 +1,14 @@
 from __future__ import annotations
 
 import pytest
+from itertools import product
 from ..error import RegistrationError
+from ..predicate import BitsetPredicateRegistry
 from ..predicate import ClassIndex
+from ..predicate import DecisionTreePredicateRegistry
 from ..predicate import KeyIndex
+from ..predicate import LazyResolver
+from ..predicate import Predicate
 from ..predicate import PredicateRegistry
 from ..predicate import match_instance
 from ..predicate import match_key
@@ -371,3 +376,448 @@ def test_nameless_predicate_key():
     p = match_key("a")
 
     assert p.key_by_predicate_name({}) is None
+
+
+def test_predicate_key_expression():
+    def get_key(a, b):
+        return b
+
+    assert match_key("a").key_expression(["a", "b"], "_f") == "a"
+    assert match_instance("a").key_expression(["a", "b"], "_f") == "a.__class__"
+    assert match_key("a", get_key).key_expression(["a", "b"], "_f") == "_f(a=a, b=b)"
+    assert match_instance("a", get_key).key_expression(["a", "b"], "_f") == "_f(a=a, b=b).__class__"
+    assert match_key("c").key_expression(["a", "b"], "_f") is None
+    assert Predicate("a", KeyIndex, lambda d: d["a"]).key_expression(["a"], "_f") is None
+
+
+def test_predicate_registry_resolve():
+    r = PredicateRegistry(match_key("a", fallback="fallback1"), match_key("b", fallback="fallback2"))
+
+    r.register(("A", "B"), "value")
+
+    assert r.resolve(("A", "B")) == "value"
+    assert r.resolve(("A", "C")) == "fallback2"
+    assert r.resolve(("C", "B")) == "fallback1"
+
+
+def test_predicate_registry_resolve_no_fallback():
+    r = PredicateRegistry(match_key("a"))
+
+    assert r.resolve(("A",)) is None
+
+
+def test_bitset_registry():
+    r = BitsetPredicateRegistry(match_instance("a", fallback="fallback1"), match_key("b", fallback="fallback2"))
+
+    class Foo(object):
+        pass
+
+    class FooSub(Foo):
+        pass
+
+    r.register((Foo, "B"), "foo")
+    r.register((FooSub, "B"), "foo sub")
+    r.register((object, "C"), "object")
+
+    assert r.known_values == ["foo", "foo sub", "object"]
+    assert r.indexes[0][Foo] == (0, 0b1)
+    assert r.indexes[0][FooSub] == (1, 0b1)
+    assert r.indexes[1]["B"] == (0, 0b11)
+    assert r.indexes[0][object] == (2, 0b1)
+
+    assert r.get((Foo, "B")) == ["foo"]
+    assert r.get((Foo, "C")) == []
+    assert r.component((Foo, "B")) == "foo"
+    assert r.component((FooSub, "B")) == "foo sub"
+    assert r.component((FooSub, "C")) == "object"
+    assert list(r.all((FooSub, "B"))) == ["foo sub", "foo"]
+    assert r.component((FooSub, "D")) is None
+    assert r.fallback((FooSub, "D")) == "fallback2"
+    assert r.fallback((int, "B")) == "fallback2"
+    assert r.resolve((int, "C")) == "object"
+
+    r2 = BitsetPredicateRegistry(match_instance("a", fallback="fallback1"), match_key("b", fallback="fallback2"))
+    r2.register((Foo, "B"), "foo")
+    assert r2.fallback((int, "B")) == "fallback1"
+
+
+def test_bitset_registry_same_value():
+    r = BitsetPredicateRegistry(match_key("a"))
+
+    r.register(("B",), "other")
+    r.register(("A",), "value")
+    r.register(("B2",), "value")
+
+    assert r.known_values == ["other", "value"]
+    assert r.component(("A",)) == "value"
+    assert r.component(("B2",)) == "value"
+
+
+def test_bitset_registry_lower_id():
+    r = BitsetPredicateRegistry(match_key("a"), match_key("b"))
+
+    r.register(("A", "X"), "first")
+    r.register(("B", "Y"), "second")
+    r.register(("B", "X"), "first")
+    r.register(("C", "Y"), "third")
+
+    assert r.indexes[0]["B"] == (0, 0b11)
+    assert r.indexes[1]["Y"] == (1, 0b11)
+    assert r.get(("B", "X")) == ["first"]
+    assert r.get(("B", "Y")) == ["second"]
+    assert r.get(("C", "X")) == []
+    assert r.get(("A", "Y")) == []
+
+
+def test_bitset_registry_no_predicates():
+    r = BitsetPredicateRegistry()
+
+    r.register((), "value")
+    assert r.component(()) == "value"
+
+    with pytest.raises(RegistrationError):
+        r.register((), "another")
+
+
+def test_bitset_registry_compact():
+    r = BitsetPredicateRegistry(match_key("a"))
+
+    r.register(("A",), "a")
+    r.compact()
+
+    assert r.known_values == ("a",)
+    assert r.component(("A",)) == "a"
+    with pytest.raises(RegistrationError):
+        r.register(("A",), "another")
+
+    r.register(("B",), "b")
+    r.register(("C",), "a")
+    assert r.known_values == ["a", "b"]
+    assert r.component(("B",)) == "b"
+    assert r.component(("C",)) == "a"
+
+
+@pytest.mark.parametrize("registry_class", [PredicateRegistry, BitsetPredicateRegistry, DecisionTreePredicateRegistry])
+def test_all_same_as_permutations(registry_class):
+    class A(object):
+        pass
+
+    class B(A):
+        pass
+
+    class C(B):
+        pass
+
+    class D(object):
+        pass
+
+    class E(D):
+        pass
+
+    r = registry_class(match_instance("a"), match_key("b"), match_instance("c"))
+
+    r.register((A, "x", D), "A x D")
+    r.register((B, "x", object), "B x object")
+    r.register((object, "x", E), "object x E")
+    r.register((C, "y", D), "C y D")
+    r.register((B, "x", E), "B x E")
+    r.register((object, "y", object), "object y object")
+
+    for key in [(C, "x", E), (C, "y", E), (A, "x", D), (object, "y", int), (int, "z", E)]:
+        expected = [value for p in r.permutations(key) for value in r.get(p)]
+        assert list(r.all(key)) == expected
+        assert r.component(key) == next(iter(expected), None)
+
+    assert list(r.all((C, "x", E))) == ["B x E", "B x object", "A x D", "object x E"]
+
+
+def test_decision_tree_registry():
+    r = DecisionTreePredicateRegistry(match_key("name", fallback="name fallback"), match_key("request_method", fallback="request_method fallback"), match_instance("body_model", fallback="body_model fallback"))
+
+    class Foo(object):
+        pass
+
+    class Bar(Foo):
+        pass
+
+    r.register(("foo", "POST", Foo), "post foo")
+    r.register(("foo", "POST", Bar), "post bar")
+    r.register(("bar", "GET", object), "get bar")
+
+    assert r.tree == {"foo": {"POST": {Foo: ["post foo"], Bar: ["post bar"]}}, "bar": {"GET": {object: ["get bar"]}}}
+
+    assert r.component(("baz", "GET", object)) is None
+    assert r.fallback(("baz", "GET", object)) == "name fallback"
+    assert r.fallback(("foo", "GET", object)) == "request_method fallback"
+    assert r.fallback(("bar", "POST", object)) == "request_method fallback"
+    assert r.fallback(("foo", "POST", object)) == "body_model fallback"
+    assert r.fallback(("foo", "POST", Bar)) is None
+    assert r.component(("foo", "POST", Foo)) == "post foo"
+    assert r.component(("foo", "POST", Bar)) == "post bar"
+    assert r.component(("bar", "GET", Bar)) == "get bar"
+    assert list(r.all(("foo", "POST", Bar))) == ["post bar", "post foo"]
+    assert r.get(("foo", "POST", Bar)) == ["post bar"]
+    assert r.get(("foo", "POST", object)) == []
+
+    with pytest.raises(RegistrationError):
+        r.register(("foo", "POST", Foo), "again")
+
+
+def test_decision_tree_registry_same_value():
+    r = DecisionTreePredicateRegistry(match_key("a"), match_key("b"))
+
+    r.register(("A", "X"), "value")
+    r.register(("B", "Y"), "value")
+
+    assert r.component(("A", "X")) == "value"
+    assert r.component(("B", "Y")) == "value"
+    # as with PredicateRegistry, combinations of keys are matched
+    assert r.component(("A", "Y")) == "value"
+    assert r.component(("B", "X")) == "value"
+
+
+class A(object):
+    pass
+
+
+class B(A):
+    pass
+
+
+@pytest.mark.parametrize("registry_class", [BitsetPredicateRegistry, DecisionTreePredicateRegistry])
+@pytest.mark.parametrize(
+    "registrations",
+    [
+        [((A, A), "v1"), ((B, B), "v1"), ((object, B), "v2"), ((A, object), "v3"), ((B, A), "v3"), ((object, object), "v4")],
+        # the values for A come in another order than they were first
+        # registered in
+        [((B, B), "v1"), ((A, B), "v2"), ((A, A), "v1"), ((B, A), "v2")],
+    ],
+)
+def test_registry_same_results(registry_class, registrations):
+    reference = PredicateRegistry(match_instance("a", fallback="a fallback"), match_instance("b", fallback="b fallback"))
+    r = registry_class(match_instance("a", fallback="a fallback"), match_instance("b", fallback="b fallback"))
+    for i, (key, value) in enumerate(registrations):
+        if i % 2:
+            r.register(key, value)
+        else:
+            r.register_many([(key, value)])
+        reference.register(key, value)
+        for key in product([A, B, object, int], repeat=2):
+            assert list(r.all(key)) == list(reference.all(key))
+            assert r.resolve(key) == reference.resolve(key)
+            assert r.fallback(key) == reference.fallback(key)
+
+
+def test_decision_tree_registry_no_predicates():
+    r = DecisionTreePredicateRegistry()
+
+    r.register((), "value")
+    assert r.component(()) == "value"
+    assert r.get(()) == ["value"]
+
+
+def test_key_index_registered_permutations():
+    i = KeyIndex()
+    i["GET"] = "value"
+
+    assert i.registered_permutations("GET") == ("GET",)
+    assert i.registered_permutations("POST") == ()
+
+
+def test_class_index_registered_permutations():
+    class Foo(object):
+        pass
+
+    class Bar(Foo):
+        pass
+
+    class Qux(Bar):
+        pass
+
+    i = ClassIndex()
+    i[Foo] = "foo"
+
+    assert i.registered_permutations(Qux) == (Foo,)
+    assert i.registered_permutations(Bar) == (Foo,)
+    assert i.registered_permutations(int) == ()
+
+    # adding keys updates the cached permutations of subclasses
+    i.setdefault(Bar, "bar")
+    assert i.registered_permutations(Qux) == (Bar, Foo)
+    assert i.registered_permutations(Foo) == (Foo,)
+    i[object] = "object"
+    assert i.registered_permutations(Qux) == (Bar, Foo, object)
+    assert i.registered_permutations(int) == (object,)
+
+
+@pytest.mark.parametrize("registry_class", [PredicateRegistry, BitsetPredicateRegistry, DecisionTreePredicateRegistry])
+def test_register_without_class_after_lookup(registry_class):
+    class Foo(object):
+        pass
+
+    r = registry_class(match_instance("a"), match_instance("b"))
+    r.register((Foo, Foo), "foo foo")
+    assert r.resolve((Foo, Foo)) == "foo foo"
+    # the predicate that is left out has None as its key item
+    r.register((Foo, None), "foo")
+    assert r.resolve((Foo, Foo)) == "foo foo"
+
+
+def test_class_index_registered_permutations_weak():
+    import gc
+
+    class Foo(object):
+        pass
+
+    i = ClassIndex()
+    i[Foo] = "foo"
+
+    class Bar(Foo):
+        pass
+
+    assert i.registered_permutations(Bar) == (Foo,)
+    assert len(i._registered_mro) == 1
+    del Bar
+    gc.collect()
+    assert len(i._registered_mro) == 0
+
+
+def test_matches_everything():
+    assert ClassIndex().matches_everything(object)
+    assert not ClassIndex().matches_everything(int)
+    assert not KeyIndex().matches_everything(object)
+
+
+def test_lazy_resolver():
+    evaluated = []
+
+    def get_name(d):
+        evaluated.append("name")
+        return d["name"]
+
+    def get_model(d):
+        evaluated.append("model")
+        return d["model"].__class__
+
+    registry = PredicateRegistry(
+        Predicate("name", KeyIndex, get_name, "name fallback"),
+        Predicate("model", ClassIndex, get_model, "model fallback"),
+    )
+    registry.register(("view", object), "view")
+    registry.register(("edit", int), "edit int")
+    resolver = LazyResolver(registry, registry.resolve)
+
+    assert resolver.resolve(name="view", model=1) == "view"
+    assert evaluated == ["name"]
+    del evaluated[:]
+    assert resolver.resolve(name="edit", model=1) == "edit int"
+    assert evaluated == ["name", "model"]
+    del evaluated[:]
+    assert resolver.resolve(name="edit", model="x") == "model fallback"
+    assert resolver.resolve(name="other", model="x") == "name fallback"
+
+    registry.register(("other", object), "other")
+    resolver.reset()
+    assert resolver.resolve(name="other", model="x") == "other"
+
+
+def test_lazy_resolver_same_results():
+    class A(object):
+        pass
+
+    class B(A):
+        pass
+
+    registrations = [((A, B), "v1"), ((object, object), "v1"), ((object, B), "v1"), ((object, A), "v0"), ((B, object), "v2"), ((B, B), "v0")]
+    registry = PredicateRegistry(match_instance("a", fallback="a fallback"), match_instance("b", fallback="b fallback"))
+    resolver = LazyResolver(registry, registry.resolve)
+    for key, value in registrations:
+        registry.register(key, value)
+        resolver.reset()
+        for a, b in product([A, B, int], repeat=2):
+            assert resolver.resolve(a=a(), b=b()) == registry.resolve((a, b))
+
+
+def test_lazy_resolver_max_nodes():
+    registry = PredicateRegistry(match_key("name", fallback="name fallback"), match_instance("model", fallback="model fallback"))
+    registry.register(("edit", int), "edit int")
+    resolver = LazyResolver(registry, registry.resolve, max_nodes=2)
+
+    assert resolver.resolve(name="edit", model=1) == "edit int"
+    root = resolver._root
+    assert resolver._nodes == 2
+    assert resolver.resolve(name="edit", model=1) == "edit int"
+    assert resolver._root is root
+    # a third node drops the tree
+    assert resolver.resolve(name="edit", model="x") == "model fallback"
+    assert resolver._root is None
+    assert resolver.resolve(name="other", model=1) == "name fallback"
+    assert resolver._root is not root
+    assert resolver._nodes == 1
+
+
+def test_affects():
+    class Model(object):
+        pass
+
+    class Sub(Model):
+        pass
+
+    r = PredicateRegistry(match_instance("obj"), match_key("name"))
+    r.register((Sub, "edit"), "sub edit")
+    assert r.affects((Sub, "edit"), (Sub, "view"))
+    assert r.affects((Sub, "edit"), (object, "edit"))
+    assert not r.affects((Sub, "edit"), (Model, "view"))
+    assert not r.affects((Sub, "edit"), (object, "view"))
+
+
+def test_affects_without_predicates():
+    r = PredicateRegistry()
+    r.register((), "value")
+    assert r.affects((), ())
+
+
+@pytest.mark.parametrize("registry_class", [PredicateRegistry, BitsetPredicateRegistry, DecisionTreePredicateRegistry])
+def test_register_many(registry_class):
+    class Base(object):
+        pass
+
+    class Sub(Base):
+        pass
+
+    registrations = [((Base, "a"), "base a"), ((Sub, "a"), "sub a"), ((Base, "b"), "base b"), ((object, "a"), "object a")]
+
+    def make():
+        return registry_class(match_instance("obj", fallback="obj fallback"), match_key("name", fallback="name fallback"))
+
+    one_by_one = make()
+    for key, value in registrations:
+        one_by_one.register(key, value)
+    at_once = make()
+    registered = []
+    at_once.add_listener(registered.append)
+    at_once.register_many(iter(registrations))
+
+    assert registered == [key for key, value in registrations]
+    assert at_once.generation == len(registrations)
+    assert at_once.known_keys == one_by_one.known_keys
+    for key in [(Sub, "a"), (Sub, "b"), (Base, "a"), (Base, "c"), (int, "a"), (int, "b")]:
+        assert list(at_once.all(key)) == list(one_by_one.all(key))
+        assert at_once.resolve(key) == one_by_one.resolve(key)
+
+    at_once.register_many([((Sub, "b"), "sub b")])
+    assert at_once.resolve((Sub, "b")) == "sub b"
+
+
+@pytest.mark.parametrize("registry_class", [PredicateRegistry, BitsetPredicateRegistry, DecisionTreePredicateRegistry])
+def test_register_many_duplicate(registry_class):
+    r = registry_class(match_key("name"))
+    r.register(("a",), "a")
+    with pytest.raises(RegistrationError):
+        r.register_many([(("b",), "b"), (("a",), "other a")])
+    with pytest.raises(RegistrationError):
+        r.register_many([(("c",), "c"), (("c",), "other c")])
+    # nothing was registered
+    assert r.known_keys == {("a",): "a"}
+    assert r.generation == 1
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import itertools
+import json
+import sys
+
+import pytest
+from ..cache import DictCachingKeyLookup
+from ..error import RegistrationError
+from ..snapshot import load_snapshot
+from ..snapshot import save_snapshot
+from .fixtures.views import make_view
+
+MODELS = """
+class Document(object):
+    pass
+
+
+class Report(Document):
+    pass
+"""
+
+VIEWS = """
+def document_get(obj, name):
+    return "document get"
+
+
+def report_edit(obj, name):
+    return "report edit"
+"""
+
+_counter = itertools.count()
+
+
+@pytest.fixture
+def plugin(tmp_path, monkeypatch):
+    """The name of a package with models and views modules.
+
+    The package is not imported yet, and is removed from
+    ``sys.modules`` afterwards.
+    """
+    name = "plugin_%d" % next(_counter)
+    package = tmp_path / name
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "models.py").write_text(MODELS)
+    (package / "views.py").write_text(VIEWS)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield name
+    for module in [name, name + ".models", name + ".views"]:
+        sys.modules.pop(module, None)
+
+
+@pytest.mark.parametrize("get_key_lookup", [lambda registry: registry, DictCachingKeyLookup])
+def test_register_by_name(plugin, get_key_lookup):
+    view = make_view(get_key_lookup=get_key_lookup)
+    view.register(plugin + ".views:document_get", obj=plugin + ".models:Document", name="get")
+    assert plugin + ".models" not in sys.modules
+    assert plugin + ".views" not in sys.modules
+    assert view(1, "get") == "default"
+
+    models = __import__(plugin + ".models", fromlist=["Document"])
+    assert plugin + ".views" not in sys.modules
+    assert view(models.Document(), "get") == "document get"
+    assert plugin + ".views" in sys.modules
+    assert view(models.Document(), "other") == "name fallback"
+    # registered for the class now
+    assert view.by_predicates(obj=models.Document, name="get").component is not None
+
+
+def test_register_by_name_subclass(plugin):
+    view = make_view()
+    view.register(plugin + ".views:document_get", obj=plugin + ".models:Document", name="get")
+    models = __import__(plugin + ".models", fromlist=["Report"])
+    assert view(models.Report(), "get") == "document get"
+
+
+def test_register_class_by_name(plugin):
+    view = make_view()
+
+    def document_view(obj, name):
+        return "document view"
+
+    view.register(document_view, obj=plugin + ".models:Document", name="view")
+    view.register(lambda obj, name: "int", obj=int, name="view")
+    assert view(1, "view") == "int"
+    models = __import__(plugin + ".models", fromlist=["Document"])
+    assert view(models.Document(), "view") == "document view"
+
+
+def test_register_implementation_by_name(plugin):
+    view = make_view()
+    view.register(plugin + ".views:document_get", obj=int, name="get")
+    # the class is there, so this is registered right away
+    assert view.by_predicates(obj=int, name="get").component is not None
+    assert plugin + ".views" not in sys.modules
+    assert view(1, "get") == "document get"
+
+
+def test_register_by_name_imported(plugin):
+    models = __import__(plugin + ".models", fromlist=["Document"])
+    views = __import__(plugin + ".views", fromlist=["document_get"])
+    view = make_view()
+    view.register(plugin + ".views:document_get", obj=plugin + ".models:Document", name="get")
+    assert view.by_predicates(obj=models.Document, name="get").component is views.document_get
+
+    with pytest.raises(RegistrationError):
+        view.register(plugin + ".views:report_edit", obj=plugin + ".models:Document", name="get")
+
+
+def test_register_by_name_duplicate(plugin):
+    view = make_view()
+    view.register(plugin + ".views:document_get", obj=plugin + ".models:Document", name="get")
+    with pytest.raises(RegistrationError):
+        view.register(plugin + ".views:report_edit", obj=plugin + ".models:Document", name="get")
+
+
+def test_import_pending(plugin):
+    view = make_view()
+    view.register(plugin + ".views:report_edit", obj=plugin + ".models:Report", name="edit")
+    view.import_pending()
+    assert plugin + ".models" in sys.modules
+    assert plugin + ".views" not in sys.modules
+    models = sys.modules[plugin + ".models"]
+    assert view.by_predicates(obj=models.Report, name="edit").component is not None
+    assert view(models.Report(), "edit") == "report edit"
+
+
+def test_freeze_imports_pending(plugin):
+    view = make_view()
+    view.register(plugin + ".views:report_edit", obj=plugin + ".models:Report", name="edit")
+    view.freeze()
+    models = sys.modules[plugin + ".models"]
+    assert view(models.Report(), "edit") == "report edit"
+
+
+def test_register_many_by_name(plugin):
+    view = make_view()
+
+    def int_view(obj, name):
+        return "int"
+
+    view.register_many([(plugin + ".views:document_get", {"obj": plugin + ".models:Document", "name": "get"}), (int_view, {"obj": int, "name": "get"})])
+    assert view(1, "get") == "int"
+    models = __import__(plugin + ".models", fromlist=["Document"])
+    assert view(models.Document(), "get") == "document get"
+
+
+def test_clean_by_name(plugin):
+    view = make_view()
+    view.register(plugin + ".views:document_get", obj=plugin + ".models:Document", name="get")
+    view.clean()
+    models = __import__(plugin + ".models", fromlist=["Document"])
+    assert view(models.Document(), "get") == "default"
+
+
+def test_register_pending_duplicate(plugin):
+    view = make_view()
+    view.register(plugin + ".views:document_get", obj=plugin + ".models:Document", name="get")
+    models = __import__(plugin + ".models", fromlist=["Document"])
+
+    def document_view(obj, name):
+        return "document view"
+
+    # raised here rather than by the call that imports the pending key
+    with pytest.raises(RegistrationError):
+        view.register(document_view, obj=models.Document, name="get")
+    with pytest.raises(RegistrationError):
+        view.register(plugin + ".views:report_edit", obj=models.Document, name="get")
+    with pytest.raises(RegistrationError):
+        view.register_many([(document_view, {"obj": models.Document, "name": "get"})])
+    assert view(models.Document(), "get") == "document get"
+
+
+def test_register_many_by_name_atomic(plugin):
+    view = make_view()
+
+    def int_view(obj, name):
+        return "int"
+
+    with pytest.raises(RegistrationError):
+        view.register_many(
+            [
+                (int_view, {"obj": int, "name": "get"}),
+                (plugin + ".views:document_get", {"obj": plugin + ".models:Document", "name": "get"}),
+                (plugin + ".views:report_edit", {"obj": plugin + ".models:Document", "name": "get"}),
+            ]
+        )
+    assert view(1, "get") == "default"
+    models = __import__(plugin + ".models", fromlist=["Document"])
+    assert view(models.Document(), "get") == "default"
+
+    view.register(int_view, obj=int, name="get")
+    with pytest.raises(RegistrationError):
+        view.register_many([(plugin + ".views:document_get", {"obj": models.Document, "name": "get"}), (int_view, {"obj": int, "name": "get"})])
+    assert view(models.Document(), "get") == "default"
+
+
+def test_save_snapshot_pending(plugin, tmp_path):
+    view = make_view()
+    view.register(plugin + ".views:document_get", obj=plugin + ".models:Document", name="get")
+    path = str(tmp_path / "view.json")
+    save_snapshot(view, path)
+    assert plugin + ".models" not in sys.modules
+    with open(path) as f:
+        data = json.load(f)
+    assert data["registrations"] == [[[{"class": plugin + ".models:Document"}, "get"], plugin + ".views:document_get"]]
+
+    loaded = make_view()
+    load_snapshot(loaded, path)
+    models = sys.modules[plugin + ".models"]
+    assert loaded(models.Document(), "get") == "document get"
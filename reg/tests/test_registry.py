@@ -1,8 +1,12 @@
 from __future__ import annotations
 from __future__ import unicode_literals
 
+import gc
 import inspect
 import pytest
+import weakref
+from ..cache import AdaptiveCachingKeyLookup
+from ..cache import CanonicalCachingKeyLookup
 from ..cache import DictCachingKeyLookup
 from ..cache import LruCachingKeyLookup
 from ..dispatch import dispatch
@@ -231,11 +235,13 @@ def test_dict_caching_registry():
     assert view.by_predicates(model=Foo, name="", request_method="GET").key == (Foo, "", "GET")
 
     # use a bit of inside knowledge to check the cache is filled
-    assert view.key_lookup.component.__self__.get((Foo, "", "GET")) is not None
-    assert view.key_lookup.component.__self__.get((FooSub, "", "GET")) is not None
-    assert view.key_lookup.component.__self__.get((FooSub, "edit", "POST")) is not None
+    assert view.key_lookup.resolve.__self__.get((Foo, "", "GET")) is foo_default
+    assert view.key_lookup.resolve.__self__.get((FooSub, "", "GET")) is foo_default
+    assert view.key_lookup.resolve.__self__.get((FooSub, "edit", "POST")) is foo_edit
+    # dispatch calls do not fill the component cache
+    assert view.key_lookup.component.__self__.get((Foo, "", "GET")) is None
 
-    # now let's do this again. this time things come from the component cache
+    # now let's do this again. this time things come from the resolve cache
     assert view(Foo(), Request("", "GET")) == "foo default"
     assert view(FooSub(), Request("", "GET")) == "foo default"
     assert view(FooSub(), Request("edit", "POST")) == "foo edit"
@@ -255,10 +261,11 @@ def test_dict_caching_registry():
     assert view(Foo(), Request("", "PUT")) == "Request method fallback"
     assert view(FooSub(), Request("dummy", "GET")) == "Name fallback"
 
-    # fallbacks get cached too
-    assert key_lookup.fallback.__self__.get((Bar, "", "GET")) is model_fallback
+    # fallbacks get cached in the same table
+    assert key_lookup.resolve.__self__.get((Bar, "", "GET")) is model_fallback
+    assert key_lookup.fallback.__self__.get((Bar, "", "GET")) is None
 
-    # these come from the fallback cache now
+    # these come from the resolve cache now
     assert view(Bar(), Request("", "GET")) == "Model fallback"
     assert view(Foo(), Request("dummy", "GET")) == "Name fallback"
     assert view(Foo(), Request("", "PUT")) == "Request method fallback"
@@ -326,12 +333,15 @@ def test_lru_caching_registry():
     assert view.by_predicates(model=Foo, name="", request_method="GET").key == (Foo, "", "GET")
 
     # use a bit of inside knowledge to check the cache is filled
-    component_cache = view.key_lookup.component.__closure__[0].cell_contents
-    assert component_cache.get(((Foo, "", "GET"),)) is not None
-    assert component_cache.get(((FooSub, "", "GET"),)) is not None
-    assert component_cache.get(((FooSub, "edit", "POST"),)) is not None
-
-    # now let's do this again. this time things come from the component cache
+    resolve_cache = view.key_lookup.resolve._cache
+    assert resolve_cache.get(((Foo, "", "GET"),)) is foo_default
+    assert resolve_cache.get(((FooSub, "", "GET"),)) is foo_default
+    assert resolve_cache.get(((FooSub, "edit", "POST"),)) is foo_edit
+    # dispatch calls do not fill the component cache
+    component_cache = view.key_lookup.component._cache
+    assert component_cache.get(((Foo, "", "GET"),)) is None
+
+    # now let's do this again. this time things come from the resolve cache
     assert view(Foo(), Request("", "GET")) == "foo default"
     assert view(FooSub(), Request("", "GET")) == "foo default"
     assert view(FooSub(), Request("edit", "POST")) == "foo edit"
@@ -351,12 +361,301 @@ def test_lru_caching_registry():
     assert view(Foo(), Request("", "PUT")) == "Request method fallback"
     assert view(FooSub(), Request("dummy", "GET")) == "Name fallback"
 
-    # fallbacks get cached too
-    fallback_cache = view.key_lookup.fallback.__closure__[0].cell_contents
-    assert fallback_cache.get(((Bar, "", "GET"),)) is model_fallback
+    # fallbacks get cached in the same table
+    assert resolve_cache.get(((Bar, "", "GET"),)) is model_fallback
 
-    # these come from the fallback cache now
+    # these come from the resolve cache now
     assert view(Bar(), Request("", "GET")) == "Model fallback"
     assert view(Foo(), Request("dummy", "GET")) == "Name fallback"
     assert view(Foo(), Request("", "PUT")) == "Request method fallback"
     assert view(FooSub(), Request("dummy", "GET")) == "Name fallback"
+
+
+def test_key_lookup_without_resolve():
+    class ComponentKeyLookup(object):
+        def __init__(self, registry):
+            self.component = registry.component
+            self.fallback = registry.fallback
+            self.all = registry.all
+
+    @dispatch(match_instance("obj", fallback=lambda obj: "obj fallback"), get_key_lookup=ComponentKeyLookup)
+    def foo(obj):
+        return "default"
+
+    class Bar(object):
+        pass
+
+    foo.register(lambda obj: "bar", obj=Bar)
+
+    assert foo(Bar()) == "bar"
+    assert foo(object()) == "obj fallback"
+
+
+def test_canonical_caching_registry():
+    class Model(object):
+        pass
+
+    class Other(object):
+        pass
+
+    def model_view(obj, name):
+        return "model view"
+
+    def other_view(obj, name):
+        return "other view"
+
+    def mixed_view(obj, name):
+        return "mixed view"
+
+    @dispatch("obj", match_key("name", fallback=lambda obj, name: "name fallback"), get_key_lookup=CanonicalCachingKeyLookup)
+    def view(obj, name):
+        return "default"
+
+    view.register(model_view, obj=Model, name="view")
+    view.register(other_view, obj=Other, name="view")
+    view.register(mixed_view, obj=Other, name="mixed")
+
+    subclasses = [type("Tenant%d" % i, (Model,), {}) for i in range(10)]
+    for subclass in subclasses:
+        assert view(subclass(), "view") == "model view"
+        assert view(subclass(), "edit") == "name fallback"
+        assert view(subclass(), "unknown") == "name fallback"
+
+    key_lookup = view.key_lookup
+    assert key_lookup.canonical((subclasses[0], "view")) == (Model, "view")
+    assert key_lookup.canonical((subclasses[0], "unknown")) == (Model, "edit")
+    # all subclasses share the cache entries of their base class
+    assert list(key_lookup._resolved) == [(Model, "view"), (Model, "edit")]
+
+    class Both(Model, Other):
+        pass
+
+    class BothSub(Both):
+        pass
+
+    # the canonical item needs to have the same registered base classes
+    assert key_lookup.canonical((BothSub, "mixed")) == (BothSub, "mixed")
+    assert view(BothSub(), "mixed") == "mixed view"
+    assert view(Both(), "mixed") == "mixed view"
+    assert view(Model(), "mixed") == "name fallback"
+    assert view(object(), "view") == "default"
+
+    assert view.by_args(subclasses[1](), "view").all_matches == [model_view]
+    assert view.by_args(BothSub(), "view").component is model_view
+    assert view.by_args(BothSub(), "edit").fallback is not None
+
+
+def test_canonical_caching_registry_weak():
+    import gc
+
+    class Model(object):
+        pass
+
+    @dispatch("obj", get_key_lookup=CanonicalCachingKeyLookup)
+    def view(obj):
+        return "default"
+
+    view.register(lambda obj: "model", obj=Model)
+
+    Tenant = type("Tenant", (Model,), {})
+    Unregistered = type("Unregistered", (object,), {})
+    assert view(Tenant()) == "model"
+    assert view(Unregistered()) == "default"
+
+    canonical_items = view.key_lookup._canonical_items[0]
+    assert len(canonical_items) == 2
+    del Tenant
+    gc.collect()
+    assert len(canonical_items) == 1
+
+
+@pytest.mark.parametrize(
+    "get_key_lookup",
+    [DictCachingKeyLookup, LruCachingKeyLookup, CanonicalCachingKeyLookup],
+)
+def test_caching_registry_register_later(get_key_lookup):
+    class Model(object):
+        pass
+
+    class Sub(Model):
+        pass
+
+    class Other(object):
+        pass
+
+    @dispatch("obj", match_key("name", fallback=lambda obj, name: "name fallback"), get_key_lookup=get_key_lookup)
+    def view(obj, name):
+        return "default"
+
+    view.register(lambda obj, name: "model view", obj=Model, name="view")
+    view.register(lambda obj, name: "other view", obj=Other, name="view")
+
+    assert view(Sub(), "view") == "model view"
+    assert view(Sub(), "edit") == "name fallback"
+    assert view(Other(), "view") == "other view"
+    assert view(Other(), "edit") == "name fallback"
+    assert view.by_args(Sub(), "view").all_matches == [view.by_args(Model(), "view").component]
+
+    view.register(lambda obj, name: "sub view", obj=Sub, name="view")
+    view.register(lambda obj, name: "model edit", obj=Model, name="edit")
+
+    assert view(Sub(), "view") == "sub view"
+    assert view(Sub(), "edit") == "model edit"
+    assert view.by_args(Sub(), "view").all_matches == [
+        view.by_args(Sub(), "view").component,
+        view.by_args(Model(), "view").component,
+    ]
+    assert view(Other(), "view") == "other view"
+    assert view(Other(), "edit") == "name fallback"
+
+
+def test_dict_caching_registry_register_later_evicts_affected():
+    class Model(object):
+        pass
+
+    class Sub(Model):
+        pass
+
+    class Other(object):
+        pass
+
+    @dispatch("obj", match_key("name"), get_key_lookup=DictCachingKeyLookup)
+    def view(obj, name):
+        return "default"
+
+    view.register(lambda obj, name: "model view", obj=Model, name="view")
+
+    for obj in [Model(), Sub(), Other()]:
+        view(obj, "view")
+        view(obj, "edit")
+    cache = view.key_lookup.resolve.__self__
+    assert len(cache) == 6
+
+    view.register(lambda obj, name: "sub edit", obj=Sub, name="edit")
+    # only the lookups for Sub and for "edit" can be affected
+    assert set(cache) == {(Model, "view"), (Other, "view")}
+
+
+def test_key_lookup_generation():
+    @dispatch("obj")
+    def view(obj):
+        return "default"
+
+    registry = view.register.__self__.registry
+    generation = registry.generation
+    view.register(lambda obj: "int", obj=int)
+    assert registry.generation == generation + 1
+
+
+@pytest.mark.parametrize(
+    "get_key_lookup, resolve_cache_size",
+    [
+        (lambda r: DictCachingKeyLookup(r, weak=True), lambda key_lookup: len(key_lookup.resolve.__self__)),
+        (lambda r: LruCachingKeyLookup(r, 100, 100, 100, weak=True), lambda key_lookup: len(key_lookup.resolve._cache.data)),
+    ],
+)
+def test_weak_caching_registry(get_key_lookup, resolve_cache_size):
+    class Model(object):
+        pass
+
+    @dispatch("obj", match_key("name", fallback=lambda obj, name: "name fallback"), get_key_lookup=get_key_lookup)
+    def view(obj, name):
+        return "default"
+
+    view.register(lambda obj, name: "model view", obj=Model, name="view")
+
+    def use_subclass():
+        class Tenant(Model):
+            pass
+
+        assert view(Tenant(), "view") == "model view"
+        assert view(Tenant(), "edit") == "name fallback"
+        assert view.by_args(Tenant(), "view").all_matches == [view.by_args(Model(), "view").component]
+        return weakref.ref(Tenant)
+
+    references = [use_subclass() for i in range(10)]
+    assert view(Model(), "view") == "model view"
+    gc.collect()
+    assert [reference() for reference in references] == [None] * 10
+
+    # only the entry for Model is left
+    assert resolve_cache_size(view.key_lookup) == 1
+
+    # registering later still works
+    view.register(lambda obj, name: "model edit", obj=Model, name="edit")
+    assert view(Model(), "edit") == "model edit"
+
+
+def test_weak_lru_caching_registry_many_keys():
+    class Model(object):
+        pass
+
+    @dispatch("obj", match_key("name"), get_key_lookup=lambda r: LruCachingKeyLookup(r, weak=True))
+    def view(obj, name):
+        return "default"
+
+    view.register(lambda obj, name: "model view", obj=Model, name="view")
+    for i in range(10000):
+        assert view(Model(), i) == "default"
+    # the weak keys the cache has evicted are no longer watched
+    watched = view.key_lookup._weak_keys._watched
+    assert sum(len(weak_keys) for weak_keys in watched.values()) <= 128
+    assert view(Model(), "view") == "model view"
+
+
+def make_adaptive_view(**kw):
+    @dispatch(
+        match_key("name", fallback=lambda name: "fallback"),
+        get_key_lookup=lambda r: AdaptiveCachingKeyLookup(r, **kw),
+    )
+    def view(name):
+        return "default"
+
+    view.register(lambda name: "view", name="view")
+    view.register(lambda name: "edit", name="edit")
+    return view
+
+
+def test_adaptive_caching_registry_repeated_keys():
+    view = make_adaptive_view(sample_size=10)
+    key_lookup = view.key_lookup
+    assert key_lookup.mode == "uncached"
+    for i in range(10):
+        assert view("view") == "view"
+        assert view("other") == "fallback"
+    assert key_lookup.mode == "dict"
+    assert key_lookup.reasons == ["dict: 8 of 10 sampled lookups repeated a key"]
+    assert view("edit") == "edit"
+    assert sorted(key_lookup._cache) == [("edit",), ("other",), ("view",)]
+
+    view.register(lambda name: "other", name="other")
+    assert sorted(key_lookup._cache) == [("edit",), ("view",)]
+    assert view("other") == "other"
+    assert view.by_args("view").all_matches == [view.by_args("view").component]
+
+
+def test_adaptive_caching_registry_unique_keys():
+    view = make_adaptive_view(sample_size=10)
+    for i in range(100):
+        assert view(i) == "fallback"
+    assert view.key_lookup.mode == "uncached"
+    assert view.key_lookup.reasons == []
+
+
+def test_adaptive_caching_registry_growing_keys():
+    view = make_adaptive_view(sample_size=10, max_size=20)
+    key_lookup = view.key_lookup
+    for i in range(10):
+        view(i % 3)
+    assert key_lookup.mode == "dict"
+    assert key_lookup.working_set == 3
+    for i in range(100):
+        assert view(i) == "fallback"
+    assert key_lookup.mode == "lru"
+    assert key_lookup.reasons[-1] == "lru: more than 20 distinct keys, using 6 entries for a working set of 3 keys"
+    assert len(key_lookup._cache.data) == 6
+
+    assert view("view") == "view"
+    view.register(lambda name: "other", name="other")
+    assert view("other") == "other"
+    assert view("view") == "view"
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+from ..dispatch import dispatch
+from ..error import RegistrationError
+from ..snapshot import load_snapshot
+from ..snapshot import save_snapshot
+from .fixtures.views import Document
+from .fixtures.views import Report
+from .fixtures.views import document_view
+from .fixtures.views import make_view
+from .fixtures.views import report_edit
+
+
+def test_snapshot(tmp_path):
+    view = make_view()
+    view.register(document_view, obj=Document, name="view")
+    view.register(report_edit, obj=Report, name="edit")
+    path = str(tmp_path / "view.json")
+    save_snapshot(view, path)
+    with open(path) as f:
+        data = json.load(f)
+    assert data["version"] == 1
+    assert data["predicates"] == ["obj", "name"]
+    assert data["registrations"] == [
+        [[{"class": "reg.tests.fixtures.views:Document"}, "view"], "reg.tests.fixtures.views:document_view"],
+        [[{"class": "reg.tests.fixtures.views:Report"}, "edit"], "reg.tests.fixtures.views:report_edit"],
+    ]
+
+    loaded = make_view()
+    load_snapshot(loaded, path)
+    implementation = loaded.by_predicates(obj=Report, name="view").component
+    assert implementation.snapshot_name == "reg.tests.fixtures.views:document_view"
+    assert loaded(Report(), "view") == "document view"
+    assert loaded(Report(), "edit") == "report edit"
+    assert loaded(Report(), "other") == "name fallback"
+    assert loaded(object(), "view") == "default"
+
+    # a loaded dispatch function can be saved again
+    save_snapshot(loaded, path)
+    with open(path) as f:
+        assert json.load(f) == data
+
+    with pytest.raises(RegistrationError):
+        load_snapshot(loaded, path)
+
+
+def test_snapshot_implementation_not_importable(tmp_path):
+    view = make_view()
+    view.register(lambda obj, name: "lambda", obj=Document, name="view")
+    with pytest.raises(ValueError):
+        save_snapshot(view, str(tmp_path / "view.json"))
+
+
+def test_snapshot_mismatch(tmp_path):
+    view = make_view()
+    view.register(document_view, obj=Document, name="view")
+    path = str(tmp_path / "view.json")
+    save_snapshot(view, path)
+
+    @dispatch("obj")
+    def other(obj):
+        return "default"
+
+    with pytest.raises(ValueError):
+        load_snapshot(other, path)
+
+    with open(path) as f:
+        data = json.load(f)
+    data["version"] = 0
+    with open(path, "w") as f:
+        json.dump(data, f)
+    with pytest.raises(ValueError):
+        load_snapshot(make_view(), path)
+
+
+def test_snapshot_deferred(tmp_path):
+    view = make_view(deferred=True)
+    view.register(document_view, obj=Document, name="view")
+    path = str(tmp_path / "view.json")
+    save_snapshot(view, path)
+
+    loaded = make_view(deferred=True)
+    load_snapshot(loaded, path)
+    assert loaded(Report(), "view") == "document view"
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from ..cache import DictCachingKeyLookup
+from ..dispatch import dispatch
+from ..predicate import match_instance
+from ..predicate import match_key
+from ..warm import KeyRecorder
+from ..warm import dotted_name
+from ..warm import resolve_dotted_name
+from ..warm import warm_from_file
+from .fixtures.views import Document
+from .fixtures.views import Report
+
+
+@dispatch(
+    match_instance("obj"),
+    match_key("name", fallback=lambda obj, name: "name fallback"),
+    get_key_lookup=DictCachingKeyLookup,
+)
+def view(obj, name):
+    return "default"
+
+
+view.register(lambda obj, name: "document view", obj=Document, name="view")
+
+
+def cached_keys(dispatch_function):
+    return set(dispatch_function.key_lookup.resolve.__self__)
+
+
+def test_warm():
+    @dispatch(match_instance("obj"), get_key_lookup=DictCachingKeyLookup)
+    def target(obj):
+        return "default"
+
+    target.register(lambda obj: "document", obj=Document)
+    target.warm([(Report,), (int,)])
+    assert cached_keys(target) == {(Report,), (int,)}
+    assert target(Report()) == "document"
+
+
+def test_record_and_warm_from_file(tmp_path):
+    recorder = KeyRecorder()
+    view.record(recorder)
+    try:
+        assert view(Report(), "view") == "document view"
+        assert view(Report(), "edit") == "name fallback"
+        assert view(Report(), "view") == "document view"
+        assert view(1, "view") == "default"
+    finally:
+        view.record(None)
+    assert recorder.keys == {
+        "reg.tests.test_warm:view": {(Report, "view"), (Report, "edit"), (int, "view")},
+    }
+
+    # recording has stopped
+    view(Document(), "view")
+    assert (Document, "view") not in recorder.keys["reg.tests.test_warm:view"]
+
+    path = str(tmp_path / "keys.json")
+    recorder.save(path)
+    with open(path) as f:
+        data = json.load(f)
+    assert data["dispatches"]["reg.tests.test_warm:view"] == [
+        [{"class": "builtins:int"}, "view"],
+        [{"class": "reg.tests.fixtures.views:Report"}, "edit"],
+        [{"class": "reg.tests.fixtures.views:Report"}, "view"],
+    ]
+
+    view.clean()
+    view.register(lambda obj, name: "document view", obj=Document, name="view")
+    assert cached_keys(view) == set()
+    assert warm_from_file(path) == 3
+    assert cached_keys(view) == {(Report, "view"), (Report, "edit"), (int, "view")}
+    assert view(Report(), "view") == "document view"
+
+
+def test_warm_from_file_version(tmp_path):
+    path = tmp_path / "keys.json"
+    path.write_text(json.dumps({"version": 2, "dispatches": {}}))
+    with pytest.raises(ValueError):
+        warm_from_file(str(path))
+
+
+def test_save_skips_keys_that_cannot_be_imported(tmp_path):
+    class Local(object):
+        pass
+
+    recorder = KeyRecorder()
+    recorder.keys["reg.tests.test_warm:view"] = {(Local, "view"), (Report, ("a", "tuple")), (Report, "view")}
+    recorder.keys["reg.tests.test_warm:gone"] = {(Report, "view")}
+    path = str(tmp_path / "keys.json")
+    recorder.save(path)
+    with open(path) as f:
+        data = json.load(f)
+    assert data["dispatches"]["reg.tests.test_warm:view"] == [[{"class": "reg.tests.fixtures.views:Report"}, "view"]]
+    # dispatch functions that are gone are skipped
+    assert warm_from_file(path) == 1
+
+
+def test_dotted_name():
+    assert dotted_name(Report) == "reg.tests.fixtures.views:Report"
+    assert resolve_dotted_name("reg.tests.fixtures.views:Report") is Report
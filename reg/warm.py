@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import importlib
+import json
+
+KEYS_VERSION = 1
+
+
+class KeyRecorder(object):
+    """Record the keys that dispatch functions look up.
+
+    Use :meth:`reg.Dispatch.record` to record the keys of a dispatch
+    function, and :meth:`save` to store the distinct keys in a file.
+    At startup, :func:`reg.warm_from_file` then looks up these keys in
+    advance, so that caching key lookups are warm before the first
+    call.
+
+    Only keys whose items are classes, strings, numbers, booleans or
+    ``None`` can be saved. Classes are stored by their qualified name,
+    so they need to be importable.
+    """
+
+    def __init__(self):
+        #: maps the names of dispatch functions to the set of keys
+        #: they looked up.
+        self.keys = {}
+
+    def recording(self, dispatch, resolve):
+        """Wrap the resolve function of a dispatch function.
+
+        :param dispatch: the :class:`reg.Dispatch`.
+        :param resolve: a function that resolves keys.
+        :returns: a function that records its keys, and then calls
+          ``resolve``.
+        """
+        keys = self.keys.setdefault(dotted_name(dispatch.wrapped_func), set())
+
+        def recording_resolve(key):
+            keys.add(key)
+            return resolve(key)
+
+        return recording_resolve
+
+    def save(self, path):
+        """Save the recorded keys to a file.
+
+        Keys that cannot be saved are left out.
+
+        :param path: the path of the file.
+        """
+        dispatches = {}
+        for name, keys in list(self.keys.items()):
+            encoded_keys = []
+            for key in list(keys):
+                try:
+                    encoded_keys.append([encode_key_item(item) for item in key])
+                except ValueError:
+                    continue
+            dispatches[name] = sorted(encoded_keys, key=repr)
+        with open(path, "w") as f:
+            json.dump({"version": KEYS_VERSION, "dispatches": dispatches}, f, separators=(",", ":"))
+
+
+def warm_from_file(path):
+    """Look up the keys saved by a :class:`reg.KeyRecorder`.
+
+    This imports the dispatch functions and the classes in the keys,
+    and calls :meth:`reg.Dispatch.warm` for each dispatch function.
+    Dispatch functions and keys that cannot be imported anymore, for
+    instance because the code changed since they were recorded, are
+    skipped.
+
+    :param path: the path of the file.
+    :returns: the number of keys that were looked up.
+    :raises ValueError: if the file has another version.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != KEYS_VERSION:
+        raise ValueError("Unsupported keys file version: %r" % data.get("version"))
+    count = 0
+    for name, encoded_keys in data["dispatches"].items():
+        try:
+            dispatch = resolve_dotted_name(name)
+        except (ImportError, AttributeError):
+            continue
+        keys = []
+        for encoded_key in encoded_keys:
+            try:
+                keys.append(tuple([decode_key_item(item) for item in encoded_key]))
+            except (ImportError, AttributeError):
+                continue
+        dispatch.warm(keys)
+        count += len(keys)
+    return count
+
+
+def dotted_name(obj):
+    """The name under which a class or function can be imported.
+
+    :returns: the module and the qualified name, separated by a colon.
+    """
+    return "{}:{}".format(obj.__module__, obj.__qualname__)
+
+
+def resolve_dotted_name(name):
+    """Import the object named by :func:`dotted_name`.
+
+    :raises ImportError: if the module cannot be imported.
+    :raises AttributeError: if the module has no such object.
+    """
+    module_name, qualname = name.split(":")
+    obj = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def encode_key_item(item):
+    if isinstance(item, type):
+        name = dotted_name(item)
+        if "<locals>" in name:
+            raise ValueError("Class cannot be imported: %s" % name)
+        return {"class": name}
+    if item is None or isinstance(item, (str, int, float, bool)):
+        return item
+    raise ValueError("Cannot encode key item: %r" % (item,))
+
+
+def decode_key_item(item):
+    if isinstance(item, dict):
+        return resolve_dotted_name(item["class"])
+    return item